@@ -8,14 +8,17 @@ y conecta los botones a la lógica del plugin.
 
 import os
 import csv
+import math
 
+import numpy as np
 from qgis.PyQt import QtWidgets, QtGui, QtCore, uic
 from qgis.core import (
     QgsProject,
     QgsRasterLayer,
     QgsApplication,
-    QgsMapRendererCustomPainterJob,
+    QgsCoordinateTransform,
     QgsRectangle,
+    QgsTask,
     QgsGeometry,
     QgsPointXY,
     QgsWkbTypes,
@@ -23,6 +26,52 @@ from qgis.core import (
 from qgis.gui import QgsMapTool, QgsRubberBand
 
 from .calculus import feature_matcher_cv
+from . import batch_panel
+from . import matches_viewer
+from . import preview_loader
+from . import qa_views
+from . import reference_renderer
+
+# Lado máximo (px) de la referencia que se lee para el matching
+REFERENCE_MAX_SIDE = 8192
+# transform_model de cada entrada de comboTransformModel (mismo orden que el .ui)
+TRANSFORM_MODELS_UI = ("homography", "affine", "similarity", "auto")
+# scale_policy de cada entrada de comboScalePolicy; 'gsd' usa el GSD de ambas imágenes
+# si se conoce y, si no, iguala el área en píxeles (ver working_scales)
+SCALE_POLICIES_UI = ("gsd", "area", "none")
+# Lado máximo (px) con el que se dibuja la composición de matches para la pestaña
+MATCHES_PREVIEW_MAX_SIDE = 2048
+
+
+def _draw_matches_preview(float_image, ref_image, params, result):
+    """Imagen de matches ya reducida, reutilizando KPs/matches de 'result'."""
+    return feature_matcher_cv.draw_matches(
+        float_image,
+        ref_image,
+        params,
+        max_draw=80,
+        annotate=True,
+        max_side=MATCHES_PREVIEW_MAX_SIDE,
+        result=result,
+    )
+
+
+def _reestimate_worker(task, session, float_image, ref_image, params):
+    """
+    Cuerpo del QgsTask de re-estimación (sin tocar widgets): ratio test + estimación
+    sobre la sesión guardada y dibujo de la previsualización de matches.
+    """
+    details = feature_matcher_cv.match_details(
+        float_image,
+        ref_image,
+        session=session,
+        return_result=True,
+        **params,
+    )
+    if task.isCanceled():
+        return None
+    vis = _draw_matches_preview(float_image, ref_image, params, details["result"])
+    return details, vis
 
 
 # ----------------------------------------------------------
@@ -212,14 +261,54 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
         # Construir la UI definida en main_window.ui
         self.setupUi(self)
 
-        # Para guardar los pixmaps originales
-        self._float_pixmap = None
-        self._ref_pixmap = None
+        # Previsualizaciones reducidas (preview_loader.PreviewPyramid) y sus cargas en curso
+        self._float_pyramid = None
+        self._ref_pyramid = None
+        self._preview_tasks = {}
+        self._previews = preview_loader.PreviewManager(self)
+        # Último dibujo de matches (el QImage de la pestaña lo referencia sin copia) y
+        # datos a resolución completa para el visor ampliable
+        self._matches_vis = None
+        self._matches_view_data = None
+        try:
+            self.labelMatchesPreview.installEventFilter(self)
+            self.labelMatchesPreview.setToolTip("Doble clic para ver los matches a resolución completa")
+        except AttributeError:
+            pass
+
+        # Sesión del último matching (features + knn) para re-estimar en vivo
+        self._session = None
+        self._session_images = None
+        self._session_params = None
+        self._reestimate_task = None
+        self._reestimate_seq = 0
+        self._reestimate_timer = QtCore.QTimer(self)
+        self._reestimate_timer.setSingleShot(True)
+        self._reestimate_timer.setInterval(250)
+        self._reestimate_timer.timeout.connect(self._reestimate)
+
+        # Vistas de control de calidad (residuos y cortina), generadas en segundo plano
+        self._qa_task = None
+        try:
+            self._swipe = qa_views.SwipeView(self.labelSideBySidePreview, self)
+            self.labelSideBySidePreview.setToolTip(
+                "Mueve el ratón: izquierda = flotante remuestreada, derecha = referencia"
+            )
+        except AttributeError:
+            self._swipe = None
         self._ref_layer = None
 
         # Para el motor CV
         self._ref_img_path = None      # ruta de la imagen usada como referencia
         self._ref_crs = None           # CRS de referencia
+        self._ref_geotransform = None  # geotransformación GDAL de la referencia (si se conoce)
+        self._render_cache = None      # caché en disco de AOIs renderizadas (lazy)
+        self._ref_image = None         # ReferenceImage (píxeles + georreferencia) ya cargada
+        self._ref_image_key = None     # qué referencia/ventana contiene _ref_image
+
+        # AOI dibujada en el canvas (limita la lectura de referencias raster)
+        self._aoi_rect = None
+        self._aoi_crs = None
 
         # Para herramienta de rectángulo en el canvas
         self._rect_tool = None
@@ -227,6 +316,7 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
 
         # Para resultados del matching
         self.current_homography = None   # matriz de transformación (3x3)
+        self.current_model = None        # modelo estimado: similarity / affine / homography
         self.current_gcps = []           # lista de puntos de control / matches
 
         # Ajustar proporciones del splitter si existe
@@ -259,6 +349,40 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
         except AttributeError:
             pass
 
+        # Botones de AOI (ventana de lectura de la referencia raster)
+        try:
+            self.btnDrawAOI.clicked.connect(self._on_draw_aoi_clicked)
+        except AttributeError:
+            pass
+
+        try:
+            self.btnClearAOI.clicked.connect(self._on_clear_aoi_clicked)
+        except AttributeError:
+            pass
+
+        # Panel de lotes (varias flotantes contra la referencia actual)
+        self._batch_panel = None
+        try:
+            self.btnBatch.clicked.connect(self._on_open_batch_panel)
+        except AttributeError:
+            pass
+
+        # Ajustes que sólo requieren re-estimar (ratio test / matcher / modelo)
+        try:
+            self.spinRatioTest.valueChanged.connect(self._schedule_reestimate)
+        except AttributeError:
+            pass
+
+        try:
+            self.comboMatcher.currentIndexChanged.connect(self._schedule_reestimate)
+        except AttributeError:
+            pass
+
+        try:
+            self.comboTransformModel.currentIndexChanged.connect(self._schedule_reestimate)
+        except AttributeError:
+            pass
+
         # Botón GET MATCHES >
         try:
             self.btnNextStep.clicked.connect(self.run_matching_from_ui)
@@ -316,19 +440,22 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
         except AttributeError:
             pass
 
-        pixmap = QtGui.QPixmap(file_path)
-        if pixmap.isNull():
-            QtWidgets.QMessageBox.warning(
-                self,
-                "Error al cargar imagen",
-                "No se ha podido cargar la imagen seleccionada:\n{}".format(
-                    file_path
-                ),
-            )
-            return
+        self._float_pyramid = None
+        try:
+            self.labelFloatPreview.clear()
+            self.labelFloatPreview.setText("Cargando previsualización...")
+        except AttributeError:
+            pass
+
+        self._start_preview_load("float", file_path)
 
-        self._float_pixmap = pixmap
-        self._update_float_preview()
+    def _on_open_batch_panel(self):
+        """Abre (o trae al frente) el panel de lotes; conserva su cola entre aperturas."""
+        if self._batch_panel is None:
+            self._batch_panel = batch_panel.BatchPanel(self)
+        self._batch_panel.show()
+        self._batch_panel.raise_()
+        self._batch_panel.activateWindow()
 
     # ------------------------------------------------------------------
     # LÓGICA DE LOS BOTONES - CAPA DE REFERENCIA
@@ -372,11 +499,13 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
 
     def _load_reference_pixmap_from_layer(self, layer: QgsRasterLayer):
         """
-        Intenta cargar un QPixmap a partir de la fuente de la capa raster
-        y guarda la ruta en _ref_img_path para el motor de matching.
+        Carga una previsualización reducida de la capa raster (sólo la ventana de la
+        AOI si hay una, vía GDAL y sus overviews) y guarda la ruta en _ref_img_path
+        para el motor de matching.
         """
-        self._ref_pixmap = None
+        self._ref_pyramid = None
         self._ref_img_path = None
+        self._ref_geotransform = None
 
         if not isinstance(layer, QgsRasterLayer) or not layer.isValid():
             return
@@ -392,9 +521,10 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
 
         source_path = source_path.strip('"')
 
-        pixmap = QtGui.QPixmap(source_path)
-        if pixmap.isNull():
+        if not os.path.exists(source_path):
+            self._cancel_preview_load("ref")
             try:
+                self.labelRefPreview.clear()
                 self.labelRefPreview.setText(
                     "(Sin previsualización: formato no soportado como imagen)"
                 )
@@ -402,8 +532,21 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
                 pass
             return
 
-        self._ref_pixmap = pixmap
         self._ref_img_path = source_path
+        try:
+            self.labelRefPreview.clear()
+            self.labelRefPreview.setText("Cargando previsualización...")
+        except AttributeError:
+            pass
+        self._start_preview_load("ref", source_path, bounds=self._layer_window_bounds(layer))
+
+        # Geotransformación desde los metadatos de la capa (sin releer el fichero)
+        ext = layer.extent()
+        if layer.width() > 0 and layer.height() > 0 and not ext.isEmpty():
+            self._ref_geotransform = (
+                ext.xMinimum(), ext.width() / layer.width(), 0.0,
+                ext.yMaximum(), 0.0, -ext.height() / layer.height(),
+            )
 
     # ------------------------------------------------------------------
     # LÓGICA DE LOS BOTONES - CARGAR REFERENCIA DESDE MAPA QGIS
@@ -480,10 +623,44 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
         except AttributeError:
             pass
 
+    def _target_ground_resolution(self, rect: QgsRectangle):
+        """
+        Resolución en terreno (unidades de mapa/px) para renderizar la AOI.
+
+        Si hay imagen flotante se busca un nº de píxeles similar al suyo (misma escala
+        de muestreo asumiendo huellas parecidas); si no, la resolución actual del canvas.
+        """
+        res = self._floating_matched_resolution(rect.width(), rect.height())
+        if res is not None:
+            return res
+        return self.iface.mapCanvas().mapUnitsPerPixel()
+
+    def _floating_matched_resolution(self, width, height):
+        """
+        Resolución (unidades/px) con la que una extensión width x height tendría tantos
+        píxeles como la imagen flotante, o None si no hay flotante.
+        """
+        float_path = ""
+        try:
+            float_path = self.editFloatingPath.text().strip()
+        except AttributeError:
+            pass
+
+        if float_path and os.path.exists(float_path):
+            size = QtGui.QImageReader(float_path).size()
+            if size.isValid() and size.width() > 0 and size.height() > 0:
+                return math.sqrt(
+                    (width * height) / float(size.width() * size.height())
+                )
+
+        return None
+
     def _render_reference_from_canvas(self, rect: QgsRectangle):
         """
-        Renderiza el mapa de QGIS en la extensión del rectángulo dado y
-        guarda el resultado como pixmap de referencia y PNG temporal.
+        Renderiza el mapa de QGIS en la extensión del rectángulo dado a una resolución
+        en terreno adecuada y guarda el resultado como GeoTIFF teselado (con
+        geotransformación y CRS) para el motor de matching. Los renders se reutilizan
+        desde la caché si la AOI, el CRS, la resolución y las capas/estilos coinciden.
         """
         if self.iface is None:
             return
@@ -492,23 +669,28 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
         if canvas is None:
             return
 
-        ms = canvas.mapSettings()
-        ms.setExtent(rect)
-
-        size = QtCore.QSize(512, 512)
-        ms.setOutputSize(size)
-
-        img = QtGui.QImage(size, QtGui.QImage.Format_ARGB32_Premultiplied)
-        img.fill(QtCore.Qt.transparent)
+        if self._render_cache is None:
+            self._render_cache = reference_renderer.RenderCache(
+                os.path.join(os.path.dirname(__file__), "tmp", "ref_cache")
+            )
 
-        painter = QtGui.QPainter(img)
-        job = QgsMapRendererCustomPainterJob(ms, painter)
-        job.start()
-        job.waitForFinished()
-        painter.end()
+        try:
+            result = reference_renderer.render_extent_cached(
+                self._render_cache,
+                canvas.mapSettings(),
+                rect,
+                target_res=self._target_ground_resolution(rect),
+            )
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(
+                self,
+                "Error al renderizar mapa",
+                f"No se ha podido renderizar la zona seleccionada del mapa:\n{e}",
+            )
+            return
 
-        pixmap = QtGui.QPixmap.fromImage(img)
-        if pixmap.isNull():
+        pyramid = preview_loader.PreviewPyramid(result["preview"])
+        if pyramid.isNull():
             QtWidgets.QMessageBox.warning(
                 self,
                 "Error al renderizar mapa",
@@ -516,85 +698,277 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
             )
             return
 
-        self._ref_pixmap = pixmap
+        self._cancel_preview_load("ref")
+        self._ref_pyramid = pyramid
         self._update_reference_preview()
 
-        # Guardar en fichero temporal para el motor de matching
-        tmp_dir = os.path.join(os.path.dirname(__file__), "tmp")
-        os.makedirs(tmp_dir, exist_ok=True)
-        tmp_path = os.path.join(tmp_dir, "ref_from_canvas_aoi.png")
-        pixmap.save(tmp_path, "PNG")
-        self._ref_img_path = tmp_path
+        self._ref_layer = None
+        self._ref_img_path = result["path"]
+        self._ref_geotransform = result["geotransform"]
 
         # CRS del canvas como referencia
         try:
-            self._ref_crs = self.iface.mapCanvas().mapSettings().destinationCrs()
+            self._ref_crs = canvas.mapSettings().destinationCrs()
         except Exception:
             pass
 
     # ------------------------------------------------------------------
-    # ACTUALIZACIÓN DE PREVISUALIZACIONES
+    # AOI: VENTANA DE LECTURA DE LA REFERENCIA RASTER
     # ------------------------------------------------------------------
-    def _update_float_preview(self):
-        """
-        Escala la imagen flotante al tamaño del QLabel labelFloatPreview.
-        """
-        if self._float_pixmap is None or self._float_pixmap.isNull():
+    def _on_draw_aoi_clicked(self):
+        """Activa la herramienta de rectángulo para definir la AOI (sin renderizar)."""
+        if self.iface is None or self.iface.mapCanvas() is None:
             return
 
+        canvas = self.iface.mapCanvas()
+        self._prev_map_tool = canvas.mapTool()
+        self._rect_tool = RectangleMapTool(canvas, self._on_aoi_rectangle_selected)
+        canvas.setMapTool(self._rect_tool)
+
         try:
-            label = self.labelFloatPreview
+            self.labelAOIStatus.setText("Dibuja un rectángulo en el mapa de QGIS para definir la AOI.")
         except AttributeError:
-            return
+            pass
 
-        if label.width() <= 0 or label.height() <= 0:
-            return
+    def _on_aoi_rectangle_selected(self, rect: QgsRectangle):
+        canvas = self.iface.mapCanvas()
+        try:
+            if self._prev_map_tool is not None:
+                canvas.setMapTool(self._prev_map_tool)
+        except Exception:
+            pass
+        self._prev_map_tool = None
+        self._rect_tool = None
 
-        scaled = self._float_pixmap.scaled(
-            label.size(),
-            QtCore.Qt.KeepAspectRatio,
-            QtCore.Qt.SmoothTransformation,
-        )
-        label.setPixmap(scaled)
-        label.setText("")
+        self._aoi_rect = QgsRectangle(rect)
+        self._aoi_crs = canvas.mapSettings().destinationCrs()
 
-    def _update_reference_preview(self):
-        """
-        Escala la imagen de referencia al tamaño del QLabel labelRefPreview.
-        """
-        if self._ref_pixmap is None or self._ref_pixmap.isNull():
-            return
+        try:
+            self.labelAOIStatus.setText("AOI definida: se leerá sólo esa zona de la referencia.")
+        except AttributeError:
+            pass
+
+        if self._ref_layer is not None:
+            self._load_reference_pixmap_from_layer(self._ref_layer)
+            self._update_reference_preview()
 
+    def _on_clear_aoi_clicked(self):
+        self._aoi_rect = None
+        self._aoi_crs = None
         try:
-            label = self.labelRefPreview
+            self.labelAOIStatus.setText("Sin AOI: se usará la referencia completa.")
         except AttributeError:
-            return
+            pass
 
-        if label.width() <= 0 or label.height() <= 0:
-            return
+        if self._ref_layer is not None:
+            self._load_reference_pixmap_from_layer(self._ref_layer)
+            self._update_reference_preview()
+
+    def _layer_window_bounds(self, layer):
+        """AOI en el CRS de la capa como (xmin, ymin, xmax, ymax), o None sin AOI."""
+        if self._aoi_rect is None:
+            return None
+        rect = self._aoi_rect
+        if self._aoi_crs is not None and self._aoi_crs != layer.crs():
+            xform = QgsCoordinateTransform(self._aoi_crs, layer.crs(), QgsProject.instance())
+            rect = xform.transformBoundingBox(rect)
+        return (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+
+    def _reference_image(self):
+        """
+        Devuelve la referencia actual como feature_matcher_cv.ReferenceImage
+        (píxeles + geotransformación + CRS), reutilizando la ya cargada si no ha cambiado.
+
+        Para capas raster sólo se lee la ventana de la AOI (o la capa completa si no hay),
+        a la resolución equivalente a la imagen flotante y con lado <= REFERENCE_MAX_SIDE.
+        """
+        layer = self._ref_layer
+        if layer is not None:
+            bounds = self._layer_window_bounds(layer)
+            if bounds is None:
+                ext = layer.extent()
+                width, height = ext.width(), ext.height()
+            else:
+                width, height = bounds[2] - bounds[0], bounds[3] - bounds[1]
+            target_res = self._floating_matched_resolution(width, height)
+            key = ("window", self._ref_img_path, bounds, target_res)
+        else:
+            key = ("file", self._ref_img_path, self._ref_geotransform)
+
+        if self._ref_image is not None and self._ref_image_key == key:
+            return self._ref_image
+
+        if layer is not None:
+            self._ref_image = feature_matcher_cv.read_reference_window(
+                self._ref_img_path,
+                bounds,
+                target_res=target_res,
+                max_side=REFERENCE_MAX_SIDE,
+            )
+        else:
+            crs = None
+            try:
+                if self._ref_crs is not None and self._ref_crs.isValid():
+                    crs = self._ref_crs.toWkt()
+            except AttributeError:
+                pass
 
-        scaled = self._ref_pixmap.scaled(
-            label.size(),
-            QtCore.Qt.KeepAspectRatio,
-            QtCore.Qt.SmoothTransformation,
+            self._ref_image = feature_matcher_cv.read_reference(
+                self._ref_img_path,
+                geotransform=self._ref_geotransform,
+                crs=crs,
+            )
+        self._ref_image_key = key
+        return self._ref_image
+
+    # ------------------------------------------------------------------
+    # CARGA DIFERIDA DE PREVISUALIZACIONES
+    # ------------------------------------------------------------------
+    def _start_preview_load(self, slot, path, bounds=None):
+        """
+        Lanza en segundo plano la lectura reducida de 'path' para la previsualización
+        'slot' ("float" o "ref"), cancelando la carga anterior de ese mismo hueco.
+        """
+        self._cancel_preview_load(slot)
+        task = preview_loader.PreviewLoadTask(
+            f"Autogeoreferencer: previsualización {os.path.basename(path)}",
+            path,
+            lambda t, slot=slot: self._on_preview_loaded(slot, t),
+            bounds=bounds,
         )
-        label.setPixmap(scaled)
-        label.setText("")
+        self._preview_tasks[slot] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _cancel_preview_load(self, slot):
+        task = self._preview_tasks.pop(slot, None)
+        if task is not None:
+            try:
+                task.cancel()
+            except RuntimeError:
+                # El QgsTask ya terminó y fue liberado por el gestor
+                pass
+
+    def _on_preview_loaded(self, slot, task):
+        # Ignorar resultados de cargas reemplazadas por otra posterior
+        if self._preview_tasks.get(slot) is not task:
+            return
+        del self._preview_tasks[slot]
+
+        if slot == "float":
+            if task.pyramid is None:
+                try:
+                    self.labelFloatPreview.setText("")
+                except AttributeError:
+                    pass
+                QtWidgets.QMessageBox.warning(
+                    self,
+                    "Error al cargar imagen",
+                    "No se ha podido cargar la imagen seleccionada:\n{}".format(
+                        task.path
+                    ),
+                )
+                return
+            self._float_pyramid = task.pyramid
+            self._update_float_preview()
+        else:
+            if task.pyramid is None:
+                try:
+                    self.labelRefPreview.setText(
+                        "(Sin previsualización: formato no soportado como imagen)"
+                    )
+                except AttributeError:
+                    pass
+                return
+            self._ref_pyramid = task.pyramid
+            self._update_reference_preview()
 
     # ------------------------------------------------------------------
-    # EVENTOS
+    # ACTUALIZACIÓN DE PREVISUALIZACIONES
     # ------------------------------------------------------------------
-    def resizeEvent(self, event):
+    # (el reescalado al cambiar de tamaño lo hace self._previews con antirrebote y caché)
+    def _update_float_preview(self):
         """
-        Reescala las previsualizaciones al cambiar el tamaño de la ventana.
+        Muestra la imagen flotante en el QLabel labelFloatPreview.
         """
-        super().resizeEvent(event)
-        self._update_float_preview()
-        self._update_reference_preview()
+        if self._float_pyramid is None:
+            return
+        try:
+            self._previews.set_source(self.labelFloatPreview, self._float_pyramid)
+        except AttributeError:
+            pass
+
+    def _update_reference_preview(self):
+        """
+        Muestra la imagen de referencia en el QLabel labelRefPreview.
+        """
+        if self._ref_pyramid is None:
+            return
+        try:
+            self._previews.set_source(self.labelRefPreview, self._ref_pyramid)
+        except AttributeError:
+            pass
 
     # ------------------------------------------------------------------
     # MATCHING: MOTOR CV + ACTUALIZACIÓN UI
     # ------------------------------------------------------------------
+    def _matching_params_from_ui(self):
+        """Parámetros de match_details/draw_matches según los controles del diálogo."""
+        try:
+            detector = self.comboDetector.currentText().strip()
+        except AttributeError:
+            detector = "ORB"
+
+        try:
+            matcher_ui = self.comboMatcher.currentText().strip().lower()
+        except AttributeError:
+            matcher_ui = "auto"
+
+        if "flann" in matcher_ui:
+            matcher_type = "flann"
+        elif "bf" in matcher_ui or "brute" in matcher_ui:
+            matcher_type = "bf"
+        else:
+            matcher_type = "auto"
+
+        # Corregido: spinRatioTest (como en el .ui)
+        try:
+            ratio_thresh = float(self.spinRatioTest.value())
+        except AttributeError:
+            ratio_thresh = 0.75
+
+        # Presupuesto de keypoints por imagen (selección uniforme en rejilla)
+        try:
+            max_keypoints = int(self.spinMaxFeatures.value())
+        except AttributeError:
+            max_keypoints = None
+
+        # Modelo de transformación (orden de comboTransformModel); escaneos y ortofotos
+        # casi cenitales suelen bastar con similitud/afín
+        try:
+            transform_model = TRANSFORM_MODELS_UI[self.comboTransformModel.currentIndex()]
+        except (AttributeError, IndexError):
+            transform_model = "homography"
+
+        ransac_thresh = 3.0
+        alpha_rmse = 0.15
+        # Detectar a una escala común: la AOI renderizada suele tener muchos menos
+        # píxeles que la imagen flotante
+        try:
+            scale_policy = SCALE_POLICIES_UI[self.comboScalePolicy.currentIndex()]
+        except (AttributeError, IndexError):
+            scale_policy = "gsd"
+
+        return {
+            "detector": detector,
+            "matcher_type": matcher_type,
+            "ratio_thresh": ratio_thresh,
+            "ransac_thresh": ransac_thresh,
+            "alpha_rmse": alpha_rmse,
+            "scale_policy": scale_policy,
+            "max_keypoints": max_keypoints,
+            "transform_model": transform_model,
+        }
+
     def run_matching_from_ui(self):
         """
         Ejecuta el motor de matching (feature_matcher_cv) usando:
@@ -629,32 +1003,7 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
             )
             return
 
-        # Parámetros desde la UI
-        try:
-            detector = self.comboDetector.currentText().strip()
-        except AttributeError:
-            detector = "ORB"
-
-        try:
-            matcher_ui = self.comboMatcher.currentText().strip().lower()
-        except AttributeError:
-            matcher_ui = "auto"
-
-        if "flann" in matcher_ui:
-            matcher_type = "flann"
-        elif "bf" in matcher_ui or "brute" in matcher_ui:
-            matcher_type = "bf"
-        else:
-            matcher_type = "auto"
-
-        # Corregido: spinRatioTest (como en el .ui)
-        try:
-            ratio_thresh = float(self.spinRatioTest.value())
-        except AttributeError:
-            ratio_thresh = 0.75
-
-        ransac_thresh = 3.0
-        alpha_rmse = 0.15
+        params = self._matching_params_from_ui()
 
         # Barra de progreso y estado
         try:
@@ -664,15 +1013,26 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
             pass
 
         # Llamar al motor para obtener detalles (incluye RMSE y, si está implementado, homografía y GCPs)
+        # La sesión guarda features y knn para re-estimar al ajustar ratio/matcher
+        self._session = None
         try:
+            float_image = feature_matcher_cv.read_reference(float_path)
+            ref_image = self._reference_image()
+            session = feature_matcher_cv.MatchSession(
+                float_image.pixels,
+                ref_image.pixels,
+                params["detector"],
+                scale_policy=params["scale_policy"],
+                gsd1=float_image.gsd,
+                gsd2=ref_image.gsd,
+                max_keypoints=params["max_keypoints"],
+            )
             details = feature_matcher_cv.match_details(
-                float_path,
-                self._ref_img_path,
-                detector=detector,
-                matcher_type=matcher_type,
-                ratio_thresh=ratio_thresh,
-                ransac_thresh=ransac_thresh,
-                alpha_rmse=alpha_rmse,
+                float_image,
+                ref_image,
+                session=session,
+                return_result=True,
+                **params,
             )
         except Exception as e:
             QtWidgets.QMessageBox.critical(
@@ -687,6 +1047,31 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
                 pass
             return
 
+        self._session = session
+        self._session_images = (float_image, ref_image)
+        self._session_params = params
+
+        self._show_match_results(float_image, ref_image, details, params)
+
+        # Poner la pestaña de matches al frente
+        try:
+            idx = self.tabViews.indexOf(self.tabMatches)
+            if idx != -1:
+                self.tabViews.setCurrentIndex(idx)
+        except Exception:
+            pass
+
+        # Actualizar barra de progreso
+        try:
+            self.progressBar.setValue(100)
+        except Exception:
+            pass
+
+    def _show_match_results(self, float_image, ref_image, details, params, vis=None):
+        """
+        Muestra un resultado de match_details(..., return_result=True): matriz, RMSE,
+        GCPs, imagen de matches (vis, o se dibuja aquí) y vistas de residuos/cortina.
+        """
         # Extraer RMSE
         rmse = details.get("rmse", None)
 
@@ -708,6 +1093,7 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
 
         # Guardar en atributos
         self.current_homography = H
+        self.current_model = details.get("model")
         # Forzamos lista para evitar problemas si viene como None
         self.current_gcps = list(gcps) if gcps else []
 
@@ -726,53 +1112,34 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
             except Exception:
                 pass
 
-        # Dibujar imagen de matches con el motor
-        params_for_draw = {
-            "detector": detector,
-            "matcher_type": matcher_type,
-            "ratio_thresh": ratio_thresh,
-            "ransac_thresh": ransac_thresh,
-            "alpha_rmse": alpha_rmse,
-        }
-
-        try:
-            vis = feature_matcher_cv.draw_matches(
-                float_path,
-                self._ref_img_path,
-                params_for_draw,
-                max_draw=80,
-                annotate=True,
-            )
-        except Exception as e:
-            QtWidgets.QMessageBox.warning(
-                self,
-                "Error al dibujar matches",
-                f"Se han calculado los matches, pero no se pudo generar la imagen de visualización:\n{e}",
-            )
-            # Aun así actualizamos la barra de progreso
+        # Dibujar imagen de matches con el motor (si no viene ya dibujada)
+        result = details.pop("result")
+        if vis is None:
             try:
-                self.progressBar.setValue(100)
-            except Exception:
-                pass
-            return
+                vis = _draw_matches_preview(float_image, ref_image, params, result)
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(
+                    self,
+                    "Error al dibujar matches",
+                    f"Se han calculado los matches, pero no se pudo generar la imagen de visualización:\n{e}",
+                )
+                return
 
-        # Convertir imagen OpenCV (BGR) a QPixmap y mostrar en labelMatchesPreview
+        # Envolver la imagen OpenCV (BGR) en un QImage sin copiarla (self._matches_vis
+        # mantiene vivo el buffer) y retenerla en labelMatchesPreview
         try:
+            self._matches_vis = vis
+            self._matches_view_data = (
+                float_image.pixels,
+                ref_image.pixels,
+                *feature_matcher_cv.matched_points(result),
+            )
             h, w = vis.shape[:2]
-            bytes_per_line = 3 * w
             qimg = QtGui.QImage(
-                vis.data, w, h, bytes_per_line, QtGui.QImage.Format_BGR888
+                vis.data, w, h, vis.strides[0], QtGui.QImage.Format_BGR888
             )
-            pix = QtGui.QPixmap.fromImage(qimg)
 
-            label = self.labelMatchesPreview
-            scaled = pix.scaled(
-                label.size(),
-                QtCore.Qt.KeepAspectRatio,
-                QtCore.Qt.SmoothTransformation,
-            )
-            label.setPixmap(scaled)
-            label.setText("")
+            self._previews.set_source(self.labelMatchesPreview, qimg)
         except Exception as e:
             QtWidgets.QMessageBox.warning(
                 self,
@@ -780,19 +1147,153 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
                 f"No se pudo mostrar la imagen de matches en la pestaña 'Matches':\n{e}",
             )
 
-        # Poner la pestaña de matches al frente
+        # Residuos y cortina (en segundo plano, con refinado progresivo)
+        self._start_qa_views(float_image, ref_image, result, details)
+
+    # ------------------------------------------------------------------
+    # RE-ESTIMACIÓN EN VIVO AL AJUSTAR RATIO / MATCHER
+    # ------------------------------------------------------------------
+    def _schedule_reestimate(self, *args):
+        """Agrupa cambios seguidos de los controles antes de re-estimar."""
+        if self._session is not None:
+            self._reestimate_timer.start()
+
+    def _reestimate(self):
+        """
+        Repite sólo ratio test, estimación y dibujo sobre la sesión del último
+        matching, en segundo plano. Si cambian parámetros de detección hay que
+        volver a pulsar el botón de matching.
+        """
+        if self._session is None:
+            return
+
+        params = self._matching_params_from_ui()
+        detection_keys = ("detector", "scale_policy", "max_keypoints")
+        if any(params[k] != self._session_params[k] for k in detection_keys):
+            try:
+                self.label_status_value.setText(
+                    "Parámetros de detección cambiados: vuelve a calcular los matches."
+                )
+            except AttributeError:
+                pass
+            return
+
+        self._reestimate_seq += 1
+        seq = self._reestimate_seq
+        float_image, ref_image = self._session_images
+        task = QgsTask.fromFunction(
+            "Autogeoreferencer: re-estimación",
+            _reestimate_worker,
+            self._session, float_image, ref_image, params,
+            on_finished=lambda exception, value=None, seq=seq, params=params:
+                self._on_reestimate_finished(seq, params, exception, value),
+        )
+        self._reestimate_task = task
         try:
-            idx = self.tabViews.indexOf(self.tabMatches)
-            if idx != -1:
-                self.tabViews.setCurrentIndex(idx)
-        except Exception:
+            self.label_status_value.setText("Re-estimando...")
+        except AttributeError:
             pass
+        QgsApplication.taskManager().addTask(task)
 
-        # Actualizar barra de progreso
+    def _on_reestimate_finished(self, seq, params, exception, value):
+        # Ignorar resultados superados por un ajuste posterior
+        if seq != self._reestimate_seq:
+            return
+        self._reestimate_task = None
+        if exception is not None or value is None:
+            try:
+                self.label_status_value.setText(f"Error al re-estimar: {exception}")
+            except AttributeError:
+                pass
+            return
+
+        details, vis = value
+        self._session_params = params
+        float_image, ref_image = self._session_images
+        self._show_match_results(float_image, ref_image, details, params, vis=vis)
+
+    # ------------------------------------------------------------------
+    # VISTAS DE CONTROL DE CALIDAD: RESIDUOS Y CORTINA
+    # ------------------------------------------------------------------
+    def _start_qa_views(self, float_image, ref_image, result, details):
+        """
+        Lanza la generación de las vistas de residuos/cortina del último resultado,
+        cancelando la anterior si sigue en curso.
+        """
+        if self._qa_task is not None:
+            try:
+                self._qa_task.cancel()
+            except RuntimeError:
+                pass
+            self._qa_task = None
+
+        residuals = np.asarray(details.get("residuals") or [], dtype=np.float64).reshape(-1, 2)
         try:
-            self.progressBar.setValue(100)
-        except Exception:
+            if result.H is None or len(residuals) == 0:
+                self.labelResidualsInfo.setText("Sin transformación: no hay residuos que mostrar.")
+            else:
+                err = np.linalg.norm(residuals, axis=1)
+                self.labelResidualsInfo.setText(
+                    "GCPs: {}  |  RMSE: {:.3f} px  |  p90: {:.3f} px  |  Máx: {:.3f} px".format(
+                        len(err), float(np.sqrt((err ** 2).mean())),
+                        float(np.percentile(err, 90)), float(err.max()),
+                    )
+                )
+        except AttributeError:
+            pass
+
+        if result.H is None:
+            try:
+                self._previews.clear(self.labelResidualsPreview)
+            except AttributeError:
+                pass
+            if self._swipe is not None:
+                self._swipe.clear()
+            return
+
+        task = qa_views.QAViewsTask(
+            float_image.pixels,
+            ref_image.pixels,
+            result.H,
+            details.get("points_dst") or [],
+            residuals,
+        )
+        task.levelReady.connect(lambda views, t=task: self._on_qa_level_ready(t, views))
+        self._qa_task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _on_qa_level_ready(self, task, views):
+        # Ignorar niveles de un resultado anterior
+        if task is not self._qa_task:
+            return
+        try:
+            self._previews.set_source(self.labelResidualsPreview, views["residuals"])
+        except AttributeError:
             pass
+        if self._swipe is not None:
+            self._swipe.set_layers(views["reference"], views["warped"])
+
+    # ------------------------------------------------------------------
+    # VISOR DE MATCHES A RESOLUCIÓN COMPLETA
+    # ------------------------------------------------------------------
+    def eventFilter(self, obj, event):
+        try:
+            is_matches = obj is self.labelMatchesPreview
+        except AttributeError:
+            is_matches = False
+        if is_matches and event.type() == QtCore.QEvent.MouseButtonDblClick:
+            self._open_matches_viewer()
+            return True
+        return super().eventFilter(obj, event)
+
+    def _open_matches_viewer(self):
+        """Abre el visor ampliable; sólo dibuja la zona visible a la escala de pantalla."""
+        if self._matches_view_data is None:
+            return
+        img1, img2, pts1, pts2 = self._matches_view_data
+        viewer = matches_viewer.MatchesZoomDialog(img1, img2, pts1, pts2, self)
+        viewer.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        viewer.show()
 
     # ------------------------------------------------------------------
     # MATRIZ DE TRANSFORMACIÓN: ACTUALIZAR UI
@@ -806,6 +1307,8 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
         """
         # Matriz
         text = self._format_matrix_for_label(H)
+        if H is not None and self.current_model:
+            text = f"Modelo: {self.current_model}\n{text}"
         try:
             self.label_status_value.setText(text)
         except Exception:
@@ -901,6 +1404,9 @@ class MainWindow(QtWidgets.QMainWindow, FORM_CLASS):
 
         try:
             lines = []
+            # Línea de comentario con el modelo (numpy.loadtxt y similares la ignoran)
+            if self.current_model:
+                lines.append(f"# model: {self.current_model}")
             for row in H:
                 # Si row no es iterable, escribir tal cual
                 try:
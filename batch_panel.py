@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Procesado por lotes: varias imágenes flotantes contra la referencia actual.
+
+Cada imagen es un trabajo (QgsTask) de una cola con límite de concurrencia. Las
+features de la referencia se calculan una vez (feature_matcher_cv.FeatureCache) y se
+comparten entre trabajos. El panel muestra estado, inliers y RMSE por imagen y permite
+cancelar o reintentar trabajos sueltos y exportar los GCPs de los terminados.
+"""
+
+import csv
+import json
+import os
+
+from qgis.PyQt import QtCore, QtWidgets
+from qgis.core import QgsApplication, QgsTask
+
+from .calculus import feature_matcher_cv
+
+# Extensiones que se recogen al añadir una carpeta
+BATCH_IMAGE_EXT = (".tif", ".tiff", ".jpg", ".jpeg", ".png", ".bmp")
+DEFAULT_CONCURRENCY = 2
+
+STATUS_QUEUED = "En cola"
+STATUS_RUNNING = "Ejecutando"
+STATUS_DONE = "Hecho"
+STATUS_FAILED = "Error"
+STATUS_CANCELLED = "Cancelado"
+
+
+class BatchMatchTask(QgsTask):
+    """Matching de una imagen flotante contra la referencia del lote."""
+
+    def __init__(self, path, ref_image, ref_cache, params, on_done):
+        super().__init__(f"Autogeoreferencer: {os.path.basename(path)}", QgsTask.CanCancel)
+        self.path = path
+        self.ref_image = ref_image
+        self.ref_cache = ref_cache
+        self.params = params
+        self.details = None
+        self.error = None
+        self._on_done = on_done
+
+    def run(self):
+        try:
+            float_image = feature_matcher_cv.read_reference(self.path)
+            if self.isCanceled():
+                return False
+            session = feature_matcher_cv.MatchSession(
+                float_image.pixels,
+                self.ref_image.pixels,
+                self.params["detector"],
+                scale_policy=self.params.get("scale_policy", "none"),
+                gsd1=float_image.gsd,
+                gsd2=self.ref_image.gsd,
+                max_keypoints=self.params.get("max_keypoints"),
+                ref_cache=self.ref_cache,
+            )
+            if self.isCanceled():
+                return False
+            self.details = feature_matcher_cv.match_details(
+                float_image, self.ref_image, session=session, **self.params
+            )
+        except Exception as e:
+            self.error = str(e)
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        self._on_done(self, result)
+
+
+class BatchJob:
+    """Estado de un trabajo del lote (una fila de la tabla)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.status = STATUS_QUEUED
+        self.task = None
+        self.details = None
+        self.error = None
+
+
+class BatchPanel(QtWidgets.QDialog):
+    """
+    Cola de imágenes flotantes contra la referencia de 'owner' (el diálogo principal),
+    con los parámetros de matching que tenga en ese momento.
+    """
+
+    COLUMNS = ("Imagen", "Estado", "Modelo", "Inliers", "RMSE")
+
+    def __init__(self, owner, parent=None):
+        super().__init__(parent or owner)
+        self.setWindowTitle("Autogeoreferencer - Lote")
+        self.resize(760, 420)
+        self._owner = owner
+        self._jobs = []
+        self._ref_image = None
+        self._ref_cache = None
+        self._params = None
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+
+        self.btnAddFiles = QtWidgets.QPushButton("Añadir imágenes...", self)
+        self.btnAddFolder = QtWidgets.QPushButton("Añadir carpeta...", self)
+        self.btnRemove = QtWidgets.QPushButton("Quitar", self)
+        self.btnStart = QtWidgets.QPushButton("Iniciar", self)
+        self.btnCancel = QtWidgets.QPushButton("Cancelar selección", self)
+        self.btnRetry = QtWidgets.QPushButton("Reintentar selección", self)
+        self.btnExport = QtWidgets.QPushButton("Exportar GCPs...", self)
+        self.spinConcurrency = QtWidgets.QSpinBox(self)
+        self.spinConcurrency.setRange(1, max(1, QtCore.QThread.idealThreadCount()))
+        self.spinConcurrency.setValue(min(DEFAULT_CONCURRENCY, self.spinConcurrency.maximum()))
+        self.labelSummary = QtWidgets.QLabel("", self)
+
+        top = QtWidgets.QHBoxLayout()
+        for w in (self.btnAddFiles, self.btnAddFolder, self.btnRemove):
+            top.addWidget(w)
+        top.addStretch(1)
+        top.addWidget(QtWidgets.QLabel("Trabajos simultáneos:", self))
+        top.addWidget(self.spinConcurrency)
+
+        bottom = QtWidgets.QHBoxLayout()
+        for w in (self.btnStart, self.btnCancel, self.btnRetry, self.btnExport):
+            bottom.addWidget(w)
+        bottom.addStretch(1)
+        bottom.addWidget(self.labelSummary)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(top)
+        layout.addWidget(self.table)
+        layout.addLayout(bottom)
+
+        self.btnAddFiles.clicked.connect(self._on_add_files)
+        self.btnAddFolder.clicked.connect(self._on_add_folder)
+        self.btnRemove.clicked.connect(self._on_remove)
+        self.btnStart.clicked.connect(self._on_start)
+        self.btnCancel.clicked.connect(self._on_cancel)
+        self.btnRetry.clicked.connect(self._on_retry)
+        self.btnExport.clicked.connect(self._on_export)
+        self.spinConcurrency.valueChanged.connect(self._pump)
+
+    # ------------------------------------------------------------------
+    # COLA
+    # ------------------------------------------------------------------
+    def add_paths(self, paths):
+        known = {job.path for job in self._jobs}
+        for path in paths:
+            if path in known:
+                continue
+            job = BatchJob(path)
+            self._jobs.append(job)
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+            for col in range(len(self.COLUMNS)):
+                self.table.setItem(row, col, QtWidgets.QTableWidgetItem(""))
+            self.table.item(row, 0).setText(os.path.basename(path))
+            self.table.item(row, 0).setToolTip(path)
+            self._update_row(job)
+        self._update_summary()
+
+    def _selected_jobs(self):
+        rows = sorted({idx.row() for idx in self.table.selectionModel().selectedRows()})
+        return [self._jobs[r] for r in rows]
+
+    def _running(self):
+        return [job for job in self._jobs if job.status == STATUS_RUNNING]
+
+    def _pump(self, *args):
+        """Arranca trabajos en cola hasta llenar el límite de concurrencia."""
+        if self._ref_image is None:
+            return
+        free = self.spinConcurrency.value() - len(self._running())
+        for job in self._jobs:
+            if free <= 0:
+                break
+            if job.status != STATUS_QUEUED:
+                continue
+            job.task = BatchMatchTask(job.path, self._ref_image, self._ref_cache,
+                                      self._params, self._on_task_done)
+            job.status = STATUS_RUNNING
+            job.error = None
+            self._update_row(job)
+            QgsApplication.taskManager().addTask(job.task)
+            free -= 1
+        self._update_summary()
+
+    def _on_task_done(self, task, ok):
+        job = next((j for j in self._jobs if j.task is task), None)
+        if job is None:
+            return
+        job.task = None
+        if ok:
+            job.status = STATUS_DONE
+            job.details = task.details
+        elif task.isCanceled() or job.status == STATUS_CANCELLED:
+            job.status = STATUS_CANCELLED
+        else:
+            job.status = STATUS_FAILED
+            job.error = task.error
+        self._update_row(job)
+        self._pump()
+
+    # ------------------------------------------------------------------
+    # BOTONES
+    # ------------------------------------------------------------------
+    def _on_add_files(self):
+        paths, _ = QtWidgets.QFileDialog.getOpenFileNames(
+            self,
+            "Añadir imágenes al lote",
+            "",
+            "Imágenes (*.tif *.tiff *.jpg *.jpeg *.png *.bmp);;Todos los archivos (*)",
+        )
+        self.add_paths(paths)
+
+    def _on_add_folder(self):
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Añadir carpeta al lote")
+        if not folder:
+            return
+        self.add_paths(
+            os.path.join(folder, name)
+            for name in sorted(os.listdir(folder))
+            if name.lower().endswith(BATCH_IMAGE_EXT)
+        )
+
+    def _on_remove(self):
+        for job in self._selected_jobs():
+            if job.status == STATUS_RUNNING:
+                continue
+            row = self._jobs.index(job)
+            self._jobs.pop(row)
+            self.table.removeRow(row)
+        self._update_summary()
+
+    def _on_start(self):
+        """Fija referencia y parámetros actuales del diálogo principal y lanza la cola."""
+        try:
+            ref_image = self._owner._reference_image()
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(
+                self,
+                "Referencia no disponible",
+                f"Debes seleccionar una capa de referencia o definir una AOI desde el mapa de QGIS.\n{e}",
+            )
+            return
+
+        # Reutilizar features de la referencia mientras no cambie
+        if self._ref_cache is None or self._ref_cache.image is not ref_image.pixels:
+            self._ref_cache = feature_matcher_cv.FeatureCache(ref_image.pixels)
+        self._ref_image = ref_image
+        self._params = self._owner._matching_params_from_ui()
+        self._pump()
+
+    def _on_cancel(self):
+        for job in self._selected_jobs():
+            if job.status == STATUS_QUEUED:
+                job.status = STATUS_CANCELLED
+                self._update_row(job)
+            elif job.status == STATUS_RUNNING and job.task is not None:
+                # El estado final llega en _on_task_done
+                job.task.cancel()
+        self._update_summary()
+
+    def _on_retry(self):
+        for job in self._selected_jobs():
+            if job.status in (STATUS_FAILED, STATUS_CANCELLED):
+                job.status = STATUS_QUEUED
+                job.details = job.error = None
+                self._update_row(job)
+        self._pump()
+
+    def _on_export(self):
+        """Un CSV de GCPs por imagen terminada + resumen del lote en JSON."""
+        done = [job for job in self._jobs if job.status == STATUS_DONE and job.details]
+        if not done:
+            QtWidgets.QMessageBox.information(self, "Exportar GCPs", "No hay trabajos terminados.")
+            return
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Carpeta de salida")
+        if not folder:
+            return
+
+        summary = []
+        for job in done:
+            stem = os.path.splitext(os.path.basename(job.path))[0]
+            gcps = job.details.get("gcps") or []
+            if gcps:
+                with open(os.path.join(folder, f"{stem}_gcps.csv"), "w", newline="", encoding="utf-8") as f:
+                    writer = csv.DictWriter(f, fieldnames=list(gcps[0].keys()))
+                    writer.writeheader()
+                    writer.writerows(gcps)
+            summary.append({
+                "image": job.path,
+                "model": job.details.get("model"),
+                "H": job.details.get("H"),
+                "inliers": job.details.get("inliers"),
+                "rmse": job.details.get("rmse"),
+                "gcps": len(gcps),
+                "crs": job.details.get("crs"),
+            })
+        with open(os.path.join(folder, "batch_summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"params": self._params, "results": summary}, f, ensure_ascii=False, indent=2)
+
+    # ------------------------------------------------------------------
+    # TABLA
+    # ------------------------------------------------------------------
+    def _update_row(self, job):
+        row = self._jobs.index(job)
+        d = job.details or {}
+        rmse = d.get("rmse")
+        self.table.item(row, 1).setText(job.status)
+        self.table.item(row, 1).setToolTip(job.error or "")
+        self.table.item(row, 2).setText(d.get("model") or "")
+        self.table.item(row, 3).setText("" if not d else str(d.get("inliers", "")))
+        self.table.item(row, 4).setText("" if rmse is None else f"{rmse:.3f}")
+
+    def _update_summary(self):
+        counts = {}
+        for job in self._jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        self.labelSummary.setText("  |  ".join(f"{k}: {v}" for k, v in counts.items()))
+
+    def closeEvent(self, event):
+        # Cerrar el panel no cancela lo que ya está en marcha, sí lo pendiente
+        for job in self._jobs:
+            if job.status == STATUS_QUEUED:
+                job.status = STATUS_CANCELLED
+                self._update_row(job)
+        super().closeEvent(event)
@@ -0,0 +1,540 @@
+# file: benchmark.py
+# -*- coding: utf-8 -*-
+"""
+Benchmark reproducible del motor de matching sobre pares sintéticos con verdad terreno.
+
+Genera pares paramétricos (lado de 512 a 16384 px; rotación, escala, perspectiva y
+ruido), guarda las imágenes y su homografía real (groundtruth.json) y, para cada
+combinación detector/matcher/estimador, mide:
+  - tiempo por etapa: read, detect1, detect2, build_index, knn, ratio, estimate, rmse
+  - pico de memoria (RSS) del proceso que ejecuta el caso
+  - error de esquinas frente a la homografía real (media y máximo, px de img2)
+  - throughput (pares/s y megapíxeles/s)
+  - memoria de descriptores y, si se comparan varias representaciones (--storages,
+    --pca), ahorro y cambio de inliers/error frente a float32
+y vuelca un informe JSON apto para seguimiento de regresiones.
+
+Puerta de regresión (--save-baseline / --compare): un conjunto fijo de cargas
+(match_and_score por escenario y detector con los valores por defecto del motor,
+FeatureMatcherOptimizer.fit con un grid pequeño y la exportación
+save_homographies_json) se repite N veces; se guarda la mediana como línea base o se
+compara con una anterior y el proceso sale con código 1 si alguna carga es más lenta
+que la tolerancia o su error de esquinas empeora.
+
+Cada caso se ejecuta por defecto en un proceso nuevo (spawn) para que el pico de RSS
+sea el del propio caso y no el acumulado.
+
+CLI
+---
+python benchmark.py --suite quick --out /tmp/bench.json
+python benchmark.py --suite full --detectors SIFT ORB --methods ransac prosac \\
+    --data-dir /tmp/bench_data --out /tmp/bench_full.json
+python benchmark.py --suite quick --detectors SIFT ORB --matchers bf flann blocked --out /tmp/bench_knn.json
+python benchmark.py --suite quick --detectors SIFT --storages float32 float16 uint8 --pca 0 64 \\
+    --out /tmp/bench_desc.json
+python benchmark.py --save-baseline baseline.json --repeat 5
+python benchmark.py --compare baseline.json --repeat 5 --tolerance 0.15 --out /tmp/gate.json
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    from . import feature_matcher_cv as fm
+except ImportError:
+    import feature_matcher_cv as fm
+
+
+# --------------------------- Escenarios ---------------------------
+
+# perspective: desplazamiento máximo de cada esquina, como fracción del lado
+SUITES: Dict[str, List[Dict]] = {
+    "quick": [
+        {"name": "s512_easy", "size": 512, "rotation": 5.0, "scale": 1.0, "perspective": 0.01, "noise": 2.0},
+        {"name": "s1024_rot30", "size": 1024, "rotation": 30.0, "scale": 0.9, "perspective": 0.0, "noise": 2.0},
+        {"name": "s1024_persp", "size": 1024, "rotation": 10.0, "scale": 0.8, "perspective": 0.05, "noise": 5.0},
+    ],
+    "full": [
+        {"name": "s512_easy", "size": 512, "rotation": 5.0, "scale": 1.0, "perspective": 0.01, "noise": 2.0},
+        {"name": "s512_hard", "size": 512, "rotation": 45.0, "scale": 0.6, "perspective": 0.08, "noise": 10.0},
+        {"name": "s2048_mid", "size": 2048, "rotation": 15.0, "scale": 0.85, "perspective": 0.03, "noise": 4.0},
+        {"name": "s4096_mid", "size": 4096, "rotation": 15.0, "scale": 0.85, "perspective": 0.03, "noise": 4.0},
+        {"name": "s8192_mid", "size": 8192, "rotation": 10.0, "scale": 0.9, "perspective": 0.02, "noise": 4.0},
+        {"name": "s16384_mid", "size": 16384, "rotation": 10.0, "scale": 0.9, "perspective": 0.02, "noise": 4.0},
+    ],
+}
+
+
+def make_scene(size: int, seed: int = 0) -> np.ndarray:
+    """
+    Imagen base cuadrada (gris) con textura multiescala y primitivas (rectángulos,
+    círculos, texto) repartidas por toda la superficie, para que haya features en
+    cualquier tamaño. El nº de primitivas crece con el área.
+    """
+    rng = np.random.default_rng(seed)
+    img = np.zeros((size, size), np.float32)
+    # Textura: ruido de baja frecuencia a varias escalas
+    for cells, amp in ((8, 60.0), (32, 30.0), (128, 15.0)):
+        c = min(cells, size)
+        img += cv2.resize(rng.standard_normal((c, c)).astype(np.float32), (size, size),
+                          interpolation=cv2.INTER_CUBIC) * amp
+    img = np.clip(img + 110.0, 0, 255).astype(np.uint8)
+
+    n = max(40, int(40 * (size / 512.0) ** 2))
+    for _ in range(n):
+        kind = rng.integers(3)
+        color = int(rng.integers(0, 256))
+        x, y = (int(v) for v in rng.integers(0, size, 2))
+        r = int(rng.integers(max(3, size // 200), max(6, size // 40)))
+        if kind == 0:
+            cv2.rectangle(img, (x, y), (x + 2 * r, y + int(1.5 * r)), color, -1 if rng.random() < 0.5 else 2)
+        elif kind == 1:
+            cv2.circle(img, (x, y), r, color, -1, cv2.LINE_AA)
+        else:
+            cv2.putText(img, "FM%d" % rng.integers(100), (x, y), cv2.FONT_HERSHEY_SIMPLEX,
+                        r / 20.0, color, max(1, r // 10), cv2.LINE_AA)
+    return img
+
+
+def make_homography(size: int, rotation: float, scale: float, perspective: float,
+                    seed: int = 0) -> np.ndarray:
+    """
+    Homografía de similitud (rotación/escala sobre el centro) seguida de un
+    desplazamiento aleatorio de las esquinas de hasta perspective*size px.
+    """
+    rng = np.random.default_rng(seed + 1)
+    c = (size - 1) / 2.0
+    corners = np.float32([[0, 0], [size - 1, 0], [size - 1, size - 1], [0, size - 1]])
+    A = cv2.getRotationMatrix2D((c, c), rotation, scale)
+    moved = corners @ A[:, :2].T + A[:, 2]
+    moved += rng.uniform(-1.0, 1.0, moved.shape) * perspective * size
+    return cv2.getPerspectiveTransform(corners, moved.astype(np.float32)).astype(np.float64)
+
+
+def make_pair(scenario: Dict, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(img1, img2, H_true) con img2 = warp(img1, H_true) + ruido gaussiano."""
+    size = int(scenario["size"])
+    img1 = make_scene(size, seed)
+    H = make_homography(size, scenario["rotation"], scenario["scale"], scenario["perspective"], seed)
+    img2 = cv2.warpPerspective(img1, H, (size, size), flags=cv2.INTER_LINEAR)
+    if scenario.get("noise", 0) > 0:
+        rng = np.random.default_rng(seed + 2)
+        noisy = img2.astype(np.float32) + rng.standard_normal(img2.shape, dtype=np.float32) * scenario["noise"]
+        img2 = np.clip(noisy, 0, 255).astype(np.uint8)
+    return img1, img2, H
+
+
+def write_pairs(scenarios: Sequence[Dict], data_dir: str, seed: int = 0) -> Dict[str, Dict]:
+    """
+    Genera (o reutiliza si ya existen con los mismos parámetros) los pares de los
+    escenarios en data_dir y devuelve {nombre: {img1, img2, H_true, scenario}}.
+    La verdad terreno queda en data_dir/groundtruth.json.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    gt_path = os.path.join(data_dir, "groundtruth.json")
+    try:
+        with open(gt_path, "r", encoding="utf-8") as f:
+            gt = json.load(f)
+    except (OSError, ValueError):
+        gt = {}
+
+    for sc in scenarios:
+        entry = gt.get(sc["name"])
+        if (entry is not None and entry.get("scenario") == sc and entry.get("seed") == seed
+                and os.path.exists(entry["img1"]) and os.path.exists(entry["img2"])):
+            continue
+        img1, img2, H = make_pair(sc, seed)
+        # TIFF sin compresión: escribir/leer 16k px no debe dominar el tiempo de "read"
+        p1 = os.path.join(data_dir, f"{sc['name']}_A.tif")
+        p2 = os.path.join(data_dir, f"{sc['name']}_B.tif")
+        cv2.imwrite(p1, img1)
+        cv2.imwrite(p2, img2)
+        gt[sc["name"]] = {"img1": p1, "img2": p2, "H_true": H.tolist(), "scenario": sc, "seed": seed}
+
+    with open(gt_path, "w", encoding="utf-8") as f:
+        json.dump(gt, f, ensure_ascii=False, indent=2)
+    return {sc["name"]: gt[sc["name"]] for sc in scenarios}
+
+
+# --------------------------- Métricas ---------------------------
+
+def corner_error(H_est: Optional[np.ndarray], H_true: np.ndarray, shape: Tuple[int, ...]) -> Tuple[float, float]:
+    """Error (media, máximo) en px de img2 de las 4 esquinas de img1 proyectadas."""
+    if H_est is None:
+        return float("inf"), float("inf")
+    h, w = shape[:2]
+    corners = np.float64([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]]).reshape(-1, 1, 2)
+    est = cv2.perspectiveTransform(corners, np.asarray(H_est, dtype=np.float64))
+    true = cv2.perspectiveTransform(corners, np.asarray(H_true, dtype=np.float64))
+    err = np.linalg.norm((est - true).reshape(-1, 2), axis=1)
+    return float(err.mean()), float(err.max())
+
+
+# --------------------------- Ejecución de un caso ---------------------------
+
+def run_case(pair: Dict, config: Dict) -> Dict:
+    """
+    Ejecuta un par con una configuración y mide cada etapa por separado
+    (instrumentación del motor, ver feature_matcher_cv.StageProfile).
+
+    config: detector, matcher_type, ratio_thresh, ransac_thresh, ransac_method,
+    transform_model, max_keypoints (+ parámetros del detector con prefijo).
+    """
+    det_params, engine_kw = fm._split_params(config)
+    engine_kw["profile"] = True
+
+    read_prof = fm.make_profile(True)
+    with read_prof.stage("read"):
+        img1 = fm._read_gray(pair["img1"])
+        img2 = fm._read_gray(pair["img2"])
+
+    res = fm.match_and_score(
+        img1, img2,
+        detector_name=config["detector"],
+        params=det_params,
+        matcher_type=config.get("matcher_type", "auto"),
+        ratio_thresh=config.get("ratio_thresh", 0.75),
+        ransac_thresh=config.get("ransac_thresh", 3.0),
+        **engine_kw
+    )
+    profile = res.profile.merge(read_prof)
+    stages = profile.stages
+
+    total = sum(stages.values())
+    err_mean, err_max = corner_error(res.H, np.asarray(pair["H_true"]), img1.shape)
+    mpx = (img1.size + img2.size) / 1e6
+    return {
+        "stages_s": stages,
+        "total_s": total,
+        "peak_rss_mb": fm.peak_rss_mb(),
+        "rss_mb_after": profile.rss_mb,
+        "keypoints": [res.total_kp1, res.total_kp2],
+        "knn_pairs": profile.counts.get("knn_pairs", 0),
+        "descriptor_bytes": profile.counts.get("descriptor_bytes", 0),
+        "good_matches": res.good_matches,
+        "inliers": res.inliers,
+        "model": res.model,
+        "rmse": res.rmse,
+        "corner_err_mean": err_mean,
+        "corner_err_max": err_max,
+        "pairs_per_s": 1.0 / total if total > 0 else None,
+        "mpx_per_s": mpx / total if total > 0 else None,
+    }
+
+
+def _run_case_isolated(pair: Dict, config: Dict) -> Dict:
+    """run_case en un proceso nuevo (pico de RSS propio del caso)."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as ex:
+        return ex.submit(run_case, pair, config).result()
+
+
+# Detectores con descriptor float: las variantes de almacenamiento (float16, uint8, PCA)
+# sólo tienen efecto sobre ellos; ORB y AKAZE (MLDB) son binarios y no cambian
+FLOAT_DESCRIPTOR_DETECTORS = ("SIFT",)
+
+
+def build_configs(detectors: Sequence[str], matchers: Sequence[str], methods: Sequence[str],
+                  models: Sequence[str], max_keypoints: Optional[int],
+                  storages: Sequence[str] = ("float32",),
+                  pca_dims: Sequence[Optional[int]] = (None,)) -> List[Dict]:
+    """
+    Producto de las opciones. Los detectores binarios sólo se prueban con float32 sin
+    PCA (las demás variantes de almacenamiento serían casos repetidos).
+    """
+    def variants(d):
+        if d.upper() not in FLOAT_DESCRIPTOR_DETECTORS:
+            return [("float32", None)]
+        # Sin combinaciones inválidas (uint8 + PCA, ver check_descriptor_options)
+        return [(st, pca) for st in storages for pca in pca_dims
+                if fm._descriptor_options_ok({"descriptor_storage": st, "descriptor_pca": pca})]
+
+    return [
+        {"detector": d, "matcher_type": m, "ransac_method": e, "transform_model": t,
+         "ratio_thresh": 0.75, "ransac_thresh": 3.0, "max_keypoints": max_keypoints,
+         "descriptor_storage": st, "descriptor_pca": pca}
+        for d in detectors for m in matchers for e in methods for t in models
+        for st, pca in variants(d)
+    ]
+
+
+def descriptor_report(results: Sequence[Dict]) -> List[Dict]:
+    """
+    Ahorro de memoria y cambio de precisión de cada representación de descriptores
+    frente a float32 sin PCA, con el resto de la configuración igual.
+    """
+    def base_key(r):
+        cfg = {k: v for k, v in r["config"].items() if k not in ("descriptor_storage", "descriptor_pca")}
+        return r["scenario"], json.dumps(cfg, sort_keys=True)
+
+    ok = [r for r in results if not r.get("error")]
+    bases = {base_key(r): r for r in ok
+             if r["config"].get("descriptor_storage", "float32") == "float32" and not r["config"].get("descriptor_pca")}
+    rows = []
+    for r in ok:
+        b = bases.get(base_key(r))
+        if b is None or r is b:
+            continue
+        rows.append({
+            "scenario": r["scenario"],
+            "detector": r["config"]["detector"],
+            "matcher_type": r["config"]["matcher_type"],
+            "descriptor_storage": r["config"].get("descriptor_storage"),
+            "descriptor_pca": r["config"].get("descriptor_pca"),
+            "descriptor_bytes": r["descriptor_bytes"],
+            "bytes_ratio": r["descriptor_bytes"] / b["descriptor_bytes"] if b["descriptor_bytes"] else None,
+            "inliers_delta": r["inliers"] - b["inliers"],
+            "corner_err_delta": r["corner_err_mean"] - b["corner_err_mean"],
+            "knn_s_ratio": (r["stages_s"].get("knn", 0.0) / b["stages_s"]["knn"]
+                            if b["stages_s"].get("knn") else None),
+        })
+    return rows
+
+
+def environment_info() -> Dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_benchmark(scenarios: Sequence[Dict],
+                  configs: Sequence[Dict],
+                  data_dir: str,
+                  seed: int = 0,
+                  isolate: bool = True,
+                  verbose: bool = True) -> Dict:
+    """Ejecuta todos los casos escenario x configuración y devuelve el informe."""
+    pairs = write_pairs(scenarios, data_dir, seed)
+    results = []
+    for sc in scenarios:
+        pair = pairs[sc["name"]]
+        for cfg in configs:
+            try:
+                out = _run_case_isolated(pair, cfg) if isolate else run_case(pair, cfg)
+                out["error"] = None
+            except Exception as e:
+                out = {"error": str(e)}
+            results.append({"scenario": sc["name"], "config": cfg, **out})
+            if verbose:
+                if out.get("error"):
+                    print(f"[{sc['name']}] {cfg['detector']}/{cfg['matcher_type']}/{cfg['ransac_method']}: ERROR {out['error']}")
+                else:
+                    print(f"[{sc['name']}] {cfg['detector']}/{cfg['matcher_type']}/{cfg['ransac_method']}: "
+                          f"{out['total_s']:.3f}s  corner_err={out['corner_err_mean']:.2f}px  "
+                          f"inliers={out['inliers']}  rss={out['peak_rss_mb']}")
+    report = {
+        "environment": environment_info(),
+        "seed": seed,
+        "scenarios": list(scenarios),
+        "results": results,
+    }
+    if len({(c.get("descriptor_storage"), c.get("descriptor_pca")) for c in configs}) > 1:
+        report["descriptors"] = descriptor_report(results)
+        if verbose:
+            for row in report["descriptors"]:
+                pca = f"+pca{row['descriptor_pca']}" if row["descriptor_pca"] else ""
+                ratio = "-" if row["bytes_ratio"] is None else f"{row['bytes_ratio']:.2f}"
+                print(f"[{row['scenario']}] {row['detector']}/{row['matcher_type']} {row['descriptor_storage']}{pca}: "
+                      f"bytes x{ratio}  inliers {row['inliers_delta']:+d}  "
+                      f"corner_err {row['corner_err_delta']:+.2f}px")
+    return report
+
+
+# --------------------------- Puerta de regresión ---------------------------
+
+# Escenarios y configuraciones fijos: cambiarlos invalida las líneas base guardadas
+GATE_SCENARIOS: List[Dict] = [
+    {"name": "gate_s768", "size": 768, "rotation": 8.0, "scale": 0.95, "perspective": 0.02, "noise": 2.0},
+    {"name": "gate_s1024", "size": 1024, "rotation": 20.0, "scale": 0.85, "perspective": 0.04, "noise": 4.0},
+]
+GATE_DETECTORS = ("SIFT", "ORB")
+GATE_MAX_KEYPOINTS = 4000
+GATE_GRID = {"detector": ["ORB", "AKAZE"], "ratio_thresh": [0.7, 0.75], "max_keypoints": [GATE_MAX_KEYPOINTS]}
+# Diferencia mínima (s) que se considera regresión aunque supere la tolerancia relativa
+GATE_MIN_DELTA_S = 0.005
+# Empeoramiento admitido del error de esquinas (px) antes de marcarlo
+GATE_CORNER_ERR_PX = 1.0
+
+
+def _timed_runs(fn, repeat: int) -> Tuple[List[float], object]:
+    """Ejecuta fn() 'repeat' veces (más una de calentamiento) y devuelve (tiempos, última salida)."""
+    out = fn()
+    times = []
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return times, out
+
+
+def _summarize_times(times: Sequence[float]) -> Dict:
+    arr = np.asarray(times, dtype=np.float64)
+    med = float(np.median(arr))
+    return {"times_s": [float(t) for t in arr], "median_s": med,
+            "mad_s": float(np.median(np.abs(arr - med))), "min_s": float(arr.min())}
+
+
+def run_gate(data_dir: str, repeat: int = 5, seed: int = 0, verbose: bool = True) -> Dict:
+    """
+    Mide las cargas fijas de la puerta de regresión y devuelve
+    {"environment", "repeat", "workloads": {nombre: {times_s, median_s, mad_s, min_s, ...}}}.
+    """
+    pairs = write_pairs(GATE_SCENARIOS, data_dir, seed)
+    workloads = {}
+
+    def record(name, times, **quality):
+        workloads[name] = {**_summarize_times(times), **quality}
+        if verbose:
+            w = workloads[name]
+            print(f"[gate] {name}: median={w['median_s']:.4f}s  mad={w['mad_s']:.4f}s")
+
+    # match_and_score con los valores por defecto del motor (detecta cambios de defaults)
+    for sc in GATE_SCENARIOS:
+        pair = pairs[sc["name"]]
+        img1, img2 = fm._read_gray(pair["img1"]), fm._read_gray(pair["img2"])
+        for det in GATE_DETECTORS:
+            times, res = _timed_runs(
+                lambda: fm.match_and_score(img1, img2, det, max_keypoints=GATE_MAX_KEYPOINTS), repeat)
+            err_mean, _ = corner_error(res.H, np.asarray(pair["H_true"]), img1.shape)
+            record(f"match_and_score:{sc['name']}:{det}", times,
+                   inliers=res.inliers, corner_err_mean=err_mean)
+
+    pair_list = [(pairs[sc["name"]]["img1"], pairs[sc["name"]]["img2"]) for sc in GATE_SCENARIOS]
+
+    # Optimizador (holdout plano, un solo proceso)
+    def fit():
+        opt = fm.FeatureMatcherOptimizer(GATE_GRID, alpha_rmse=0.15, test_size=0.5, n_jobs=1)
+        return opt.fit(pair_list)[0]
+    times, best = _timed_runs(fit, repeat)
+    record("optimizer_fit", times, best_params=best)
+
+    # Exportación de homografías por par
+    with tempfile.TemporaryDirectory() as tmp:
+        out_json = os.path.join(tmp, "homogs.json")
+        params = {"detector": "ORB", "max_keypoints": GATE_MAX_KEYPOINTS}
+        times, _ = _timed_runs(lambda: fm.save_homographies_json(pair_list, params, out_json), repeat)
+    record("export_homographies", times)
+
+    return {"environment": environment_info(), "seed": seed, "repeat": repeat,
+            "scenarios": GATE_SCENARIOS, "workloads": workloads}
+
+
+def compare_gate(baseline: Dict, current: Dict, tolerance: float = 0.15,
+                 min_delta_s: float = GATE_MIN_DELTA_S) -> Dict:
+    """
+    Compara dos salidas de run_gate. Una carga es regresión si su mediana supera a la
+    de la línea base en más de max(tolerance * base, 3 * MAD de ambas, min_delta_s), o
+    si su error de esquinas crece más de GATE_CORNER_ERR_PX. Devuelve
+    {"regressions": [...], "rows": [...]} (las cargas nuevas o retiradas sólo se listan).
+    """
+    rows, regressions = [], []
+    base_w, cur_w = baseline.get("workloads", {}), current.get("workloads", {})
+    for name in sorted(set(base_w) | set(cur_w)):
+        b, c = base_w.get(name), cur_w.get(name)
+        if b is None or c is None:
+            rows.append({"workload": name, "status": "new" if b is None else "missing"})
+            continue
+        delta = c["median_s"] - b["median_s"]
+        allowed = max(tolerance * b["median_s"], 3.0 * (b["mad_s"] + c["mad_s"]), min_delta_s)
+        reasons = []
+        if delta > allowed:
+            reasons.append(f"time +{delta:.4f}s > {allowed:.4f}s")
+        b_err, c_err = b.get("corner_err_mean"), c.get("corner_err_mean")
+        if b_err is not None and c_err is not None and c_err > b_err + GATE_CORNER_ERR_PX:
+            reasons.append(f"corner_err {b_err:.2f} -> {c_err:.2f}px")
+        row = {"workload": name, "base_median_s": b["median_s"], "median_s": c["median_s"],
+               "ratio": c["median_s"] / b["median_s"] if b["median_s"] > 0 else None,
+               "allowed_delta_s": allowed, "status": "regression" if reasons else "ok",
+               "reasons": reasons}
+        rows.append(row)
+        if reasons:
+            regressions.append(row)
+    return {"tolerance": tolerance, "regressions": regressions, "rows": rows}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark del motor de matching sobre pares sintéticos.")
+    parser.add_argument("--suite", type=str, default="quick", choices=sorted(SUITES),
+                        help="Conjunto de escenarios.")
+    parser.add_argument("--scenarios", type=str, default=None,
+                        help="JSON con una lista de escenarios propia (sustituye a --suite).")
+    parser.add_argument("--detectors", nargs="+", default=["SIFT", "AKAZE", "ORB"])
+    parser.add_argument("--matchers", nargs="+", default=["auto"])
+    parser.add_argument("--methods", nargs="+", default=["ransac", "prosac"],
+                        help="Estimadores robustos (ransac = el del motor por defecto, prosac).")
+    parser.add_argument("--models", nargs="+", default=["homography"], help="Modelos de transformación.")
+    parser.add_argument("--max-keypoints", type=int, default=8000,
+                        help="Presupuesto de keypoints por imagen (0 = sin límite).")
+    parser.add_argument("--storages", nargs="+", default=["float32"], choices=list(fm.DESCRIPTOR_STORAGES),
+                        help="Representaciones de descriptores a comparar (ver compact_descriptors).")
+    parser.add_argument("--pca", nargs="+", type=int, default=[0],
+                        help="Dimensiones PCA de los descriptores float (0 = sin PCA).")
+    parser.add_argument("--data-dir", type=str, default="bench_data", help="Carpeta de pares y groundtruth.json.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-isolate", action="store_true",
+                        help="No usar un proceso por caso (más rápido; el pico de RSS es acumulado).")
+    parser.add_argument("--out", type=str, default=None, help="Ruta del informe JSON.")
+
+    # Puerta de regresión
+    parser.add_argument("--save-baseline", type=str, default=None,
+                        help="Mide las cargas fijas y guarda la línea base en esta ruta.")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="Mide las cargas fijas y las compara con esta línea base (código 1 si hay regresión).")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por carga (se usa la mediana).")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Aumento relativo de la mediana admitido antes de marcar regresión.")
+    args = parser.parse_args()
+
+    if args.save_baseline or args.compare:
+        gate = run_gate(args.data_dir, repeat=args.repeat, seed=args.seed)
+        if args.save_baseline:
+            os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+            with open(args.save_baseline, "w", encoding="utf-8") as f:
+                json.dump(gate, f, ensure_ascii=False, indent=2)
+            print(f"[OK] Línea base: {args.save_baseline}")
+        if not args.compare:
+            sys.exit(0)
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        cmp = compare_gate(baseline, gate, tolerance=args.tolerance)
+        for row in cmp["rows"]:
+            if "median_s" in row:
+                print(f"[{row['status']}] {row['workload']}: {row['base_median_s']:.4f}s -> "
+                      f"{row['median_s']:.4f}s  {'; '.join(row['reasons'])}")
+            else:
+                print(f"[{row['status']}] {row['workload']}")
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({"baseline": baseline, "current": gate, "comparison": cmp}, f, ensure_ascii=False, indent=2)
+        sys.exit(1 if cmp["regressions"] else 0)
+
+    if not args.out:
+        parser.error("--out es obligatorio salvo con --save-baseline/--compare")
+
+    scenarios = json.loads(args.scenarios) if args.scenarios else SUITES[args.suite]
+    configs = build_configs(args.detectors, args.matchers, args.methods, args.models,
+                            args.max_keypoints or None, args.storages, [d or None for d in args.pca])
+    report = run_benchmark(scenarios, configs, args.data_dir, seed=args.seed, isolate=not args.no_isolate)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[OK] Informe: {args.out}")
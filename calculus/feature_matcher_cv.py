@@ -48,15 +48,30 @@ from __future__ import annotations
 import json
 import math
 import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from multiprocessing import get_context
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 import cv2
 import numpy as np
 from sklearn.model_selection import ParameterGrid, train_test_split, KFold
 from joblib import Parallel, delayed
 
+try:
+    from osgeo import gdal  # Opcional: sólo para leer geotransformación/CRS de referencias
+except ImportError:
+    gdal = None
+
+try:
+    import resource  # Sólo POSIX: pico de RSS para la instrumentación
+except ImportError:
+    resource = None
+
 
 # --------------------------- E/S de imágenes y pares ---------------------------
 
@@ -70,6 +85,168 @@ def _read_gray(path: str) -> np.ndarray:
     return img
 
 
+@dataclass
+class ReferenceImage:
+    """
+    Imagen de referencia en memoria: píxeles en gris + geotransformación GDAL
+    (x0, dx, rx, y0, ry, dy) + CRS (WKT o authid). Sin geotransformación se comporta
+    como una imagen normal (sólo píxel -> píxel).
+    """
+    pixels: np.ndarray
+    geotransform: Optional[Tuple[float, float, float, float, float, float]] = None
+    crs: Optional[str] = None
+    path: Optional[str] = None
+
+    @property
+    def georeferenced(self) -> bool:
+        return self.geotransform is not None
+
+    @property
+    def gsd(self) -> Optional[float]:
+        """Tamaño medio de píxel en terreno (unidades del CRS), o None."""
+        if self.geotransform is None:
+            return None
+        gt = self.geotransform
+        return math.sqrt(abs(gt[1] * gt[5] - gt[2] * gt[4]))
+
+    def pixel_to_world(self, xy: np.ndarray) -> np.ndarray:
+        """
+        Convierte coordenadas píxel (Nx2, convenio OpenCV: centro del píxel en enteros)
+        a coordenadas del CRS. GDAL referencia la esquina, de ahí el +0.5.
+        """
+        if self.geotransform is None:
+            raise ValueError("La referencia no tiene geotransformación.")
+        gt = self.geotransform
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2) + 0.5
+        wx = gt[0] + xy[:, 0] * gt[1] + xy[:, 1] * gt[2]
+        wy = gt[3] + xy[:, 0] * gt[4] + xy[:, 1] * gt[5]
+        return np.stack([wx, wy], axis=1)
+
+
+def read_reference(path: str,
+                   geotransform: Optional[Tuple[float, ...]] = None,
+                   crs: Optional[str] = None) -> ReferenceImage:
+    """
+    Lee una referencia: píxeles con _read_gray y, si GDAL está disponible y el fichero
+    está georreferenciado, su geotransformación y CRS (sólo metadatos, sin releer píxeles).
+    Si el llamador ya conoce geotransform/crs (p. ej. QGIS), no se consulta GDAL.
+    """
+    ref = ReferenceImage(pixels=_read_gray(path), path=path)
+    if geotransform is not None:
+        ref.geotransform, ref.crs = tuple(geotransform), crs
+        return ref
+    if gdal is None:
+        return ref
+    ds = gdal.Open(path)
+    if ds is None:
+        return ref
+    gt = ds.GetGeoTransform(can_return_null=True)
+    if gt is not None and tuple(gt) != (0.0, 1.0, 0.0, 0.0, 0.0, 1.0):
+        ref.geotransform = tuple(gt)
+        ref.crs = ds.GetProjection() or None
+    ds = None
+    return ref
+
+
+def _to_uint8(arr: np.ndarray) -> np.ndarray:
+    """Lleva un array de cualquier tipo a uint8 con estiramiento de percentiles 2-98."""
+    if arr.dtype == np.uint8:
+        return arr
+    arr = arr.astype(np.float32)
+    lo, hi = np.percentile(arr, (2, 98))
+    if hi <= lo:
+        hi = lo + 1.0
+    return np.clip((arr - lo) * (255.0 / (hi - lo)), 0, 255).astype(np.uint8)
+
+
+def read_window(path: str,
+                bounds: Optional[Tuple[float, float, float, float]] = None,
+                target_res: Optional[float] = None,
+                max_side: Optional[int] = None,
+                gray: bool = True) -> Tuple[np.ndarray, Tuple[float, ...], Optional[str]]:
+    """
+    Lectura por ventana con GDAL de un raster georreferenciado.
+
+    - bounds: (xmin, ymin, xmax, ymax) en el CRS del raster; None = raster completo.
+    - target_res: resolución deseada (unidades/px); si es más gruesa que la nativa se
+      diezma en la propia lectura (GDAL usa las overviews si existen).
+    - max_side: lado máximo del array devuelto.
+
+    Devuelve (array uint8 HxW en gris o HxWx3 RGB, geotransformación de la ventana, CRS WKT).
+    """
+    if gdal is None:
+        raise RuntimeError("Se requiere GDAL (osgeo) para leer por ventana.")
+    ds = gdal.Open(path)
+    if ds is None:
+        raise FileNotFoundError(f"No se pudo abrir el raster: {path}")
+    gt = ds.GetGeoTransform()
+    W, H = ds.RasterXSize, ds.RasterYSize
+
+    xoff, yoff, x1, y1 = 0, 0, W, H
+    # Con rotación no hay ventana rectangular en píxeles: se lee completo
+    if bounds is not None and gt[2] == 0 and gt[4] == 0:
+        xs = sorted([(bounds[0] - gt[0]) / gt[1], (bounds[2] - gt[0]) / gt[1]])
+        ys = sorted([(bounds[1] - gt[3]) / gt[5], (bounds[3] - gt[3]) / gt[5]])
+        xoff, x1 = max(0, int(math.floor(xs[0]))), min(W, int(math.ceil(xs[1])))
+        yoff, y1 = max(0, int(math.floor(ys[0]))), min(H, int(math.ceil(ys[1])))
+        if x1 <= xoff or y1 <= yoff:
+            raise ValueError("La AOI no intersecta el raster de referencia.")
+    xsize, ysize = x1 - xoff, y1 - yoff
+
+    dec = 1.0
+    if target_res:
+        dec = max(dec, float(target_res) / abs(gt[1]))
+    if max_side:
+        dec = max(dec, max(xsize, ysize) / float(max_side))
+    bx, by = max(1, int(round(xsize / dec))), max(1, int(round(ysize / dec)))
+
+    n_bands = 3 if ds.RasterCount >= 3 else 1
+    bands = [ds.GetRasterBand(i + 1).ReadAsArray(xoff, yoff, xsize, ysize, bx, by,
+                                                 resample_alg=gdal.GRIORA_Average)
+             for i in range(n_bands)]
+    crs = ds.GetProjection() or None
+    ds = None
+
+    if n_bands == 3:
+        rgb = np.dstack([_to_uint8(b) for b in bands])
+        arr = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY) if gray else rgb
+    else:
+        arr = _to_uint8(bands[0])
+        if not gray:
+            arr = cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB)
+
+    win_gt = (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1] * xsize / bx, gt[2] * ysize / by,
+              gt[3] + xoff * gt[4] + yoff * gt[5], gt[4] * xsize / bx, gt[5] * ysize / by)
+    return np.ascontiguousarray(arr), win_gt, crs
+
+
+def read_reference_window(path: str,
+                          bounds: Optional[Tuple[float, float, float, float]] = None,
+                          target_res: Optional[float] = None,
+                          max_side: Optional[int] = None) -> ReferenceImage:
+    """
+    ReferenceImage a partir de una ventana (AOI) del raster, a la resolución adecuada:
+    memoria y coste de detección escalan con la AOI y no con el mosaico completo.
+    """
+    pixels, gt, crs = read_window(path, bounds, target_res, max_side, gray=True)
+    return ReferenceImage(pixels=pixels, geotransform=gt, crs=crs, path=path)
+
+
+def _as_gray(img: Union[str, np.ndarray, ReferenceImage]) -> np.ndarray:
+    """Acepta ruta, array en gris o ReferenceImage y devuelve el array en gris."""
+    if isinstance(img, ReferenceImage):
+        return img.pixels
+    if isinstance(img, np.ndarray):
+        return img
+    return _read_gray(img)
+
+
+def _image_label(img: Union[str, np.ndarray, ReferenceImage]) -> Optional[str]:
+    if isinstance(img, ReferenceImage):
+        return img.path
+    return img if isinstance(img, str) else None
+
+
 def _load_pairs_file(pairs_file: str) -> List[Tuple[str, str]]:
     """Carga pares del archivo (separador ';' o ',')."""
     pairs = []
@@ -126,15 +303,123 @@ def _create_detector(method: str = "ORB", **kwargs):
         raise ValueError("method debe ser 'ORB','SIFT' o 'AKAZE'")
 
 
-def _create_matcher(matcher_type: str, desc_dtype: Optional[np.dtype]) -> cv2.DescriptorMatcher:
+# Popcount de cada byte (numpy < 2.0 no tiene np.bitwise_count)
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class BlockedMatcher:
+    """
+    Top-2 exacto por fuerza bruta en bloques, alternativa a BFMatcher/FLANN.
+
+    - float (L2): ||a||² + ||b||² - 2·a·bᵀ con una multiplicación de matrices por bloque
+      de filas de d1, de modo que el trabajo lo hace BLAS (multihilo) y la memoria
+      temporal queda acotada por block_mb.
+    - binario (Hamming): XOR por bloques sobre palabras de 64 bits y popcount.
+
+    knn_pairs usa top2() directamente; knnMatch(k=2) se ofrece por compatibilidad con
+    la interfaz de cv2.DescriptorMatcher.
     """
-    matcher_type: {'auto','bf','flann'}
+
+    def __init__(self, binary: bool, block_mb: float = 64.0):
+        self.binary = binary
+        self.block_mb = float(block_mb)
+
+    def _block_rows(self, n2: int, bytes_per_pair: int) -> int:
+        return max(1, int(self.block_mb * 1024 * 1024 // max(1, n2 * bytes_per_pair)))
+
+    @staticmethod
+    def _top2(dist: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        idx = np.argpartition(dist, 1, axis=1)[:, :2]
+        d = np.take_along_axis(dist, idx, axis=1)
+        swap = d[:, 1] < d[:, 0]
+        idx[swap] = idx[swap][:, ::-1]
+        d[swap] = d[swap][:, ::-1]
+        return idx, d
+
+    def _top2_l2(self, d1: np.ndarray, d2: np.ndarray):
+        a = np.asarray(d1, dtype=np.float32)
+        b = np.asarray(d2, dtype=np.float32)
+        bt = np.ascontiguousarray(b.T)
+        b_sq = np.einsum("ij,ij->i", b, b)
+        rows = self._block_rows(len(b), 4)
+        idx_out = np.empty((len(a), 2), np.int32)
+        dist_out = np.empty((len(a), 2), np.float32)
+        for i in range(0, len(a), rows):
+            blk = a[i:i + rows]
+            dist = blk @ bt
+            dist *= -2.0
+            dist += b_sq[None, :]
+            dist += np.einsum("ij,ij->i", blk, blk)[:, None]
+            idx, d = self._top2(dist)
+            idx_out[i:i + rows] = idx
+            dist_out[i:i + rows] = np.sqrt(np.maximum(d, 0.0))
+        return idx_out, dist_out
+
+    def _top2_hamming(self, d1: np.ndarray, d2: np.ndarray):
+        # Relleno a múltiplo de 8 bytes (AKAZE MLDB = 61) para trabajar con uint64
+        nbytes = d1.shape[1]
+        pad = (-nbytes) % 8
+
+        def words(d):
+            d = np.ascontiguousarray(d, dtype=np.uint8)
+            if pad:
+                d = np.hstack([d, np.zeros((len(d), pad), np.uint8)])
+            return d.view(np.uint64)
+
+        a, bt = words(d1), np.ascontiguousarray(words(d2).T)
+        # Bloques pequeños: el XOR por palabra cabe en caché (y el presupuesto manda si es menor)
+        rows = min(256, self._block_rows(bt.shape[1], 10))
+        idx_out = np.empty((len(a), 2), np.int32)
+        dist_out = np.empty((len(a), 2), np.float32)
+        for i in range(0, len(a), rows):
+            blk = a[i:i + rows]
+            dist = np.zeros((len(blk), bt.shape[1]), np.uint16)
+            x = np.empty((len(blk), bt.shape[1]), np.uint64)
+            # Palabra a palabra: evita el tensor (filas, n2, palabras) y su suma con saltos
+            for w in range(a.shape[1]):
+                np.bitwise_xor(blk[:, w, None], bt[w][None, :], out=x)
+                if hasattr(np, "bitwise_count"):
+                    dist += np.bitwise_count(x)
+                else:
+                    dist += _POPCOUNT8[x.view(np.uint8).reshape(len(blk), -1, 8)].sum(axis=2, dtype=np.uint16)
+            idx, d = self._top2(dist)
+            idx_out[i:i + rows] = idx
+            dist_out[i:i + rows] = d
+        return idx_out, dist_out
+
+    def top2(self, d1: np.ndarray, d2: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(query, train, dist_1º, dist_2º) como knn_pairs."""
+        if len(d1) == 0 or len(d2) < 2:
+            return (np.empty(0, np.int32), np.empty(0, np.int32),
+                    np.empty(0, np.float32), np.empty(0, np.float32))
+        idx, dist = (self._top2_hamming if self.binary else self._top2_l2)(d1, d2)
+        return np.arange(len(d1), dtype=np.int32), idx[:, 0], dist[:, 0], dist[:, 1]
+
+    def knnMatch(self, d1: np.ndarray, d2: np.ndarray, k: int = 2) -> List[List[cv2.DMatch]]:
+        if k != 2:
+            raise ValueError("BlockedMatcher sólo implementa k=2")
+        if len(d1) == 0 or len(d2) < 2:
+            return []
+        idx, dist = (self._top2_hamming if self.binary else self._top2_l2)(_matchable(d1), _matchable(d2))
+        return [[cv2.DMatch(q, int(idx[q, 0]), float(dist[q, 0])),
+                 cv2.DMatch(q, int(idx[q, 1]), float(dist[q, 1]))] for q in range(len(d1))]
+
+
+def _create_matcher(matcher_type: str,
+                    desc_dtype: Optional[np.dtype],
+                    binary: Optional[bool] = None) -> cv2.DescriptorMatcher:
+    """
+    matcher_type: {'auto','bf','flann','blocked'}
     - 'auto' elige BF/FLANN y norma según dtype (Hamming para binarios, L2 para float).
+    - 'blocked': top-2 exacto en bloques con BLAS/popcount (ver BlockedMatcher).
+    - binary fuerza el tipo de descriptor (p.ej. SIFT cuantizado a uint8 no es binario).
     """
     def _is_binary(dtype) -> bool:
-        return dtype == np.uint8
+        return dtype == np.uint8 if binary is None else binary
 
     m = (matcher_type or "auto").lower()
+    if m == "blocked":
+        return BlockedMatcher(binary=_is_binary(desc_dtype))
     if m == "bf" or (m == "auto" and desc_dtype is not None):
         return cv2.BFMatcher(cv2.NORM_HAMMING if _is_binary(desc_dtype) else cv2.NORM_L2, crossCheck=False)
 
@@ -152,11 +437,287 @@ def _create_matcher(matcher_type: str, desc_dtype: Optional[np.dtype]) -> cv2.De
         search_params = dict(checks=64)
         return cv2.FlannBasedMatcher(index_params, search_params)
 
-    raise ValueError("matcher_type debe ser {'auto','bf','flann'}")
+    raise ValueError("matcher_type debe ser {'auto','bf','flann','blocked'}")
+
+
+# --------------------------- Instrumentación ---------------------------
+
+def peak_rss_mb() -> Optional[float]:
+    """Pico de RSS del proceso actual (MB), o None si no se puede medir."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KiB; macOS: bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+class StageProfile:
+    """
+    Tiempos por etapa (s), contadores y pico de RSS tras cada etapa de un matching.
+
+    Etapas: read, detect1, detect2, compact, build_index, knn (o guided_knn), ratio,
+    estimate, rmse.
+    Las que se repiten se acumulan. El pico de RSS es el del proceso (monótono): la
+    etapa en la que salta es la que marcó el máximo.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.rss_mb: Dict[str, Optional[float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0)
+            self.rss_mb[name] = peak_rss_mb()
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def copy(self) -> "StageProfile":
+        out = StageProfile()
+        out.stages, out.counts, out.rss_mb = dict(self.stages), dict(self.counts), dict(self.rss_mb)
+        return out
+
+    def merge(self, other: "StageProfile") -> "StageProfile":
+        """Añade las etapas de 'other' por delante (p.ej. la lectura de las imágenes)."""
+        stages = dict(other.stages)
+        for name, t in self.stages.items():
+            stages[name] = stages.get(name, 0.0) + t
+        self.stages = stages
+        self.counts = {**other.counts, **self.counts}
+        self.rss_mb = {**other.rss_mb, **self.rss_mb}
+        return self
+
+    def as_dict(self) -> Dict:
+        return {
+            "stages_s": dict(self.stages),
+            "total_s": float(sum(self.stages.values())),
+            "counts": dict(self.counts),
+            "rss_mb_after": dict(self.rss_mb),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+class _NullProfile:
+    """Instrumentación desactivada: cada etapa cuesta una llamada y un 'with' vacío."""
+
+    enabled = False
+    _stage = nullcontext()
+
+    def stage(self, name: str):
+        return self._stage
+
+    def count(self, **counts):
+        pass
+
+    def copy(self) -> "_NullProfile":
+        return self
+
+
+NO_PROFILE = _NullProfile()
+
+
+def make_profile(enabled: bool = False):
+    """StageProfile si 'enabled'; si no, NO_PROFILE (sin coste apreciable)."""
+    return StageProfile() if enabled else NO_PROFILE
+
+
+# --------------------------- Keypoints e índice espacial ---------------------------
+
+class GridIndex:
+    """
+    Índice espacial de rejilla uniforme sobre puntos 2D.
+
+    Los puntos se ordenan por celda (lado 'cell') y las celdas se localizan con
+    búsqueda binaria, así que la memoria es O(n) aunque la rejilla sea enorme.
+    query_pairs devuelve todos los pares (consulta, punto) a distancia <= radio.
+    """
+
+    def __init__(self, xy: np.ndarray, cell: float):
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.cell = float(cell)
+        cells = np.floor(self.xy / self.cell).astype(np.int64)
+        self._origin = cells.min(axis=0) if len(cells) else np.zeros(2, np.int64)
+        cells -= self._origin
+        self._ncols = int(cells[:, 0].max()) + 1 if len(cells) else 1
+        self._nrows = int(cells[:, 1].max()) + 1 if len(cells) else 1
+        ids = cells[:, 1] * self._ncols + cells[:, 0]
+        self.order = np.argsort(ids, kind="stable")
+        self._sorted_ids = ids[self.order]
+
+    def __len__(self) -> int:
+        return len(self.xy)
+
+    def query_pairs(self, pts: np.ndarray, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(índices de pts, índices del índice) de los pares a distancia <= radius."""
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        if len(pts) == 0 or len(self.xy) == 0:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        reach = int(math.ceil(radius / self.cell))
+        qcells = np.floor(pts / self.cell).astype(np.int64) - self._origin
+        qs, ts = [], []
+        for dy in range(-reach, reach + 1):
+            for dx in range(-reach, reach + 1):
+                cx, cy = qcells[:, 0] + dx, qcells[:, 1] + dy
+                ok = np.flatnonzero((cx >= 0) & (cx < self._ncols) & (cy >= 0) & (cy < self._nrows))
+                if ok.size == 0:
+                    continue
+                ids = cy[ok] * self._ncols + cx[ok]
+                start = np.searchsorted(self._sorted_ids, ids, side="left")
+                counts = np.searchsorted(self._sorted_ids, ids, side="right") - start
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                # Expansión de rangos [start, start + count) sin bucle por consulta
+                q = np.repeat(ok, counts)
+                offs = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                qs.append(q)
+                ts.append(self.order[np.repeat(start, counts) + offs])
+        if not qs:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        q, t = np.concatenate(qs), np.concatenate(ts)
+        d2 = ((pts[q] - self.xy[t]) ** 2).sum(axis=1)
+        keep = d2 <= radius * radius
+        return q[keep], t[keep]
+
+
+class KeypointSet:
+    """
+    Keypoints como estructura de arrays (x, y, size, angle, response, octave) en vez
+    de lista de cv2.KeyPoint: selección, reescalado y consultas espaciales sin bucles
+    Python y 24 bytes por keypoint.
+
+    kps[i] devuelve un cv2.KeyPoint (compatibilidad con kp[m.queryIdx].pt); con un
+    slice, máscara o array de índices devuelve otro KeypointSet. index(cell) construye
+    (y guarda) un GridIndex sobre las posiciones.
+    """
+
+    FIELDS = ("x", "y", "size", "angle", "response", "octave")
+
+    def __init__(self, x, y, size=None, angle=None, response=None, octave=None):
+        self.x = np.ascontiguousarray(x, dtype=np.float32).ravel()
+        self.y = np.ascontiguousarray(y, dtype=np.float32).ravel()
+        n = len(self.x)
+        self.size = np.zeros(n, np.float32) if size is None else np.ascontiguousarray(size, dtype=np.float32).ravel()
+        self.angle = np.full(n, -1.0, np.float32) if angle is None else np.ascontiguousarray(angle, dtype=np.float32).ravel()
+        self.response = np.zeros(n, np.float32) if response is None else np.ascontiguousarray(response, dtype=np.float32).ravel()
+        self.octave = np.zeros(n, np.int32) if octave is None else np.ascontiguousarray(octave, dtype=np.int32).ravel()
+        self._indexes: Dict[float, GridIndex] = {}
+
+    @classmethod
+    def from_cv(cls, kps) -> "KeypointSet":
+        """Desde una secuencia de cv2.KeyPoint (un KeypointSet se devuelve tal cual)."""
+        if isinstance(kps, KeypointSet):
+            return kps
+        kps = list(kps or ())
+        n = len(kps)
+        pt = np.float32([k.pt for k in kps]).reshape(n, 2)
+        return cls(pt[:, 0], pt[:, 1],
+                   np.fromiter((k.size for k in kps), np.float32, n),
+                   np.fromiter((k.angle for k in kps), np.float32, n),
+                   np.fromiter((k.response for k in kps), np.float32, n),
+                   np.fromiter((k.octave for k in kps), np.int32, n))
+
+    @classmethod
+    def concat(cls, sets: Sequence["KeypointSet"]) -> "KeypointSet":
+        sets = [k for k in sets if len(k)]
+        if not sets:
+            return cls(np.empty(0), np.empty(0))
+        return cls(*(np.concatenate([getattr(k, f) for k in sets]) for f in cls.FIELDS))
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return cv2.KeyPoint(float(self.x[idx]), float(self.y[idx]), float(self.size[idx]),
+                                float(self.angle[idx]), float(self.response[idx]), int(self.octave[idx]))
+        return KeypointSet(*(getattr(self, f)[idx] for f in self.FIELDS))
+
+    def __iter__(self):
+        return iter(self.to_cv())
+
+    def to_cv(self) -> List[cv2.KeyPoint]:
+        """Lista de cv2.KeyPoint (para detector.compute, drawKeypoints, ...)."""
+        return [self[i] for i in range(len(self))]
+
+    @property
+    def xy(self) -> np.ndarray:
+        """Posiciones Nx2 (float32)."""
+        return np.column_stack((self.x, self.y))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, f).nbytes for f in self.FIELDS)
+
+    def scaled(self, factor: float) -> "KeypointSet":
+        """Posiciones y tamaños multiplicados por 'factor' (cambio de resolución)."""
+        return KeypointSet(self.x * factor, self.y * factor, self.size * factor,
+                           self.angle, self.response, self.octave)
+
+    def shifted(self, dx: float, dy: float) -> "KeypointSet":
+        return KeypointSet(self.x + dx, self.y + dy, self.size,
+                           self.angle, self.response, self.octave)
+
+    def index(self, cell: float) -> GridIndex:
+        """GridIndex de lado 'cell' sobre las posiciones (se construye una vez por lado)."""
+        cell = max(float(cell), 1.0)
+        idx = self._indexes.get(cell)
+        if idx is None:
+            idx = GridIndex(self.xy, cell)
+            self._indexes[cell] = idx
+        return idx
+
+    def within(self, pts: np.ndarray, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Pares (índice en pts, índice de keypoint) a distancia <= radius."""
+        return self.index(radius).query_pairs(pts, radius)
+
+
+def _keypoint_xy(kps) -> np.ndarray:
+    """Posiciones Nx2 float32 de un KeypointSet o de una secuencia de cv2.KeyPoint."""
+    if isinstance(kps, KeypointSet):
+        return kps.xy
+    return np.float32([k.pt for k in kps]).reshape(-1, 2)
+
+
+def _match_points(kp1, kp2, matches: Sequence[cv2.DMatch]) -> Tuple[np.ndarray, np.ndarray]:
+    """Coordenadas Nx2 (float32) de origen y destino de cada match."""
+    n = len(matches)
+    q = np.fromiter((m.queryIdx for m in matches), np.int64, n)
+    t = np.fromiter((m.trainIdx for m in matches), np.int64, n)
+    return _keypoint_xy(kp1)[q], _keypoint_xy(kp2)[t]
 
 
 # --------------------------- Núcleo: matching y scoring ---------------------------
 
+# Prefijos de parámetros propios de cada detector
+_DETECTOR_PREFIXES = ("orb_", "sift_", "akaze_")
+
+# Coste base de un par sin transformación estimada (coste = penalización - inliers)
+_NO_H_PENALTY = 1000.0
+
+# Parámetros opcionales de match_and_score que pueden venir en un dict plano (grid, JSON)
+_ENGINE_KEYS = ("scale_policy", "max_working_side", "gsd1", "gsd2", "max_keypoints", "kp_selection",
+                "tile_size", "tile_overlap", "tile_max_keypoints", "detect_threads",
+                "transform_model", "ransac_method", "ransac_max_iters", "ransac_time_limit_s", "ransac_confidence",
+                "descriptor_norm", "descriptor_storage", "descriptor_pca", "guide_H", "guide_radius", "profile")
+
+
+def _split_params(params: Dict) -> Tuple[Dict, Dict]:
+    """Separa un dict plano en (parámetros del detector, kwargs extra de match_and_score)."""
+    params = params or {}
+    det_params = {k: v for k, v in params.items() if k.startswith(_DETECTOR_PREFIXES)}
+    engine_kw = {k: params[k] for k in _ENGINE_KEYS if k in params}
+    return det_params, engine_kw
+
+
 @dataclass
 class MatchResult:
     H: Optional[np.ndarray]
@@ -167,53 +728,804 @@ class MatchResult:
     good_matches: int
     cost: float
     mask_inliers: Optional[np.ndarray]
+    model: str = "homography"
+    # Keypoints (en coordenadas de resolución completa) y matches ordenados por ratio
+    # sobre los que se calculó la máscara
+    kp1: Optional[KeypointSet] = None
+    kp2: Optional[KeypointSet] = None
+    matches: Optional[List[cv2.DMatch]] = None
+    # Factores de escala de trabajo aplicados a img1/img2 antes de detectar
+    scales: Tuple[float, float] = (1.0, 1.0)
+    # Tiempos por etapa, contadores y memoria (sólo con profile=True)
+    profile: Optional[StageProfile] = None
+
+
+def working_scales(shape1: Tuple[int, int],
+                   shape2: Tuple[int, int],
+                   policy: str = "area",
+                   gsd1: Optional[float] = None,
+                   gsd2: Optional[float] = None,
+                   max_side: Optional[int] = None,
+                   min_reduction: float = 0.9) -> Tuple[float, float]:
+    """
+    Factores de escala (<= 1) para llevar ambas imágenes a una escala de muestreo común
+    antes de detectar.
+
+    policy: {'none','area','gsd'}
+    - 'gsd': con el tamaño de píxel en terreno de ambas (gsd1, gsd2) se baja la más fina
+      al GSD de la más gruesa. Sin ambos GSD se comporta como 'area'.
+    - 'area': sin metadatos se asume una huella similar y se reduce la de más píxeles
+      hasta igualar el área (en píxeles) de la otra.
+    max_side limita además el lado mayor de trabajo. Reducciones menores que
+    min_reduction no compensan el remuestreo y se ignoran.
+    """
+    p = (policy or "none").lower()
+    if p not in ("none", "area", "gsd"):
+        raise ValueError("scale_policy debe ser {'none','area','gsd'}")
+    s1 = s2 = 1.0
+    if p == "gsd" and gsd1 and gsd2:
+        target = max(float(gsd1), float(gsd2))
+        s1, s2 = float(gsd1) / target, float(gsd2) / target
+    elif p != "none":
+        a1 = float(shape1[0]) * float(shape1[1])
+        a2 = float(shape2[0]) * float(shape2[1])
+        if a1 > a2:
+            s1 = math.sqrt(a2 / a1)
+        elif a2 > a1:
+            s2 = math.sqrt(a1 / a2)
+    if max_side:
+        s1 = min(s1, float(max_side) / max(shape1[:2]))
+        s2 = min(s2, float(max_side) / max(shape2[:2]))
+    s1 = 1.0 if s1 > min_reduction else s1
+    s2 = 1.0 if s2 > min_reduction else s2
+    return s1, s2
+
+
+def _downscale(img: np.ndarray, scale: float) -> np.ndarray:
+    """Reducción con INTER_AREA (sin aliasing); scale=1 devuelve la misma imagen."""
+    if scale >= 1.0:
+        return img
+    h, w = img.shape[:2]
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def _rescale_keypoints(kps, scale: float) -> KeypointSet:
+    """Lleva keypoints detectados a escala 'scale' a coordenadas de resolución completa."""
+    kps = KeypointSet.from_cv(kps)
+    return kps if scale == 1.0 else kps.scaled(1.0 / scale)
+
+
+def _grid_select(xy: np.ndarray,
+                 response: np.ndarray,
+                 n: int,
+                 shape: Tuple[int, int],
+                 per_cell: int = 10) -> np.ndarray:
+    """
+    Bucketing en rejilla: reparte el cupo 'n' entre celdas (proporcionales al aspecto
+    de la imagen), toma los de mayor respuesta de cada celda y rellena el cupo sobrante
+    con los mejores restantes. Devuelve índices seleccionados.
+    """
+    h, w = shape[:2]
+    n_cells = max(1, n // per_cell)
+    ncols = max(1, int(round(math.sqrt(n_cells * w / max(h, 1)))))
+    nrows = max(1, int(round(n_cells / ncols)))
+    cx = np.clip((xy[:, 0] * ncols / max(w, 1)).astype(np.int64), 0, ncols - 1)
+    cy = np.clip((xy[:, 1] * nrows / max(h, 1)).astype(np.int64), 0, nrows - 1)
+    cell = cy * ncols + cx
+
+    # Orden por celda y, dentro de cada celda, por respuesta descendente
+    order = np.lexsort((-response, cell))
+    sorted_cell = cell[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_cell)) + 1]
+    counts = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+
+    quota = int(math.ceil(n / float(ncols * nrows)))
+    chosen = order[rank < quota]
+    if len(chosen) > n:
+        chosen = chosen[np.argsort(-response[chosen], kind="stable")[:n]]
+    elif len(chosen) < n:
+        rest = order[rank >= quota]
+        rest = rest[np.argsort(-response[rest], kind="stable")[:n - len(chosen)]]
+        chosen = np.concatenate([chosen, rest])
+    return chosen
+
+
+def _anms_select(xy: np.ndarray,
+                 response: np.ndarray,
+                 n: int,
+                 c_robust: float = 0.9,
+                 pool_factor: int = 3,
+                 block: int = 1024) -> np.ndarray:
+    """
+    Adaptive non-maximal suppression (Brown et al.): radio de supresión de cada punto =
+    distancia al punto más cercano con respuesta claramente mayor; se quedan los n de
+    mayor radio. Para acotar el coste O(m^2) se parte de los pool_factor*n más fuertes.
+    """
+    pool = np.argsort(-response, kind="stable")[:max(n, pool_factor * n)]
+    pts = xy[pool].astype(np.float32)
+    resp = response[pool]
+    m = len(pool)
+    sq = (pts ** 2).sum(axis=1)
+    radius = np.full(m, np.inf, dtype=np.float32)
+    for i0 in range(1, m, block):
+        i1 = min(m, i0 + block)
+        # Sólo pueden suprimir los puntos anteriores (mayor respuesta)
+        d2 = sq[i0:i1, None] + sq[None, :i1] - 2.0 * (pts[i0:i1] @ pts[:i1].T)
+        stronger = resp[None, :i1] * c_robust > resp[i0:i1, None]
+        d2[~stronger] = np.inf
+        radius[i0:i1] = np.sqrt(np.maximum(d2.min(axis=1), 0.0))
+    return pool[np.argsort(-radius, kind="stable")[:n]]
+
+
+def _select_indices(kps,
+                    max_keypoints: int,
+                    method: str = "grid",
+                    image_shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """Índices de los keypoints elegidos por select_keypoints (en el orden de selección)."""
+    if max_keypoints is None or max_keypoints <= 0 or len(kps) <= max_keypoints:
+        return np.arange(len(kps))
+    kps = KeypointSet.from_cv(kps)
+    xy, response = kps.xy, kps.response
+    m = (method or "grid").lower()
+    if m == "response":
+        idx = np.argsort(-response, kind="stable")[:max_keypoints]
+    elif m == "grid":
+        if image_shape is None:
+            image_shape = (int(xy[:, 1].max()) + 1, int(xy[:, 0].max()) + 1)
+        idx = _grid_select(xy, response, max_keypoints, image_shape)
+    elif m == "anms":
+        idx = _anms_select(xy, response, max_keypoints)
+    else:
+        raise ValueError("kp_selection debe ser {'grid','anms','response'}")
+    return idx
+
+
+def select_keypoints(kps,
+                     max_keypoints: int,
+                     method: str = "grid",
+                     image_shape: Optional[Tuple[int, int]] = None):
+    """
+    Limita el nº de keypoints a 'max_keypoints' con selección espacialmente uniforme.
+    Devuelve el mismo tipo que recibe (KeypointSet o lista de cv2.KeyPoint).
+
+    method: {'grid','anms','response'}
+    - 'grid': bucketing en rejilla (rápido, vectorizado).
+    - 'anms': adaptive non-maximal suppression.
+    - 'response': los de mayor respuesta (sin control espacial).
+    """
+    idx = _select_indices(kps, max_keypoints, method, image_shape)
+    if isinstance(kps, KeypointSet):
+        return kps[idx]
+    kps = list(kps)
+    return [kps[i] for i in idx]
+
 
+# Solape por defecto entre teselas (px) para detectores sin borde conocido
+MIN_TILE_OVERLAP = 128
 
-def detect_and_describe(img: np.ndarray, detector) -> Tuple[List[cv2.KeyPoint], Optional[np.ndarray]]:
-    kps, desc = detector.detectAndCompute(img, None)
-    return kps, desc
+
+def _default_tile_overlap(detector, tile_size: int) -> int:
+    """
+    Solape por defecto: el borde que el detector descarta en su nivel de pirámide más
+    grueso, llevado a resolución completa. En ORB es max(edgeThreshold, patchSize) *
+    scaleFactor^(nlevels-1) (31·1.2^7 ≈ 111 px con los valores por defecto); para el
+    resto, MIN_TILE_OVERLAP. Nunca menos de MIN_TILE_OVERLAP ni más de tile_size.
+    """
+    det = detector() if callable(detector) else detector
+    overlap = MIN_TILE_OVERLAP
+    if isinstance(det, cv2.ORB):
+        border = max(det.getEdgeThreshold(), det.getPatchSize())
+        overlap = max(overlap, int(math.ceil(border * det.getScaleFactor() ** (det.getNLevels() - 1))))
+    return min(overlap, int(tile_size))
+
+
+def _detector_budget(detector) -> Optional[int]:
+    """Nº máximo de keypoints que el detector devuelve por llamada (None si no tiene)."""
+    det = detector() if callable(detector) else detector
+    if isinstance(det, cv2.ORB):
+        return int(det.getMaxFeatures()) or None
+    if hasattr(det, "getNFeatures"):  # SIFT (0 = sin límite)
+        return int(det.getNFeatures()) or None
+    return None
+
+
+def _tile_windows(shape: Tuple[int, int],
+                  tile_size: int,
+                  overlap: int) -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int, int]]]:
+    """
+    Divide la imagen en teselas. Cada tesela tiene un 'núcleo' (sin solape, cubre la
+    imagen exactamente una vez) y una ventana de lectura ampliada 'overlap' px por lado.
+    Devuelve [((x0,y0,x1,y1) ventana, (cx0,cy0,cx1,cy1) núcleo), ...].
+    """
+    h, w = shape[:2]
+    out = []
+    for cy0 in range(0, h, tile_size):
+        for cx0 in range(0, w, tile_size):
+            cx1, cy1 = min(w, cx0 + tile_size), min(h, cy0 + tile_size)
+            win = (max(0, cx0 - overlap), max(0, cy0 - overlap),
+                   min(w, cx1 + overlap), min(h, cy1 + overlap))
+            out.append((win, (cx0, cy0, cx1, cy1)))
+    return out
+
+
+def _detect_tiled(img: np.ndarray,
+                  detector,
+                  tile_size: int,
+                  tile_overlap: Optional[int],
+                  tile_max_keypoints: Optional[int],
+                  kp_selection: str,
+                  n_threads: Optional[int],
+                  max_keypoints: Optional[int] = None) -> Tuple[KeypointSet, Optional[np.ndarray]]:
+    """
+    Detección por teselas en un pool de hilos (OpenCV libera el GIL).
+
+    Cada tesela detecta sobre su ventana ampliada y sólo conserva los keypoints de su
+    núcleo, de modo que los puntos del solape no se duplican y los descriptores cerca
+    del borde ven el contexto completo. tile_max_keypoints es el cupo por tesela; por
+    defecto es el presupuesto de la imagen (max_keypoints o, si no, el del detector,
+    p.ej. nfeatures de ORB) repartido según el área del núcleo, para que teselar no
+    multiplique el nº de keypoints. Sin presupuesto alguno (SIFT con nfeatures=0,
+    AKAZE) cada tesela usa detectAndCompute sobre su ventana y filtra al núcleo, sin
+    construir la pirámide dos veces.
+    Si 'detector' es una fábrica (callable), cada hilo crea su propio detector.
+
+    El solape debe cubrir el borde que el detector ignora en sus escalas gruesas; si es
+    menor, se pierden keypoints grandes junto a las costuras. Con tile_overlap=None se
+    deriva del detector (_default_tile_overlap). Más solape = más píxeles procesados
+    por tesela (con tesela t y solape o, ~((t+2o)/t)^2 veces el área).
+    """
+    if tile_overlap is None:
+        tile_overlap = _default_tile_overlap(detector, int(tile_size))
+    budget = max_keypoints or _detector_budget(detector)
+    img_area = float(img.shape[0] * img.shape[1])
+    local = threading.local()
+
+    def _get_detector():
+        if not callable(detector):
+            return detector
+        if not hasattr(local, "det"):
+            local.det = detector()
+        return local.det
+
+    def _run(tile):
+        (x0, y0, x1, y1), (cx0, cy0, cx1, cy1) = tile
+        det = _get_detector()
+        sub = img[y0:y1, x0:x1]
+        quota = tile_max_keypoints
+        if quota is None and budget:
+            quota = max(1, int(math.ceil(budget * (cx1 - cx0) * (cy1 - cy0) / img_area)))
+        if quota is None:
+            # Sin cupo: una sola pasada y filtro al núcleo
+            kps, desc = det.detectAndCompute(sub, None)
+            if desc is None or not kps:
+                return None, None
+            kps = KeypointSet.from_cv(kps).shifted(x0, y0)
+            core = (kps.x >= cx0) & (kps.x < cx1) & (kps.y >= cy0) & (kps.y < cy1)
+            return kps[core], desc[core]
+        kps = det.detect(sub, None)
+        kps = [k for k in kps
+               if cx0 <= k.pt[0] + x0 < cx1 and cy0 <= k.pt[1] + y0 < cy1]
+        kps = select_keypoints(kps, quota, kp_selection, sub.shape)
+        if not kps:
+            return None, None
+        kps, desc = det.compute(sub, kps)
+        return KeypointSet.from_cv(kps).shifted(x0, y0), desc
+
+    tiles = _tile_windows(img.shape, int(tile_size), int(tile_overlap))
+    workers = n_threads or min(len(tiles), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(_run, tiles))
+
+    results = [(kps, desc) for kps, desc in results if desc is not None and kps]
+    if not results:
+        return KeypointSet.from_cv([]), None
+    return (KeypointSet.concat([kps for kps, _ in results]),
+            np.vstack([desc for _, desc in results]))
+
+
+def detect_and_describe(img: np.ndarray,
+                        detector,
+                        max_keypoints: Optional[int] = None,
+                        kp_selection: str = "grid",
+                        tile_size: Optional[int] = None,
+                        tile_overlap: Optional[int] = None,
+                        tile_max_keypoints: Optional[int] = None,
+                        n_threads: Optional[int] = None,
+                        descriptor_norm: Optional[str] = None) -> Tuple[KeypointSet, Optional[np.ndarray]]:
+    """
+    Detecta y describe keypoints. Con max_keypoints se aplica un presupuesto de puntos
+    (selección uniforme, ver select_keypoints) antes de calcular descriptores, de modo
+    que el coste de knnMatch queda acotado y los matches cubren mejor la imagen.
+
+    Con tile_size, si la imagen es mayor que una tesela, la detección se hace por teselas
+    solapadas en paralelo (ver _detect_tiled); 'detector' puede ser entonces una fábrica
+    sin argumentos para no compartir el mismo objeto OpenCV entre hilos.
+
+    descriptor_norm post-procesa los descriptores float (ver normalize_descriptors).
+    Los keypoints se devuelven como KeypointSet.
+    """
+    if tile_size and (img.shape[0] > tile_size or img.shape[1] > tile_size):
+        kps, desc = _detect_tiled(img, detector, tile_size, tile_overlap,
+                                  tile_max_keypoints, kp_selection, n_threads, max_keypoints)
+        if max_keypoints and len(kps) > max_keypoints:
+            idx = _select_indices(kps, max_keypoints, kp_selection, img.shape)
+            kps, desc = kps[idx], desc[idx]
+        return kps, normalize_descriptors(desc, descriptor_norm)
+    if callable(detector):
+        detector = detector()
+    if not max_keypoints:
+        kps, desc = detector.detectAndCompute(img, None)
+        return KeypointSet.from_cv(kps), normalize_descriptors(desc, descriptor_norm)
+    kps = detector.detect(img, None)
+    kps = select_keypoints(kps, max_keypoints, kp_selection, img.shape)
+    if not kps:
+        return KeypointSet.from_cv([]), None
+    kps, desc = detector.compute(img, kps)
+    return KeypointSet.from_cv(kps), normalize_descriptors(desc, descriptor_norm)
+
+
+# --------------------------- Normalización y descriptores compactos ---------------------------
+
+# Post-procesos de descriptores float (los binarios no cambian)
+DESCRIPTOR_NORMS = ("none", "l2", "rootsift", "whiten")
+
+# Representaciones de almacenamiento de descriptores float (los binarios no cambian)
+DESCRIPTOR_STORAGES = ("float32", "float16", "uint8")
+# Norma L2 a la que se llevan los descriptores antes de cuantizar a uint8 (la de SIFT en OpenCV)
+_UINT8_DESCRIPTOR_NORM = 512.0
+
+
+def normalize_descriptors(desc: Optional[np.ndarray], method: Optional[str] = None) -> Optional[np.ndarray]:
+    """
+    Post-proceso por descriptor de descriptores float (SIFT, KAZE):
+      - 'l2': norma L2 unidad
+      - 'rootsift': normaliza L1 y toma la raíz (Arandjelović & Zisserman); la distancia
+        L2 resultante equivale a la de Hellinger y suele dar más inliers con el mismo coste
+      - 'whiten': RootSIFT aquí; el blanqueo es de conjunto y lo aplica MatchSession con
+        una base ajustada sobre img2 (fit_descriptor_pca(whiten=True))
+    None/'none' y los descriptores binarios se devuelven sin cambios.
+    """
+    if method is None or method == "none" or desc is None or desc.dtype == np.uint8:
+        return desc
+    if method not in DESCRIPTOR_NORMS:
+        raise ValueError(f"descriptor_norm debe ser uno de {DESCRIPTOR_NORMS}")
+    out = np.asarray(desc, dtype=np.float32)
+    if method == "l2":
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+    out = np.abs(out) / np.maximum(np.abs(out).sum(axis=1, keepdims=True), 1e-12)
+    return np.sqrt(out)
+
+
+def fit_descriptor_pca(desc: np.ndarray,
+                       n_components: Optional[int] = None,
+                       whiten: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Base PCA (media, componentes n_components x D) de un conjunto de descriptores float.
+    Se ajusta sobre una sola imagen (la referencia) y se aplica a las dos con
+    compact_descriptors, para que las distancias sean comparables. Con whiten=True
+    cada componente se divide por su desviación típica (blanqueo; n_components=None
+    conserva todas las dimensiones).
+    """
+    X = np.asarray(desc, dtype=np.float64)
+    n_components = int(min(n_components or X.shape[1], X.shape[1]))
+    mean = X.mean(axis=0)
+    cov = np.cov(X - mean, rowvar=False) if len(X) > 1 else np.eye(X.shape[1])
+    vals, vecs = np.linalg.eigh(cov)  # autovalores ascendentes
+    basis = vecs[:, ::-1][:, :n_components].T
+    if whiten:
+        # Regularizado con la varianza media: las direcciones casi vacías no se disparan
+        var = vals[::-1][:n_components]
+        basis = basis / np.sqrt(np.maximum(var, 0.0) + max(float(var.mean()), 1e-12) * 0.1)[:, None]
+    return mean.astype(np.float32), np.ascontiguousarray(basis, dtype=np.float32)
+
+
+def check_descriptor_options(descriptor_norm: Optional[str] = None,
+                             descriptor_storage: str = "float32",
+                             descriptor_pca: Optional[int] = None) -> None:
+    """
+    ValueError si la combinación de post-proceso y almacenamiento no es válida: uint8
+    cuantiza descriptores de norma fija y no admite proyecciones (PCA ni el blanqueo
+    de descriptor_norm='whiten', que es una PCA blanqueada).
+    """
+    if descriptor_storage != "uint8":
+        return
+    if descriptor_norm == "whiten":
+        raise ValueError("descriptor_norm='whiten' no es compatible con descriptor_storage='uint8'")
+    if descriptor_pca:
+        raise ValueError("descriptor_storage='uint8' no es compatible con descriptor_pca")
+
+
+def _descriptor_options_ok(params: Dict) -> bool:
+    try:
+        check_descriptor_options(params.get("descriptor_norm"),
+                                 params.get("descriptor_storage", "float32"),
+                                 params.get("descriptor_pca"))
+    except ValueError:
+        return False
+    return True
+
+
+def compact_descriptors(desc: Optional[np.ndarray],
+                        storage: str = "float32",
+                        pca: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Optional[np.ndarray]:
+    """
+    Representación compacta de descriptores float (SIFT, KAZE):
+      - pca: proyección (media, base) de fit_descriptor_pca (p.ej. 128 -> 64 dimensiones)
+      - 'float16': mitad de memoria; se convierte a float32 sólo al emparejar
+      - 'uint8': cada descriptor se lleva a norma L2 512 (la convención de SIFT en
+        OpenCV) y se satura a 0..255; 4x menos memoria y BF L2 lo empareja tal cual.
+        No admite PCA (las componentes tienen signo).
+    Los descriptores binarios (uint8 de ORB/AKAZE) se devuelven sin cambios.
+    """
+    if storage not in DESCRIPTOR_STORAGES:
+        raise ValueError(f"descriptor_storage debe ser uno de {DESCRIPTOR_STORAGES}")
+    if desc is None or desc.dtype == np.uint8:
+        return desc
+    out = np.asarray(desc, dtype=np.float32)
+    if pca is not None:
+        if storage == "uint8":
+            raise ValueError("descriptor_storage='uint8' no es compatible con descriptor_pca")
+        mean, basis = pca
+        out = (out - mean) @ basis.T
+    if storage == "float16":
+        return out.astype(np.float16)
+    if storage == "uint8":
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        out = out * (_UINT8_DESCRIPTOR_NORM / np.maximum(norms, 1e-12))
+        return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(out)
+
+
+def _matchable(desc: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """OpenCV no empareja float16: se sube a float32 justo antes del knn."""
+    if desc is not None and desc.dtype == np.float16:
+        return desc.astype(np.float32)
+    return desc
+
+
+def knn_pairs(d1: np.ndarray,
+              d2: np.ndarray,
+              matcher: cv2.DescriptorMatcher) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    knnMatch(k=2) reducido a arrays (query, train, dist_1º, dist_2º) de los pares
+    completos. Es la parte cara del matching; el ratio test se aplica después
+    (ratio_filter) sin volver a emparejar. Acepta descriptores compactos
+    (compact_descriptors).
+    """
+    empty = (np.empty(0, np.int32), np.empty(0, np.int32),
+             np.empty(0, np.float32), np.empty(0, np.float32))
+    if d1 is None or d2 is None or len(d1) == 0 or len(d2) == 0:
+        return empty
+    d1, d2 = _matchable(d1), _matchable(d2)
+    if isinstance(matcher, BlockedMatcher):
+        return matcher.top2(d1, d2)
+    knn = [pair for pair in matcher.knnMatch(d1, d2, k=2) if len(pair) == 2]
+    if not knn:
+        return empty
+    query = np.fromiter((m.queryIdx for m, _ in knn), np.int32, len(knn))
+    train = np.fromiter((m.trainIdx for m, _ in knn), np.int32, len(knn))
+    dist1 = np.fromiter((m.distance for m, _ in knn), np.float32, len(knn))
+    dist2 = np.fromiter((n.distance for _, n in knn), np.float32, len(knn))
+    return query, train, dist1, dist2
+
+
+def ratio_filter(pairs: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+                 ratio_thresh: float = 0.75,
+                 sort_by_ratio: bool = True,
+                 return_ratios: bool = False):
+    """Ratio test de Lowe sobre la salida de knn_pairs (ver knn_ratio_match)."""
+    query, train, dist1, dist2 = pairs
+    valid = dist2 > 0
+    ratios = np.full(dist1.shape, np.inf, dtype=np.float32)
+    np.divide(dist1, dist2, out=ratios, where=valid)
+    keep = np.flatnonzero(ratios < ratio_thresh)
+    if sort_by_ratio and keep.size > 1:
+        keep = keep[np.argsort(ratios[keep], kind="stable")]
+    good = [cv2.DMatch(int(query[i]), int(train[i]), 0, float(dist1[i])) for i in keep]
+    return (good, ratios[keep]) if return_ratios else good
 
 
 def knn_ratio_match(d1: np.ndarray,
                     d2: np.ndarray,
                     matcher: cv2.DescriptorMatcher,
-                    ratio_thresh: float = 0.75) -> List[cv2.DMatch]:
-    if d1 is None or d2 is None or len(d1) == 0 or len(d2) == 0:
-        return []
-    knn = matcher.knnMatch(d1, d2, k=2)
-    good = []
-    for pair in knn:
-        if len(pair) == 2:
-            m, n = pair
-            if n.distance == 0:
-                continue
-            if m.distance / n.distance < ratio_thresh:
-                good.append(m)
-    return good
+                    ratio_thresh: float = 0.75,
+                    sort_by_ratio: bool = True,
+                    return_ratios: bool = False):
+    """
+    Ratio test de Lowe sobre knnMatch(k=2).
+
+    Los matches se devuelven ordenados por distintividad (ratio d1/d2 ascendente),
+    de forma que los estimadores tipo PROSAC muestreen primero las mejores
+    hipótesis. Con return_ratios=True devuelve (matches, ratios) con el mismo orden.
+    """
+    return ratio_filter(knn_pairs(d1, d2, matcher), ratio_thresh,
+                        sort_by_ratio=sort_by_ratio, return_ratios=return_ratios)
+
+
+# --------------------------- Matching guiado ---------------------------
+
+def _pair_distances(d1: np.ndarray, d2: np.ndarray, q: np.ndarray, t: np.ndarray,
+                    binary: bool, chunk: int = 65536) -> np.ndarray:
+    """Distancia (L2 o Hamming) entre d1[q[i]] y d2[t[i]] para cada par, por trozos."""
+    out = np.empty(len(q), np.float32)
+    for i in range(0, len(q), chunk):
+        a, b = d1[q[i:i + chunk]], d2[t[i:i + chunk]]
+        if binary:
+            x = np.bitwise_xor(a, b)
+            bits = np.bitwise_count(x) if hasattr(np, "bitwise_count") else _POPCOUNT8[x]
+            out[i:i + chunk] = bits.sum(axis=1, dtype=np.int32)
+        else:
+            diff = a.astype(np.float32) - b.astype(np.float32)
+            out[i:i + chunk] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+    return out
+
+
+def guided_knn_pairs(xy1: np.ndarray,
+                     xy2: np.ndarray,
+                     d1: np.ndarray,
+                     d2: np.ndarray,
+                     H: np.ndarray,
+                     radius: float,
+                     binary: bool,
+                     index: Optional[GridIndex] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    knn(k=2) guiado por una transformación aproximada H (img1 -> img2): cada keypoint
+    de img1 se proyecta con H y sólo se compara con los de img2 a menos de 'radius'
+    px de la predicción (GridIndex sobre xy2). Mismo formato que knn_pairs; como allí,
+    sólo se devuelven consultas con al menos dos candidatos, de modo que el ratio test
+    compara con el segundo mejor de la zona. Reduce los candidatos y los falsos
+    matches en texturas repetitivas.
+    """
+    empty = (np.empty(0, np.int32), np.empty(0, np.int32),
+             np.empty(0, np.float32), np.empty(0, np.float32))
+    if d1 is None or d2 is None or len(d1) == 0 or len(d2) < 2:
+        return empty
+    pred = cv2.perspectiveTransform(np.asarray(xy1, np.float64).reshape(-1, 1, 2),
+                                    np.asarray(H, np.float64)).reshape(-1, 2)
+    if index is None:
+        index = GridIndex(xy2, max(float(radius), 1.0))
+    q, t = index.query_pairs(pred, radius)
+    if q.size == 0:
+        return empty
+    dist = _pair_distances(_matchable(d1), _matchable(d2), q, t, binary)
+
+    # Top-2 por consulta: ordenar por (consulta, distancia) y tomar los dos primeros
+    order = np.lexsort((dist, q))
+    qs = q[order]
+    first = np.flatnonzero(np.r_[True, qs[1:] != qs[:-1]])
+    sizes = np.diff(np.r_[first, len(qs)])
+    first = first[sizes >= 2]
+    best, second = order[first], order[first + 1]
+    return (q[best].astype(np.int32), t[best].astype(np.int32),
+            dist[best], dist[second])
+
+
+def load_guide_homographies(hjson_path: str) -> Dict[Tuple[str, str], np.ndarray]:
+    """
+    Homografías aproximadas {(img1, img2): H} de un JSON de save_homographies_json
+    (p.ej. de una ejecución anterior o de un nivel de overview), para guide_H.
+    """
+    with open(hjson_path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    entries = payload.get("pairs", [payload]) if isinstance(payload, dict) else payload
+    return {(str(e["img1"]), str(e["img2"])): np.asarray(e["H"], dtype=np.float64)
+            for e in entries if e.get("H") is not None}
+
+
+def _guide_for(guides: Optional[Dict[Tuple[str, str], np.ndarray]],
+               img1, img2) -> Optional[np.ndarray]:
+    """H guía del par: por ruta y, si no, por nombre de fichero. None si no hay."""
+    if not guides:
+        return None
+    key = (_image_label(img1), _image_label(img2))
+    if None in key:
+        return None
+    if key in guides:
+        return guides[key]
+    base = tuple(os.path.basename(k) for k in key)
+    for (a, b), H in guides.items():
+        if (os.path.basename(a), os.path.basename(b)) == base:
+            return H
+    return None
+
+
+def _ransac_required_iters(inlier_ratio: float, sample_size: int, confidence: float) -> float:
+    """Nº de iteraciones RANSAC necesarias para alcanzar 'confidence' con ese ratio de inliers."""
+    w = float(inlier_ratio) ** sample_size
+    if w <= 0.0:
+        return float("inf")
+    if w >= 1.0:
+        return 1.0
+    return math.log(1.0 - confidence) / math.log(1.0 - w)
+
+
+def _robust_method_flag(method: str) -> int:
+    """
+    method: {'ransac','prosac'}
+    - 'prosac' usa USAC_PROSAC (OpenCV >= 4.5) y requiere matches ordenados por calidad;
+      si la build de OpenCV no lo trae, se recurre a RANSAC clásico.
+    """
+    m = (method or "ransac").lower()
+    if m == "prosac":
+        return getattr(cv2, "USAC_PROSAC", cv2.RANSAC)
+    if m == "ransac":
+        return cv2.RANSAC
+    raise ValueError("ransac_method debe ser {'ransac','prosac'}")
+
+
+# Modelos de transformación: (nº mínimo de puntos, grados de libertad)
+_TRANSFORM_MODELS = {
+    "similarity": (2, 4),   # estimateAffinePartial2D: rotación + escala uniforme + traslación
+    "affine": (3, 6),       # estimateAffine2D
+    "homography": (4, 8),   # findHomography
+}
 
 
-def estimate_homography(kp1: Sequence[cv2.KeyPoint],
-                        kp2: Sequence[cv2.KeyPoint],
+def _fit_transform(src_pts: np.ndarray,
+                   dst_pts: np.ndarray,
+                   model: str,
+                   method: str,
+                   ransac_thresh: float,
+                   max_iters: int,
+                   confidence: float) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Una pasada del estimador robusto de OpenCV; devuelve siempre H 3x3 (o None) y máscara."""
+    flag = _robust_method_flag(method)
+    if model == "homography":
+        return cv2.findHomography(src_pts, dst_pts, flag, ransac_thresh,
+                                  maxIters=max_iters, confidence=confidence)
+    if model == "affine":
+        fn = cv2.estimateAffine2D
+    else:
+        # estimateAffinePartial2D no admite los métodos USAC
+        fn = cv2.estimateAffinePartial2D
+        flag = cv2.RANSAC
+    A, mask = fn(src_pts, dst_pts, method=flag, ransacReprojThreshold=ransac_thresh,
+                 maxIters=max_iters, confidence=confidence)
+    if A is None:
+        return None, mask
+    return np.vstack([A, [0.0, 0.0, 1.0]]), mask
+
+
+def residual_vectors(src_pts: np.ndarray, dst_pts: np.ndarray, H: np.ndarray) -> np.ndarray:
+    """Residuos H·src - dst (Nx2, px de la imagen destino) en una sola pasada vectorizada."""
+    src = np.asarray(src_pts, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst_pts, dtype=np.float64).reshape(-1, 2)
+    if src.shape[0] == 0:
+        return np.empty((0, 2))
+    proj = src @ H[:, :2].T + H[:, 2]
+    return proj[:, :2] / proj[:, 2:3] - dst
+
+
+def _transfer_errors(src_pts: np.ndarray, dst_pts: np.ndarray, H: np.ndarray) -> np.ndarray:
+    """Errores de transferencia ||H·src - dst|| (px) para todas las correspondencias."""
+    return np.linalg.norm(residual_vectors(src_pts, dst_pts, H), axis=1)
+
+
+def gric_score(errors: np.ndarray, model: str, sigma: float) -> float:
+    """
+    GRIC de Torr (menor es mejor): penaliza residuos robustos + complejidad del modelo.
+    Datos 2D-2D (r=4), variedad de dimensión d=2, k = grados de libertad del modelo.
+    """
+    n = int(errors.size)
+    if n == 0:
+        return float("inf")
+    r, d, k = 4, 2, _TRANSFORM_MODELS[model][1]
+    lam1, lam2, lam3 = math.log(r), math.log(r * n), 2.0
+    rho = np.minimum((errors / max(sigma, 1e-6)) ** 2, lam3 * (r - d))
+    return float(rho.sum() + lam1 * d * n + lam2 * k)
+
+
+def estimate_transform(kp1: Union[KeypointSet, Sequence[cv2.KeyPoint]],
+                       kp2: Union[KeypointSet, Sequence[cv2.KeyPoint]],
+                       matches: Sequence[cv2.DMatch],
+                       model: str = "homography",
+                       ransac_thresh: float = 3.0,
+                       confidence: float = 0.999,
+                       max_iters: int = 2000,
+                       time_limit_s: Optional[float] = None,
+                       method: str = "ransac") -> Tuple[Optional[np.ndarray], Optional[np.ndarray], str]:
+    """
+    Estimación robusta de la transformación con presupuesto acotado.
+
+    - model: {'similarity','affine','homography','auto'}. Los modelos de menos grados de
+      libertad necesitan menos puntos por muestra y convergen en muchas menos iteraciones.
+      'auto' ajusta los tres y se queda con el de menor GRIC. time_limit_s es un plazo
+      común que se reparte entre los tres (el tiempo que no gasta un modelo pasa a los
+      siguientes). Sin time_limit_s la homografía conserva max_iters completo (es la que
+      más iteraciones necesita con pocos inliers) y similitud y afín, que convergen
+      mucho antes, reciben un tercio cada una.
+    - max_iters: tope de iteraciones (los pares sin solución fallan rápido).
+    - time_limit_s: si se indica, se ejecuta por bloques de iteraciones crecientes
+      (100, 200, 400, ...) y se queda con el mejor consenso. Cada bloque es una pasada
+      independiente de OpenCV (no continúa la anterior), así que la confianza se mide
+      por bloque: se para cuando el último bloque por sí solo tuvo iteraciones
+      suficientes para 'confidence' con el mejor ratio de inliers, o al agotar el tiempo.
+
+    Devuelve (H 3x3 o None, máscara de inliers o None, modelo usado).
+    """
+    m_name = (model or "homography").lower()
+    if m_name == "auto":
+        best = (None, None, "homography")
+        best_score = float("inf")
+        src_pts, dst_pts = _match_points(kp1, kp2, matches)
+        cands = list(_TRANSFORM_MODELS)
+        split_iters = max(1, int(max_iters) // len(cands))
+        deadline = None if time_limit_s is None else time.perf_counter() + float(time_limit_s)
+        for i, cand in enumerate(cands):
+            if len(matches) < _TRANSFORM_MODELS[cand][0]:
+                continue
+            cand_time = None
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0.0:
+                    break
+                cand_time = remaining / (len(cands) - i)
+            cand_iters = max_iters if deadline is None and cand == "homography" else split_iters
+            H, mask, _ = estimate_transform(kp1, kp2, matches, cand, ransac_thresh,
+                                            confidence, cand_iters, cand_time, method)
+            if H is None:
+                continue
+            score = gric_score(_transfer_errors(src_pts, dst_pts, H), cand, sigma=ransac_thresh / 2.0)
+            if score < best_score:
+                best, best_score = (H, mask, cand), score
+        return best
+    if m_name not in _TRANSFORM_MODELS:
+        raise ValueError("transform_model debe ser {'similarity','affine','homography','auto'}")
+
+    sample_size = _TRANSFORM_MODELS[m_name][0]
+    if len(matches) < sample_size:
+        return None, None, m_name
+    src_pts, dst_pts = (p.reshape(-1, 1, 2) for p in _match_points(kp1, kp2, matches))
+    max_iters = max(1, int(max_iters))
+
+    if time_limit_s is None:
+        H, mask = _fit_transform(src_pts, dst_pts, m_name, method, ransac_thresh, max_iters, confidence)
+        return H, mask, m_name
+
+    deadline = time.perf_counter() + float(time_limit_s)
+    best_H, best_mask, best_inl = None, None, -1
+    done, chunk = 0, min(max_iters, 100)
+    while done < max_iters:
+        it = min(chunk, max_iters - done)
+        H, mask = _fit_transform(src_pts, dst_pts, m_name, method, ransac_thresh, it, confidence)
+        done += it
+        if H is not None and mask is not None and int(mask.sum()) > best_inl:
+            best_H, best_mask, best_inl = H, mask, int(mask.sum())
+        # Sólo cuentan las iteraciones de este bloque: los anteriores no se acumulan
+        if best_inl > 0 and _ransac_required_iters(best_inl / len(matches), sample_size, confidence) <= it:
+            break
+        if time.perf_counter() >= deadline:
+            break
+        chunk *= 2
+    return best_H, best_mask, m_name
+
+
+def estimate_homography(kp1: Union[KeypointSet, Sequence[cv2.KeyPoint]],
+                        kp2: Union[KeypointSet, Sequence[cv2.KeyPoint]],
                         matches: Sequence[cv2.DMatch],
                         ransac_thresh: float = 3.0,
-                        confidence: float = 0.999) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
-    if len(matches) < 4:
-        return None, None
-    src_pts = np.float32([kp1[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
-    dst_pts = np.float32([kp2[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
-    H, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, ransac_thresh, confidence=confidence)
+                        confidence: float = 0.999,
+                        max_iters: int = 2000,
+                        time_limit_s: Optional[float] = None,
+                        method: str = "ransac") -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Homografía completa (8 GDL); atajo de estimate_transform(model='homography')."""
+    H, mask, _ = estimate_transform(kp1, kp2, matches, "homography", ransac_thresh,
+                                    confidence, max_iters, time_limit_s, method)
     return H, mask
 
 
-def reprojection_rmse(kp1: Sequence[cv2.KeyPoint],
-                      kp2: Sequence[cv2.KeyPoint],
+def reprojection_rmse(kp1: Union[KeypointSet, Sequence[cv2.KeyPoint]],
+                      kp2: Union[KeypointSet, Sequence[cv2.KeyPoint]],
                       matches: Sequence[cv2.DMatch],
                       H: np.ndarray,
                       mask_inliers: np.ndarray) -> Optional[float]:
     if H is None or mask_inliers is None or mask_inliers.sum() == 0:
         return None
-    src_in = np.float32([kp1[m.queryIdx].pt for i, m in enumerate(matches) if mask_inliers[i]]).reshape(-1, 1, 2)
-    dst_in = np.float32([kp2[m.trainIdx].pt for i, m in enumerate(matches) if mask_inliers[i]]).reshape(-1, 1, 2)
+    src, dst = _match_points(kp1, kp2, matches)
+    keep = np.asarray(mask_inliers).ravel()[:len(matches)].astype(bool)
+    src_in, dst_in = src[keep].reshape(-1, 1, 2), dst[keep].reshape(-1, 1, 2)
     proj = cv2.perspectiveTransform(src_in, H)
     err = np.linalg.norm(proj - dst_in, axis=2).ravel()
     if err.size == 0:
@@ -221,6 +1533,233 @@ def reprojection_rmse(kp1: Sequence[cv2.KeyPoint],
     return float(math.sqrt((err ** 2).mean()))
 
 
+# Claves de _ENGINE_KEYS que sólo afectan a la estimación (no a la detección)
+_ESTIMATION_KEYS = ("transform_model", "ransac_method", "ransac_max_iters",
+                    "ransac_time_limit_s", "ransac_confidence", "guide_H", "guide_radius")
+
+
+class FeatureCache:
+    """
+    Keypoints/descriptores de una imagen fija (p.ej. la referencia de un lote),
+    por configuración de detección (detector, parámetros, escala de trabajo, ...).
+
+    Se pasa a MatchSession(ref_cache=...) para que todos los pares contra esa imagen
+    la detecten una sola vez. Seguro entre hilos: el primero que necesita una
+    configuración la calcula y el resto espera y la reutiliza.
+    """
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple, compute):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                value = compute()
+                self._entries[key] = value
+            return value
+
+
+class MatchSession:
+    """
+    Estado reutilizable del matching de un par img1 -> img2.
+
+    Detecta y describe una sola vez (keypoints a resolución completa) y guarda, por
+    tipo de matcher, el knn(k=2) ya reducido a arrays. Cambiar ratio_thresh, el modelo
+    o los parámetros RANSAC sólo repite el filtro de ratio y la estimación (estimate).
+    Se puede usar desde varios hilos: el cálculo del knn está protegido.
+
+    Con ref_cache (FeatureCache de img2) las features de img2 se toman de la caché.
+    descriptor_norm post-procesa los descriptores float (ver normalize_descriptors);
+    descriptor_storage/descriptor_pca los guardan en forma compacta (ver
+    compact_descriptors). Las bases PCA/blanqueo se ajustan sobre img2 y se cachean con ella.
+    Con guide_H (H aproximada img1 -> img2) estimate empareja en modo guiado
+    (guided_knn_pairs) en vez de contra todos los descriptores.
+    Con profile=True cada MatchResult lleva un StageProfile; las etapas de la sesión
+    (detección, índice y knn) figuran con el tiempo que costaron al calcularse.
+    """
+
+    def __init__(self,
+                 img1: np.ndarray,
+                 img2: np.ndarray,
+                 detector_name: str = "ORB",
+                 params: Dict = None,
+                 scale_policy: str = "none",
+                 max_working_side: Optional[int] = None,
+                 gsd1: Optional[float] = None,
+                 gsd2: Optional[float] = None,
+                 max_keypoints: Optional[int] = None,
+                 kp_selection: str = "grid",
+                 tile_size: Optional[int] = None,
+                 tile_overlap: Optional[int] = None,
+                 tile_max_keypoints: Optional[int] = None,
+                 detect_threads: Optional[int] = None,
+                 ref_cache: Optional[FeatureCache] = None,
+                 descriptor_norm: Optional[str] = None,
+                 descriptor_storage: str = "float32",
+                 descriptor_pca: Optional[int] = None,
+                 profile: bool = False):
+        check_descriptor_options(descriptor_norm, descriptor_storage, descriptor_pca)
+        params = params or {}
+        self.detector_name = detector_name
+        self.profile = make_profile(profile)
+        s1, s2 = working_scales(img1.shape, img2.shape, scale_policy, gsd1, gsd2, max_working_side)
+        if tile_size:
+            # Fábrica: cada hilo de la detección por teselas crea su propio detector
+            detector = lambda: _create_detector(detector_name, **params)
+        else:
+            detector = _create_detector(detector_name, **params)
+        tiling = dict(tile_size=tile_size, tile_overlap=tile_overlap,
+                      tile_max_keypoints=tile_max_keypoints, n_threads=detect_threads)
+
+        def detect(img, scale):
+            kps, desc = detect_and_describe(_downscale(img, scale), detector,
+                                            max_keypoints, kp_selection, **tiling,
+                                            descriptor_norm=descriptor_norm)
+            return _rescale_keypoints(kps, scale), desc
+
+        def detect_ref():
+            # img2 en forma compacta (+ base PCA/blanqueo ajustada sobre ella)
+            kps, desc = detect(img2, s2)
+            pca = None
+            if desc is not None and desc.dtype != np.uint8 and len(desc):
+                if descriptor_norm == "whiten":
+                    pca = fit_descriptor_pca(desc, descriptor_pca, whiten=True)
+                elif descriptor_pca:
+                    pca = fit_descriptor_pca(desc, descriptor_pca)
+            return kps, compact_descriptors(desc, descriptor_storage, pca), pca
+
+        with self.profile.stage("detect1"):
+            self.kp1, d1 = detect(img1, s1)
+        with self.profile.stage("detect2"):
+            if ref_cache is not None and ref_cache.image is img2:
+                key = (detector_name, tuple(sorted(params.items())), round(s2, 9),
+                       max_keypoints, kp_selection, tile_size, tile_overlap, tile_max_keypoints,
+                       descriptor_norm, descriptor_storage, descriptor_pca)
+                cached = len(ref_cache)
+                self.kp2, self.d2, self.pca = ref_cache.get(key, detect_ref)
+                self.profile.count(ref_cache_hit=int(len(ref_cache) == cached))
+            else:
+                self.kp2, self.d2, self.pca = detect_ref()
+        # Binario según el descriptor original (un SIFT cuantizado a uint8 sigue siendo L2)
+        self.binary = d1 is not None and d1.dtype == np.uint8
+        with self.profile.stage("compact"):
+            self.d1 = compact_descriptors(d1, descriptor_storage, self.pca)
+        self.scales = (s1, s2)
+        if self.profile.enabled:
+            self.profile.count(
+                keypoints1=len(self.kp1), keypoints2=len(self.kp2),
+                descriptor_bytes=sum(int(d.nbytes) for d in (self.d1, self.d2) if d is not None),
+            )
+        self._knn = {}
+        self._guided = {}
+        self._lock = threading.Lock()
+
+    def knn(self, matcher_type: str = "auto"):
+        """knn_pairs de los descriptores con ese matcher (se calcula una vez)."""
+        with self._lock:
+            pairs = self._knn.get(matcher_type)
+            if pairs is None:
+                desc_dtype = None if self.d1 is None else self.d1.dtype
+                d1, d2 = self.d1, self.d2
+                if (not self.binary and desc_dtype == np.uint8
+                        and (matcher_type or "auto").lower() == "flann"):
+                    # El KDTree de FLANN sólo acepta float32
+                    d1, d2 = d1.astype(np.float32), d2.astype(np.float32)
+                with self.profile.stage("build_index"):
+                    matcher = _create_matcher(matcher_type, desc_dtype, binary=self.binary)
+                with self.profile.stage("knn"):
+                    pairs = knn_pairs(d1, d2, matcher)
+                self.profile.count(knn_pairs=len(pairs[0]))
+                self._knn[matcher_type] = pairs
+            return pairs
+
+    def guided_knn(self, H: np.ndarray, radius: float):
+        """guided_knn_pairs con H (px de resolución completa); se guarda por (H, radio)."""
+        H = np.asarray(H, dtype=np.float64).reshape(3, 3)
+        key = (H.tobytes(), float(radius))
+        with self._lock:
+            pairs = self._guided.get(key)
+            if pairs is None:
+                with self.profile.stage("guided_knn"):
+                    pairs = guided_knn_pairs(self.kp1.xy, self.kp2.xy, self.d1, self.d2, H, radius,
+                                             self.binary, index=self.kp2.index(radius))
+                self.profile.count(guided_knn_pairs=len(pairs[0]))
+                self._guided[key] = pairs
+            return pairs
+
+    def estimate(self,
+                 matcher_type: str = "auto",
+                 ratio_thresh: float = 0.75,
+                 ransac_thresh: float = 3.0,
+                 alpha_rmse: float = 0.1,
+                 transform_model: str = "homography",
+                 ransac_method: str = "ransac",
+                 ransac_max_iters: int = 2000,
+                 ransac_time_limit_s: Optional[float] = None,
+                 ransac_confidence: float = 0.999,
+                 guide_H: Optional[np.ndarray] = None,
+                 guide_radius: float = 20.0) -> MatchResult:
+        """
+        Ratio test + estimación robusta + coste sobre las features guardadas.
+        Con guide_H el knn es guiado (radio guide_radius en px de la imagen de trabajo
+        de img2, como ransac_thresh) y matcher_type no se usa.
+        """
+        kp1, kp2 = self.kp1, self.kp2
+        s2 = self.scales[1]
+        if guide_H is not None:
+            knn = self.guided_knn(guide_H, guide_radius / s2)
+        else:
+            knn = self.knn(matcher_type)
+        prof = self.profile.copy()
+        with prof.stage("ratio"):
+            good = ratio_filter(knn, ratio_thresh)
+
+        with prof.stage("estimate"):
+            H, mask, model = estimate_transform(kp1, kp2, good, model=transform_model,
+                                                ransac_thresh=ransac_thresh / s2, confidence=ransac_confidence,
+                                                max_iters=ransac_max_iters, time_limit_s=ransac_time_limit_s,
+                                                method=ransac_method)
+        if mask is not None:
+            mask_bool = mask.ravel().astype(bool)
+            inliers = int(mask_bool.sum())
+        else:
+            mask_bool = None
+            inliers = 0
+
+        with prof.stage("rmse"):
+            rmse = reprojection_rmse(kp1, kp2, good, H, mask_bool) if H is not None and mask_bool is not None else None
+        prof.count(good_matches=len(good), inliers=inliers)
+
+        # Coste: minimizar
+        if H is None or rmse is None:
+            cost = _NO_H_PENALTY - inliers
+        else:
+            cost = -inliers + alpha_rmse * rmse
+
+        return MatchResult(
+            H=H,
+            inliers=inliers,
+            rmse=rmse,
+            total_kp1=len(kp1),
+            total_kp2=len(kp2),
+            good_matches=len(good),
+            cost=float(cost),
+            mask_inliers=mask_bool,
+            model=model,
+            kp1=kp1,
+            kp2=kp2,
+            matches=good,
+            scales=self.scales,
+            profile=prof if prof.enabled else None,
+        )
+
+
 def match_and_score(img1: np.ndarray,
                     img2: np.ndarray,
                     detector_name: str = "ORB",
@@ -228,43 +1767,57 @@ def match_and_score(img1: np.ndarray,
                     matcher_type: str = "auto",
                     ratio_thresh: float = 0.75,
                     ransac_thresh: float = 3.0,
-                    alpha_rmse: float = 0.1) -> MatchResult:
-    params = params or {}
-    detector = _create_detector(detector_name, **params)
-    kp1, d1 = detect_and_describe(img1, detector)
-    kp2, d2 = detect_and_describe(img2, detector)
-
-    desc_dtype = None if d1 is None else d1.dtype
-    matcher = _create_matcher(matcher_type, desc_dtype)
-
-    good = knn_ratio_match(d1, d2, matcher, ratio_thresh=ratio_thresh)
-
-    H, mask = estimate_homography(kp1, kp2, good, ransac_thresh=ransac_thresh)
-    if mask is not None:
-        mask_bool = mask.ravel().astype(bool)
-        inliers = int(mask_bool.sum())
-    else:
-        mask_bool = None
-        inliers = 0
-
-    rmse = reprojection_rmse(kp1, kp2, good, H, mask_bool) if H is not None and mask_bool is not None else None
-
-    # Coste: minimizar
-    penalty_noH = 1000.0
-    if H is None or rmse is None:
-        cost = penalty_noH - inliers
-    else:
-        cost = -inliers + alpha_rmse * rmse
-
-    return MatchResult(
-        H=H,
-        inliers=inliers,
-        rmse=rmse,
-        total_kp1=len(kp1),
-        total_kp2=len(kp2),
-        good_matches=len(good),
-        cost=float(cost),
-        mask_inliers=mask_bool
+                    alpha_rmse: float = 0.1,
+                    scale_policy: str = "none",
+                    max_working_side: Optional[int] = None,
+                    gsd1: Optional[float] = None,
+                    gsd2: Optional[float] = None,
+                    max_keypoints: Optional[int] = None,
+                    kp_selection: str = "grid",
+                    tile_size: Optional[int] = None,
+                    tile_overlap: Optional[int] = None,
+                    tile_max_keypoints: Optional[int] = None,
+                    detect_threads: Optional[int] = None,
+                    transform_model: str = "homography",
+                    ransac_method: str = "ransac",
+                    ransac_max_iters: int = 2000,
+                    ransac_time_limit_s: Optional[float] = None,
+                    ransac_confidence: float = 0.999,
+                    descriptor_norm: Optional[str] = None,
+                    descriptor_storage: str = "float32",
+                    descriptor_pca: Optional[int] = None,
+                    guide_H: Optional[np.ndarray] = None,
+                    guide_radius: float = 20.0,
+                    profile: bool = False) -> MatchResult:
+    """
+    Detecta, empareja y estima la transformación img1 -> img2 y calcula el coste.
+
+    Con scale_policy/max_working_side la detección se hace sobre copias reducidas
+    (ver working_scales); los keypoints se devuelven a resolución completa antes de
+    estimar, de modo que H, RMSE y los puntos devueltos están en píxeles originales.
+    ransac_thresh se interpreta en píxeles de la imagen de trabajo de img2.
+    Para re-estimar el mismo par con otros parámetros, usar MatchSession.
+    Con guide_H (H aproximada, p.ej. de load_guide_homographies) el matching es guiado
+    (ver guided_knn_pairs).
+    Con profile=True el resultado lleva un StageProfile (res.profile).
+    """
+    session = MatchSession(
+        img1, img2, detector_name, params,
+        scale_policy=scale_policy, max_working_side=max_working_side, gsd1=gsd1, gsd2=gsd2,
+        max_keypoints=max_keypoints, kp_selection=kp_selection,
+        tile_size=tile_size, tile_overlap=tile_overlap,
+        tile_max_keypoints=tile_max_keypoints, detect_threads=detect_threads,
+        descriptor_norm=descriptor_norm,
+        descriptor_storage=descriptor_storage, descriptor_pca=descriptor_pca,
+        profile=profile,
+    )
+    return session.estimate(
+        matcher_type=matcher_type, ratio_thresh=ratio_thresh,
+        ransac_thresh=ransac_thresh, alpha_rmse=alpha_rmse,
+        transform_model=transform_model, ransac_method=ransac_method,
+        ransac_max_iters=ransac_max_iters, ransac_time_limit_s=ransac_time_limit_s,
+        ransac_confidence=ransac_confidence,
+        guide_H=guide_H, guide_radius=guide_radius,
     )
 
 
@@ -278,19 +1831,24 @@ def single_match(img_path1: str,
                  ransac_thresh: float = 3.0,
                  alpha_rmse: float = 0.1,
                  **detector_params) -> Dict:
-    img1 = _read_gray(img_path1)
-    img2 = _read_gray(img_path2)
+    det_params, engine_kw = _split_params(detector_params)
+    read_prof = make_profile(engine_kw.get("profile", False))
+    with read_prof.stage("read"):
+        img1 = _read_gray(img_path1)
+        img2 = _read_gray(img_path2)
     res = match_and_score(
         img1, img2,
         detector_name=detector,
-        params=detector_params,
+        params=det_params,
         matcher_type=matcher_type,
         ratio_thresh=ratio_thresh,
         ransac_thresh=ransac_thresh,
-        alpha_rmse=alpha_rmse
+        alpha_rmse=alpha_rmse,
+        **engine_kw
     )
-    return {
+    out = {
         "H": res.H,
+        "model": res.model,
         "inliers": res.inliers,
         "rmse": res.rmse,
         "total_keypoints_img1": res.total_kp1,
@@ -298,72 +1856,104 @@ def single_match(img_path1: str,
         "good_matches": res.good_matches,
         "cost": res.cost,
     }
+    if res.profile is not None:
+        out["profile"] = res.profile.merge(read_prof).as_dict()
+    return out
 
 
-def match_details(img_path1: str,
-                  img_path2: str,
+def match_details(img_path1: Union[str, np.ndarray, ReferenceImage],
+                  img_path2: Union[str, np.ndarray, ReferenceImage],
                   detector: str = "ORB",
                   matcher_type: str = "auto",
                   ratio_thresh: float = 0.75,
                   ransac_thresh: float = 3.0,
                   alpha_rmse: float = 0.1,
+                  return_result: bool = False,
+                  session: Optional[MatchSession] = None,
                   **detector_params) -> Dict:
     """
     Devuelve detalles completos del matching:
-      - H (3x3) o None
+      - H (3x3) o None y el modelo de transformación usado
       - rmse, inliers, good_matches, total_kp1, total_kp2, cost
       - correspondencias inliers: points_src (Nx2), points_dst (Nx2)
+      - residuals (Nx2): residuo H·src - dst de cada inlier, en px de la referencia
+      - si img_path2 es una ReferenceImage georreferenciada: gcps (píxel flotante ->
+        coordenadas del CRS de la referencia) y crs. pixel_x/pixel_y siguen el convenio
+        GDAL (origen en la esquina del píxel, como map_x/map_y y el georreferenciador
+        de QGIS): son points_src + 0.5
+
+    img_path1/img_path2 pueden ser rutas, arrays en gris o ReferenceImage ya cargadas.
+    Con return_result=True se añade "result" (el MatchResult, con KPs y matches) para
+    dibujar después sin repetir el matching (ver draw_matches).
+    Con una MatchSession del mismo par sólo se repiten ratio test y estimación; los
+    parámetros de detección se ignoran.
+    Con profile=True (o una sesión creada con profile=True) se añade "profile"
+    (StageProfile.as_dict: tiempos por etapa, contadores y memoria).
     """
-    img1 = _read_gray(img_path1)
-    img2 = _read_gray(img_path2)
+    det_params, engine_kw = _split_params(detector_params)
+    if isinstance(img_path1, ReferenceImage) and img_path1.gsd is not None:
+        engine_kw.setdefault("gsd1", img_path1.gsd)
+    if isinstance(img_path2, ReferenceImage) and img_path2.gsd is not None:
+        engine_kw.setdefault("gsd2", img_path2.gsd)
 
     # Calcula score + máscara
-    res = match_and_score(
-        img1, img2,
-        detector_name=detector,
-        params={k: v for k, v in detector_params.items()
-                if k.startswith(("orb_", "sift_", "akaze_"))},
-        matcher_type=matcher_type,
-        ratio_thresh=ratio_thresh,
-        ransac_thresh=ransac_thresh,
-        alpha_rmse=alpha_rmse
-    )
+    if session is not None:
+        res = session.estimate(
+            matcher_type=matcher_type,
+            ratio_thresh=ratio_thresh,
+            ransac_thresh=ransac_thresh,
+            alpha_rmse=alpha_rmse,
+            **{k: v for k, v in engine_kw.items() if k in _ESTIMATION_KEYS}
+        )
+    else:
+        read_prof = make_profile(engine_kw.get("profile", False))
+        with read_prof.stage("read"):
+            img1, img2 = _as_gray(img_path1), _as_gray(img_path2)
+        res = match_and_score(
+            img1, img2,
+            detector_name=detector,
+            params=det_params,
+            matcher_type=matcher_type,
+            ratio_thresh=ratio_thresh,
+            ransac_thresh=ransac_thresh,
+            alpha_rmse=alpha_rmse,
+            **engine_kw
+        )
+        if res.profile is not None:
+            res.profile.merge(read_prof)
 
-    # Recompute KPs + good para extraer puntos inlier
-    det_params = {k: v for k, v in detector_params.items()
-                  if k.startswith(("orb_", "sift_", "akaze_"))}
-    detector_obj = _create_detector(detector, **det_params)
-    kp1, d1 = detect_and_describe(img1, detector_obj)
-    kp2, d2 = detect_and_describe(img2, detector_obj)
-    desc_dtype = None if d1 is None else d1.dtype
-    matcher = _create_matcher(matcher_type, desc_dtype)
-    good = knn_ratio_match(d1, d2, matcher, ratio_thresh=ratio_thresh)
-
-    points_src, points_dst = [], []
-    mask = res.mask_inliers
-
-    if mask is not None and len(good) > 0:
-        # Asegurarnos de que la máscara es 1D
-        if hasattr(mask, "ravel"):
-            mask = mask.ravel()
-        n = min(len(good), len(mask))
-        for i in range(n):
-            if mask[i]:
-                m = good[i]
-                x, y = kp1[m.queryIdx].pt
-                xp, yp = kp2[m.trainIdx].pt
-                points_src.append([float(x), float(y)])
-                points_dst.append([float(xp), float(yp)])
+    # Correspondencias inliers (sólo si hay máscara) y sus residuos
+    src, dst = np.empty((0, 2)), np.empty((0, 2))
+    if res.mask_inliers is not None:
+        src, dst = matched_points(res)
+    residuals = residual_vectors(src, dst, res.H) if res.H is not None else np.zeros_like(src)
+    points_src, points_dst = src.tolist(), dst.tolist()
 
     H_list = None
     if res.H is not None:
         H_list = [[float(res.H[r, c]) for c in range(3)] for r in range(3)]
 
-    return {
-        "img1": img_path1, "img2": img_path2,
+    gcps, crs = [], None
+    if isinstance(img_path2, ReferenceImage) and img_path2.georeferenced:
+        crs = img_path2.crs
+        if points_dst:
+            world = img_path2.pixel_to_world(dst)
+            err = np.linalg.norm(residuals, axis=1)
+            # Mismo convenio que pixel_to_world: OpenCV (centro) -> GDAL (esquina)
+            pixel = src + 0.5
+            gcps = [{"id": i + 1,
+                     "pixel_x": float(p[0]), "pixel_y": float(p[1]),
+                     "map_x": float(w[0]), "map_y": float(w[1]),
+                     "residual_px": float(e)}
+                    for i, (p, w, e) in enumerate(zip(pixel, world, err))]
+
+    details = {
+        "img1": _image_label(img_path1), "img2": _image_label(img_path2),
         "detector": detector, "matcher_type": matcher_type,
         "ratio_thresh": ratio_thresh, "ransac_thresh": ransac_thresh, "alpha_rmse": alpha_rmse,
+        **engine_kw,
         "H": H_list,
+        "model": res.model,
         "rmse": res.rmse,
         "inliers": res.inliers,
         "good_matches": res.good_matches,
@@ -372,35 +1962,50 @@ def match_details(img_path1: str,
         "cost": res.cost,
         "points_src": points_src,  # Nx2
         "points_dst": points_dst,  # Nx2
+        "residuals": residuals.tolist(),  # Nx2
+        "gcps": gcps,
+        "crs": crs,
     }
+    if details.get("guide_H") is not None:
+        details["guide_H"] = np.asarray(details["guide_H"], dtype=np.float64).tolist()
+    if res.profile is not None:
+        # Sustituye el flag 'profile' de engine_kw por las medidas
+        details["profile"] = res.profile.as_dict()
+    if return_result:
+        details["result"] = res
+    return details
 
 
 
 def save_homographies_json(pairs: Sequence[Tuple[str, str]],
                            best_params: Dict,
                            out_json_path: str,
-                           alpha_rmse: float = 0.1) -> str:
+                           alpha_rmse: float = 0.1,
+                           guides: Optional[Dict[Tuple[str, str], np.ndarray]] = None) -> str:
     """
     Calcula y guarda en JSON la homografía y correspondencias inlier para cada par.
+    Con guides (ver load_guide_homographies) los pares que tengan H aproximada se
+    emparejan en modo guiado.
     Devuelve la ruta al JSON.
     """
     det = best_params.get("detector", "ORB")
     matcher_type = best_params.get("matcher_type", "auto")
     ratio = best_params.get("ratio_thresh", 0.75)
     ransac = best_params.get("ransac_thresh", 3.0)
-    det_params = {k: v for k, v in best_params.items()
-                  if k.startswith(("orb_","sift_","akaze_"))}
+    det_params, engine_kw = _split_params(best_params)
 
     payload = {
         "params": {"detector": det, "matcher_type": matcher_type,
                    "ratio_thresh": ratio, "ransac_thresh": ransac,
-                   **det_params, "alpha_rmse": alpha_rmse},
+                   **det_params, **engine_kw, "alpha_rmse": alpha_rmse},
         "pairs": []
     }
 
     for a, b in pairs:
+        guide_H = _guide_for(guides, a, b)
+        pair_kw = dict(engine_kw, guide_H=guide_H) if guide_H is not None else engine_kw
         payload["pairs"].append(
-            match_details(a, b, det, matcher_type, ratio, ransac, alpha_rmse, **det_params)
+            match_details(a, b, det, matcher_type, ratio, ransac, alpha_rmse, **det_params, **pair_kw)
         )
 
     with open(out_json_path, "w", encoding="utf-8") as f:
@@ -408,11 +2013,97 @@ def save_homographies_json(pairs: Sequence[Tuple[str, str]],
     return out_json_path
 
 
-def draw_matches(img_path1: str,
-                 img_path2: str,
+def matches_canvas_size(shape1: Tuple[int, ...], shape2: Tuple[int, ...]) -> Tuple[int, int]:
+    """Tamaño (ancho, alto) a resolución completa de la composición [img1 | img2]."""
+    return shape1[1] + shape2[1], max(shape1[0], shape2[0])
+
+
+def render_matches(img1: np.ndarray,
+                   img2: np.ndarray,
+                   pts1: np.ndarray,
+                   pts2: np.ndarray,
+                   scale: float = 1.0,
+                   roi: Optional[Tuple[float, float, float, float]] = None,
+                   line_color: Tuple[int, int, int] = (255, 0, 0),
+                   thickness: int = 1) -> np.ndarray:
+    """
+    Dibuja la composición [img1 | img2] con líneas entre pts1 (img1) y pts2 (img2),
+    sólo en la región 'roi' = (x0, y0, x1, y1) de la composición a resolución completa
+    (None = toda) y directamente a la escala 'scale' (px de salida por px original).
+
+    Cada imagen se recorta a la ROI y se reescala antes de dibujar, y los puntos se
+    transforman a coordenadas de salida, así que nunca se reserva la composición a
+    resolución completa: sirve tanto para la previsualización reducida como para
+    ver a 1:1 sólo la zona visible. Devuelve BGR uint8.
+    """
+    w_full, h_full = matches_canvas_size(img1.shape, img2.shape)
+    x0, y0, x1, y1 = roi if roi is not None else (0.0, 0.0, float(w_full), float(h_full))
+    out_w = max(1, int(math.ceil((x1 - x0) * scale)))
+    out_h = max(1, int(math.ceil((y1 - y0) * scale)))
+    vis = np.zeros((out_h, out_w, 3), dtype=np.uint8)
+
+    interp = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    for img, ox in ((img1, 0), (img2, img1.shape[1])):
+        h, w = img.shape[:2]
+        ix0, ix1 = max(x0, ox), min(x1, ox + w)
+        iy0, iy1 = max(y0, 0), min(y1, h)
+        if ix1 <= ix0 or iy1 <= iy0:
+            continue
+        dx0 = int(round((ix0 - x0) * scale))
+        dy0 = int(round((iy0 - y0) * scale))
+        dx1 = min(out_w, max(dx0 + 1, int(round((ix1 - x0) * scale))))
+        dy1 = min(out_h, max(dy0 + 1, int(round((iy1 - y0) * scale))))
+        crop = img[int(iy0):int(math.ceil(iy1)), int(ix0 - ox):int(math.ceil(ix1 - ox))]
+        tile = cv2.resize(crop, (dx1 - dx0, dy1 - dy0), interpolation=interp)
+        if tile.ndim == 2:
+            tile = cv2.cvtColor(tile, cv2.COLOR_GRAY2BGR)
+        vis[dy0:dy1, dx0:dx1] = tile
+
+    if len(pts1):
+        # Coordenadas de salida en punto fijo (shift=4) para líneas subpíxel
+        shift = 4
+        origin = np.array([x0, y0], dtype=np.float64)
+        p1 = (np.asarray(pts1, dtype=np.float64) - origin) * scale
+        p2 = (np.asarray(pts2, dtype=np.float64) + (img1.shape[1], 0) - origin) * scale
+        p1 = np.round(p1 * (1 << shift)).astype(np.int64)
+        p2 = np.round(p2 * (1 << shift)).astype(np.int64)
+        r = max(2, int(round(3 * min(scale, 2.0)))) << shift
+        for (ax, ay), (bx, by) in zip(p1.tolist(), p2.tolist()):
+            cv2.line(vis, (ax, ay), (bx, by), line_color, thickness, cv2.LINE_AA, shift)
+            cv2.circle(vis, (ax, ay), r, line_color, thickness, cv2.LINE_AA, shift)
+            cv2.circle(vis, (bx, by), r, line_color, thickness, cv2.LINE_AA, shift)
+
+    return vis
+
+
+def matched_points(res: MatchResult,
+                   max_draw: Optional[int] = None,
+                   inliers_only: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Coordenadas (Nx2, resolución completa) de los primeros max_draw matches de res,
+    quedándose sólo con los inliers si hay máscara.
+    """
+    good = res.matches or []
+    if max_draw is not None:
+        good = good[:max_draw]
+    if not good or res.kp1 is None or res.kp2 is None:
+        return np.empty((0, 2)), np.empty((0, 2))
+
+    pts1, pts2 = (p.astype(np.float64) for p in _match_points(res.kp1, res.kp2, good))
+    if inliers_only and res.mask_inliers is not None:
+        mask = np.asarray(res.mask_inliers).ravel().astype(bool)
+        n = min(len(good), len(mask))
+        pts1, pts2 = pts1[:n][mask[:n]], pts2[:n][mask[:n]]
+    return pts1, pts2
+
+
+def draw_matches(img_path1: Union[str, np.ndarray, ReferenceImage],
+                 img_path2: Union[str, np.ndarray, ReferenceImage],
                  params: Dict,
                  max_draw: int = 60,
-                 annotate: bool = True) -> np.ndarray:
+                 annotate: bool = True,
+                 max_side: Optional[int] = None,
+                 result: Optional[MatchResult] = None) -> np.ndarray:
     """
     Devuelve una imagen tipo "template vs escena" con líneas de correspondencia,
     como en los ejemplos clásicos de OpenCV:
@@ -421,14 +2112,15 @@ def draw_matches(img_path1: str,
                 \   \   \    (líneas azules)
 
     Si hay máscara de inliers, sólo esos matches se usan/colorean.
+
+    max_side: si se da, la composición se dibuja directamente reducida a ese lado
+    máximo (ver render_matches). result: MatchResult ya calculado con los mismos
+    parámetros (p.ej. match_details(..., return_result=True)["result"]) para no
+    repetir el matching.
     """
     # Para detectar usamos escala de grises
-    img1_gray = _read_gray(img_path1)
-    img2_gray = _read_gray(img_path2)
-
-    # Para dibujar convertimos a BGR (para poder colorear líneas)
-    img1_color = cv2.cvtColor(img1_gray, cv2.COLOR_GRAY2BGR)
-    img2_color = cv2.cvtColor(img2_gray, cv2.COLOR_GRAY2BGR)
+    img1_gray = _as_gray(img_path1)
+    img2_gray = _as_gray(img_path2)
 
     detector = params.get("detector", "ORB")
     matcher_type = params.get("matcher_type", "auto")
@@ -436,57 +2128,37 @@ def draw_matches(img_path1: str,
     ransac_thresh = params.get("ransac_thresh", 3.0)
     alpha_rmse = params.get("alpha_rmse", 0.1)
 
-    det_params = {k: v for k, v in params.items()
-                  if k.startswith(("orb_", "sift_", "akaze_"))}
+    res = result
+    if res is None:
+        det_params, engine_kw = _split_params(params)
+        if isinstance(img_path1, ReferenceImage) and img_path1.gsd is not None:
+            engine_kw.setdefault("gsd1", img_path1.gsd)
+        if isinstance(img_path2, ReferenceImage) and img_path2.gsd is not None:
+            engine_kw.setdefault("gsd2", img_path2.gsd)
 
-    # Obtener máscara de inliers y métricas (no reutilizamos kp/matches de aquí)
-    res = match_and_score(
-        img1_gray, img2_gray,
-        detector_name=detector, params=det_params,
-        matcher_type=matcher_type, ratio_thresh=ratio_thresh,
-        ransac_thresh=ransac_thresh, alpha_rmse=alpha_rmse
-    )
+        # Obtener máscara de inliers, métricas y los KPs/matches con los que se calcularon
+        res = match_and_score(
+            img1_gray, img2_gray,
+            detector_name=detector, params=det_params,
+            matcher_type=matcher_type, ratio_thresh=ratio_thresh,
+            ransac_thresh=ransac_thresh, alpha_rmse=alpha_rmse,
+            **engine_kw
+        )
 
-    # Recalcular KPs y matches para dibujar
-    detector_obj = _create_detector(detector, **det_params)
-    kp1, d1 = detect_and_describe(img1_gray, detector_obj)
-    kp2, d2 = detect_and_describe(img2_gray, detector_obj)
-    desc_dtype = None if d1 is None else d1.dtype
-    matcher = _create_matcher(matcher_type, desc_dtype)
-    good = knn_ratio_match(d1, d2, matcher, ratio_thresh=ratio_thresh)
-
-    # Lista de matches a dibujar
-    draw_list = good[:max_draw]
-
-    # Construir máscara de inliers del mismo tamaño que draw_list (si existe)
-    mask_draw = None
-    if res.mask_inliers is not None and len(draw_list) > 0:
-        mask = res.mask_inliers
-        # Asegurarnos de que la máscara es 1D
-        if hasattr(mask, "ravel"):
-            mask = mask.ravel()
-        n = min(len(draw_list), len(mask))
-        mask_draw = mask[:n].astype(np.uint8).tolist()
-        draw_list = draw_list[:n]  # misma longitud que mask_draw
-
-    # Imagen de matches: izq = flotante, dcha = referencia
-    # matchColor: azul, singlePointColor: verde
-    vis = cv2.drawMatches(
-        img1_color, kp1,
-        img2_color, kp2,
-        draw_list, None,
-        matchColor=(255, 0, 0),
-        singlePointColor=(0, 255, 0),
-        matchesMask=mask_draw,
-        flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS
-    )
+    pts1, pts2 = matched_points(res, max_draw=max_draw)
+
+    # Imagen de matches: izq = flotante, dcha = referencia (líneas azules)
+    scale = 1.0
+    if max_side:
+        scale = min(1.0, max_side / float(max(matches_canvas_size(img1_gray.shape, img2_gray.shape))))
+    vis = render_matches(img1_gray, img2_gray, pts1, pts2, scale=scale)
 
     if annotate:
         h, w = vis.shape[:2]
         pad = 10
         overlay = vis.copy()
         # cajetín semitransparente con info básica
-        cv2.rectangle(overlay, (pad, pad), (min(w - 1, 520), pad + 110), (0, 0, 0), -1)
+        cv2.rectangle(overlay, (pad, pad), (min(w - 1, 640), pad + 110), (0, 0, 0), -1)
         vis = cv2.addWeighted(overlay, 0.35, vis, 0.65, 0)
 
         tx = pad + 8
@@ -501,7 +2173,7 @@ def draw_matches(img_path1: str,
             )
             ty += 24
 
-        put(f"Detector: {detector}  |  Matcher: {matcher_type}")
+        put(f"Detector: {detector}  |  Matcher: {matcher_type}  |  Modelo: {res.model}")
         put(f"Good: {res.good_matches}  |  Inliers: {res.inliers}")
         put(f"RMSE: {None if res.rmse is None else round(res.rmse, 3)}  |  Cost: {round(res.cost, 3)}")
         put(f"Ratio: {ratio_thresh}  |  RANSAC: {ransac_thresh}")
@@ -509,24 +2181,236 @@ def draw_matches(img_path1: str,
     return vis
 
 
+def _fit_scale(shape: Tuple[int, ...], max_side: Optional[int]) -> float:
+    return 1.0 if not max_side else min(1.0, max_side / float(max(shape[:2])))
+
+
+def residual_magnitude_grid(shape: Tuple[int, ...],
+                            pts: np.ndarray,
+                            residuals: np.ndarray,
+                            grid_side: int = 64,
+                            power: float = 2.0) -> np.ndarray:
+    """
+    Campo de |residuo| interpolado (IDW) en una rejilla gruesa de lado mayor grid_side
+    sobre una imagen de forma 'shape'. Una sola pasada matricial (celdas x puntos).
+    """
+    h, w = shape[:2]
+    s = grid_side / float(max(h, w))
+    gh, gw = max(1, int(round(h * s))), max(1, int(round(w * s)))
+    if len(pts) == 0:
+        return np.zeros((gh, gw), dtype=np.float32)
+
+    gy, gx = np.mgrid[0:gh, 0:gw]
+    cells = np.stack([(gx.ravel() + 0.5) * w / gw, (gy.ravel() + 0.5) * h / gh], axis=1)
+    pts = np.asarray(pts, dtype=np.float64)
+    mag = np.linalg.norm(np.asarray(residuals, dtype=np.float64), axis=1)
+    d2 = (cells ** 2).sum(1)[:, None] + (pts ** 2).sum(1)[None, :] - 2.0 * cells @ pts.T
+    wts = 1.0 / (np.maximum(d2, 1.0) ** (power / 2.0))
+    field = (wts @ mag) / wts.sum(1)
+    return field.reshape(gh, gw).astype(np.float32)
+
+
+def render_residuals(ref_img: np.ndarray,
+                     pts: np.ndarray,
+                     residuals: np.ndarray,
+                     max_side: Optional[int] = 1024,
+                     grid_side: int = 64,
+                     exaggeration: Optional[float] = None,
+                     heatmap: bool = True) -> np.ndarray:
+    """
+    Vista de control de calidad sobre la referencia: mapa de calor de |residuo|
+    (interpolado, ver residual_magnitude_grid) y flechas de residuo en cada inlier.
+
+    pts/residuals en px de la referencia a resolución completa. Las flechas se
+    exageran para que el residuo mediano mida ~3% del lado de la imagen (o
+    'exaggeration' si se da). Devuelve BGR uint8 con lado <= max_side.
+    """
+    scale = _fit_scale(ref_img.shape, max_side)
+    gray = ref_img if scale == 1.0 else cv2.resize(
+        ref_img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    vis = cv2.cvtColor((gray // 2).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+    pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+    residuals = np.asarray(residuals, dtype=np.float64).reshape(-1, 2)
+    if len(pts) == 0:
+        return vis
+
+    mag = np.linalg.norm(residuals, axis=1)
+    vmax = max(float(np.percentile(mag, 95)), 1e-6)
+    if heatmap:
+        field = residual_magnitude_grid(ref_img.shape, pts, residuals, grid_side=grid_side)
+        field = cv2.resize(field, (w, h), interpolation=cv2.INTER_CUBIC)
+        heat = cv2.applyColorMap(np.clip(field / vmax * 255.0, 0, 255).astype(np.uint8),
+                                 cv2.COLORMAP_JET)
+        vis = cv2.addWeighted(vis, 0.6, heat, 0.4, 0)
+
+    if exaggeration is None:
+        med = float(np.median(mag))
+        exaggeration = 0.03 * max(h, w) / (med * scale) if med > 1e-9 else 1.0
+    p0 = pts * scale
+    p1 = p0 + residuals * scale * exaggeration
+    colors = cv2.applyColorMap(np.clip(mag / vmax * 255.0, 0, 255).astype(np.uint8).reshape(-1, 1),
+                               cv2.COLORMAP_JET).reshape(-1, 3)
+    for a, b, c in zip(np.round(p0).astype(int).tolist(), np.round(p1).astype(int).tolist(),
+                       colors.tolist()):
+        cv2.circle(vis, tuple(a), 2, (255, 255, 255), -1, cv2.LINE_AA)
+        cv2.arrowedLine(vis, tuple(a), tuple(b), tuple(c), 1, cv2.LINE_AA, tipLength=0.25)
+    return vis
+
+
+def render_swipe_layers(img1: np.ndarray,
+                        img2: np.ndarray,
+                        H: np.ndarray,
+                        max_side: Optional[int] = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Capas para comparar por cortina: (referencia, flotante remuestreada al marco de la
+    referencia), ambas gris uint8 con lado <= max_side. La flotante se devuelve con
+    canal alfa (Hx Wx2: gris, alfa) que marca dónde hay datos.
+    """
+    scale = _fit_scale(img2.shape, max_side)
+    ref = img2 if scale == 1.0 else cv2.resize(img2, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    h, w = ref.shape[:2]
+    S = np.diag([scale, scale, 1.0])
+    M = S @ H
+    # Reducir antes la flotante si se va a muestrear muy por debajo de su resolución
+    s1 = min(1.0, math.sqrt(abs(np.linalg.det(M[:2, :2]))) * 2.0)
+    src = img1
+    if s1 < 0.5:
+        src = cv2.resize(img1, None, fx=s1, fy=s1, interpolation=cv2.INTER_AREA)
+        M = M @ np.diag([1.0 / s1, 1.0 / s1, 1.0])
+    warped = cv2.warpPerspective(src, M, (w, h), flags=cv2.INTER_LINEAR)
+    alpha = cv2.warpPerspective(np.full(src.shape[:2], 255, np.uint8), M, (w, h),
+                                flags=cv2.INTER_NEAREST)
+    return ref, np.dstack([warped, alpha])
+
+
 
 # --------------------------- Optimizador con early-exit ---------------------------
 
+def _eval_worker_loop(conn):
+    """Bucle del proceso de _EvalWorker: recibe (par, params, alpha) y devuelve _eval_pair."""
+    conn.send(("ready", os.getpid()))
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        try:
+            conn.send(("ok", FeatureMatcherOptimizer._eval_pair(*msg)))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+
+class _EvalWorker:
+    """
+    Proceso hijo (spawn) que evalúa pares y se mata si excede su plazo.
+
+    Se reutiliza entre pares; tras matarlo se arranca otro en la siguiente llamada a
+    start(), cuyo tiempo de arranque (importar OpenCV, etc.) no cuenta en el plazo.
+    """
+
+    def __init__(self):
+        self._ctx = get_context("spawn")
+        self._proc = None
+        self._conn = None
+        self.pid: Optional[int] = None
+
+    def start(self):
+        if self._proc is not None and self._proc.is_alive():
+            return
+        parent, child = self._ctx.Pipe()
+        self._proc = self._ctx.Process(target=_eval_worker_loop, args=(child,), daemon=True)
+        self._proc.start()
+        child.close()
+        self._conn = parent
+        _, self.pid = self._conn.recv()
+
+    def call(self, pair: Tuple[str, str], params: Dict, alpha_rmse: float, timeout: float):
+        """_eval_pair en el proceso hijo; TimeoutError (y proceso muerto) si no acaba a tiempo."""
+        self.start()
+        self._conn.send((pair, params, alpha_rmse))
+        if not self._conn.poll(max(0.0, timeout)):
+            self.kill()
+            raise TimeoutError(f"Evaluación de {pair} cortada tras {timeout:.3f} s")
+        try:
+            status, out = self._conn.recv()
+        except EOFError:
+            # El hijo murió (p.ej. fallo nativo de OpenCV)
+            self.kill()
+            raise RuntimeError("El proceso de evaluación terminó inesperadamente")
+        if status == "error":
+            raise RuntimeError(out)
+        return out
+
+    def kill(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.join(1.0)
+            if self._proc.is_alive():
+                self._proc.kill()
+                self._proc.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._proc = self._conn = self.pid = None
+
+    def close(self):
+        """Cierre ordenado (o kill si el hijo no responde)."""
+        if self._proc is not None and self._proc.is_alive():
+            try:
+                self._conn.send(None)
+                self._proc.join(2.0)
+            except (OSError, ValueError):
+                pass
+        self.kill()
+
+
 class FeatureMatcherOptimizer:
     """
     Optimización con holdout o k-fold, paralelización y early-exit.
 
     Early-exit / pruning:
       - min_inliers_threshold: si tras 'warmup_pairs' la media de inliers < umbral, aborta combinación.
-      - time_limit_s: límite de tiempo por combinación (soft-stop).
+      - time_limit_s: límite de tiempo por combinación (soft-stop: se comprueba entre pares).
+        Con hard_time_limit=True es un plazo real: cada par se evalúa en un proceso hijo
+        que se mata al agotarse el plazo (ver _EvalWorker).
+      - timeout_policy: coste de una evaluación truncada por time_limit_s. Los pares no
+        evaluados se imputan para no favorecer a quien se cortó tras pares fáciles:
+          'penalty' (por defecto): cada par pendiente cuenta como un par sin transformación;
+          'worst': cada par pendiente cuenta como el peor coste ya observado;
+          'inf': la evaluación se descarta (+inf);
+          'partial': media de los pares evaluados (comportamiento antiguo, sesgado).
       - successive_halving: evalúa fracción creciente de pares (rung=1/eta, 1/2, 1) conservando el 1/eta mejores.
       - patience_bad_folds: en k-fold, si el coste acumulado supera X * mejor_coste, se corta.
 
+    Con 'profile': [True] en el grid, el informe incluye "profile": tiempo medio por par
+    y etapa, contadores y pico de RSS de cada combinación evaluada.
+
+    Telemetría: cada evaluación (combinación sobre un subconjunto de pares) genera un
+    evento con fase, coste, motivo de poda (min_inliers, time_limit, patience_bad_folds),
+    duración por par, pares fallidos y worker. Con telemetry_path los eventos se
+    escriben según ocurren en un fichero JSON-lines; el informe incluye "telemetry"
+    con el resumen de podas y tiempos y la traza de tiempo hasta el mejor (time_to_best).
+
     Param grid (claves típicas):
       - detector: ['SIFT','AKAZE','ORB']
-      - matcher_type: ['auto','bf','flann']
+      - matcher_type: ['auto','bf','flann','blocked']
       - ratio_thresh: [0.7,0.75]
       - ransac_thresh: [2.0,3.0]
+      - scale_policy: ['none','area','gsd'], max_working_side: [None,4096]
+      - max_keypoints: [None,5000], kp_selection: ['grid','anms','response']
+      - tile_size: [None,2048], tile_overlap: [None,128] (None: según el detector), tile_max_keypoints: [None,2000], detect_threads: [None]
+      - transform_model: ['homography','affine','similarity','auto']
+      - ransac_method: ['ransac','prosac'], ransac_max_iters: [500,2000],
+        ransac_time_limit_s: [None,0.2], ransac_confidence: [0.999]
+      - descriptor_norm: [None,'l2','rootsift','whiten'] (ver normalize_descriptors)
+      - descriptor_storage: ['float32','float16','uint8'], descriptor_pca: [None,64]
+        (descriptores compactos, ver compact_descriptors; las combinaciones de uint8
+        con PCA o 'whiten' se descartan del grid, ver check_descriptor_options)
+      - guide_radius: [10.0,20.0] (matching guiado; la H de cada par viene de guides,
+        ver guided_knn_pairs)
+      - profile: [True] (instrumentación por etapa, ver StageProfile)
       - Específicos:
         ORB:   orb_nfeatures, orb_scaleFactor, orb_nlevels, ...
         SIFT:  sift_nfeatures, sift_nOctaveLayers, sift_contrastThreshold, ...
@@ -547,8 +2431,15 @@ class FeatureMatcherOptimizer:
                  time_limit_s: Optional[float] = None,
                  successive_halving: bool = False,
                  halving_eta: int = 3,
-                 patience_bad_folds: Optional[float] = None):
-        self.param_grid = list(ParameterGrid(param_grid))
+                 patience_bad_folds: Optional[float] = None,
+                 hard_time_limit: bool = False,
+                 timeout_policy: str = "penalty",
+                 # Telemetría:
+                 telemetry_path: Optional[str] = None,
+                 # Matching guiado:
+                 guides: Optional[Dict[Tuple[str, str], np.ndarray]] = None):
+        # Las combinaciones de descriptores inválidas (uint8 + PCA/whiten) no se evalúan
+        self.param_grid = [p for p in ParameterGrid(param_grid) if _descriptor_options_ok(p)]
         if not self.param_grid:
             raise ValueError("param_grid vacío.")
 
@@ -566,22 +2457,42 @@ class FeatureMatcherOptimizer:
         self.successive_halving = successive_halving
         self.halving_eta = max(2, halving_eta)
         self.patience_bad_folds = patience_bad_folds
+        if timeout_policy not in ("penalty", "worst", "inf", "partial"):
+            raise ValueError(f"timeout_policy desconocida: {timeout_policy}")
+        self.hard_time_limit = hard_time_limit
+        self.timeout_policy = timeout_policy
+        self._worker: Optional[_EvalWorker] = None
+
+        self.telemetry_path = telemetry_path
+        self.guides = guides
 
         self.best_params_: Optional[Dict] = None
         self.summary_: Optional[Dict] = None
+        self.telemetry_: List[Dict] = []
+        self._profiles: Dict[str, Dict] = {}
+        self._candidate_ids = {self._params_key(p): i for i, p in enumerate(self.param_grid)}
+        self._t0: Optional[float] = None
+        self._incumbent: Optional[float] = None
+        self._telemetry_file = None
 
     @staticmethod
-    def _eval_pair(pair: Tuple[str, str], params: Dict, alpha_rmse: float) -> Tuple[float, int]:
+    def _params_key(params: Dict) -> str:
+        return json.dumps(params, sort_keys=True, default=str)
+
+    @staticmethod
+    def _eval_pair(pair: Tuple[str, str], params: Dict,
+                   alpha_rmse: float) -> Tuple[float, int, Optional[StageProfile]]:
         p1, p2 = pair
-        img1, img2 = _read_gray(p1), _read_gray(p2)
+        det_params, engine_kw = _split_params(params)
+        read_prof = make_profile(engine_kw.get("profile", False))
+        with read_prof.stage("read"):
+            img1, img2 = _read_gray(p1), _read_gray(p2)
 
         detector = params.get("detector", "ORB")
         matcher_type = params.get("matcher_type", "auto")
         ratio_thresh = params.get("ratio_thresh", 0.75)
         ransac_thresh = params.get("ransac_thresh", 3.0)
 
-        det_params = {k: v for k, v in params.items() if k.startswith(("orb_", "sift_", "akaze_"))}
-
         res = match_and_score(
             img1, img2,
             detector_name=detector,
@@ -589,17 +2500,141 @@ class FeatureMatcherOptimizer:
             matcher_type=matcher_type,
             ratio_thresh=ratio_thresh,
             ransac_thresh=ransac_thresh,
-            alpha_rmse=alpha_rmse
+            alpha_rmse=alpha_rmse,
+            **engine_kw
         )
-        return res.cost, res.inliers
+        prof = res.profile.merge(read_prof) if res.profile is not None else None
+        return res.cost, res.inliers, prof
+
+    def _pair_params(self, pair: Tuple[str, str], params: Dict) -> Dict:
+        """params con la H guía del par (si la hay en self.guides)."""
+        guide_H = _guide_for(self.guides, *pair)
+        return params if guide_H is None else dict(params, guide_H=guide_H)
+
+    def _record_profile(self, params: Dict, prof: StageProfile):
+        """Acumula el StageProfile de un par en el de su combinación de parámetros."""
+        key = self._params_key(params)
+        entry = self._profiles.setdefault(key, {"params": dict(params), "n_pairs": 0,
+                                                "stages_s": {}, "counts": {}, "peak_rss_mb": None})
+        entry["n_pairs"] += 1
+        for name, t in prof.stages.items():
+            entry["stages_s"][name] = entry["stages_s"].get(name, 0.0) + t
+        for name, n in prof.counts.items():
+            entry["counts"][name] = entry["counts"].get(name, 0) + n
+        rss = [v for v in prof.rss_mb.values() if v is not None]
+        if rss:
+            entry["peak_rss_mb"] = max(rss + [entry["peak_rss_mb"] or 0.0])
+
+    def _profile_report(self) -> Dict:
+        """{"profile": [...]} con medias por par de cada combinación (vacío si no hay medidas)."""
+        if not self._profiles:
+            return {}
+        rows = []
+        for entry in self._profiles.values():
+            n = entry["n_pairs"]
+            stages = {k: v / n for k, v in entry["stages_s"].items()}
+            rows.append({
+                "params": entry["params"],
+                "n_pairs": n,
+                "mean_stages_s": stages,
+                "mean_total_s": float(sum(stages.values())),
+                "mean_counts": {k: v / n for k, v in entry["counts"].items()},
+                "peak_rss_mb": entry["peak_rss_mb"],
+            })
+        rows.sort(key=lambda r: r["mean_total_s"], reverse=True)
+        return {"profile": rows}
+
+    # --- telemetría ---
+    def _elapsed(self) -> float:
+        return time.time() - self._t0 if self._t0 is not None else 0.0
+
+    def _emit(self, event: str, **fields):
+        """Registra un evento (y lo escribe en telemetry_path si está abierto)."""
+        record = {"event": event, "t": round(self._elapsed(), 6), **fields}
+        self.telemetry_.append(record)
+        if self._telemetry_file is not None:
+            self._telemetry_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._telemetry_file.flush()
+
+    def _note_incumbent(self, cost: float, params: Dict, phase: str):
+        """Evento 'incumbent' si 'cost' mejora al mejor visto hasta ahora en la fase."""
+        if self._incumbent is None or cost < self._incumbent:
+            self._incumbent = cost
+            self._emit("incumbent", phase=phase, cost=cost,
+                       candidate=self._candidate_ids.get(self._params_key(params)), params=params)
+
+    def _telemetry_report(self) -> Dict:
+        """{"telemetry": ...}: podas, tiempos por combinación, pares lentos y time_to_best."""
+        evals = [e for e in self.telemetry_ if e["event"] == "eval"]
+        pruned: Dict[str, int] = {}
+        per_candidate: Dict[int, Dict] = {}
+        pair_times: Dict[str, List[float]] = {}
+        failed: Dict[str, int] = {}
+        for e in self.telemetry_:
+            if e.get("pruned"):
+                pruned[e["pruned"]] = pruned.get(e["pruned"], 0) + 1
+            if e["event"] == "prune":
+                per_candidate.setdefault(e["candidate"], {"candidate": e["candidate"], "params": e["params"],
+                                                          "n_evals": 0, "total_s": 0.0, "pruned": []})
+                per_candidate[e["candidate"]]["pruned"].append(e["pruned"])
+        for e in evals:
+            c = per_candidate.setdefault(e["candidate"], {"candidate": e["candidate"], "params": e["params"],
+                                                          "n_evals": 0, "total_s": 0.0, "pruned": []})
+            c["n_evals"] += 1
+            c["total_s"] += e["elapsed_s"]
+            if e["pruned"]:
+                c["pruned"].append(e["pruned"])
+            for pair, t in zip(e["pairs"], e["pair_s"]):
+                pair_times.setdefault(pair, []).append(t)
+            for pair in e["failed_pairs"]:
+                failed[pair] = failed.get(pair, 0) + 1
+
+        eval_s = [e["elapsed_s"] for e in evals]
+        slow_pairs = sorted(({"pair": p, "mean_s": float(np.mean(t)), "max_s": float(np.max(t)), "n": len(t)}
+                             for p, t in pair_times.items()), key=lambda r: r["mean_s"], reverse=True)
+        return {"telemetry": {
+            "log": self.telemetry_path,
+            "elapsed_s": self._elapsed(),
+            "n_evaluations": len(evals),
+            "n_pair_evaluations": sum(len(e["pair_s"]) for e in evals),
+            "pruned": pruned,
+            "eval_time_s": {
+                "total": float(np.sum(eval_s)) if eval_s else 0.0,
+                "mean": float(np.mean(eval_s)) if eval_s else None,
+                "max": float(np.max(eval_s)) if eval_s else None,
+            },
+            "candidates": sorted(per_candidate.values(), key=lambda c: c["total_s"], reverse=True),
+            "slow_pairs": slow_pairs[:10],
+            "failed_pairs": failed,
+            "time_to_best": [{"t": e["t"], "phase": e["phase"], "cost": e["cost"], "candidate": e["candidate"]}
+                             for e in self.telemetry_ if e["event"] == "incumbent"],
+        }}
+
+    def _truncated_cost(self, costs: List[float], n_pairs: int) -> float:
+        """Coste medio de una evaluación cortada por tiempo según timeout_policy."""
+        missing = n_pairs - len(costs)
+        if self.timeout_policy == "inf" or (not costs and self.timeout_policy != "penalty"):
+            return float("inf")
+        if self.timeout_policy == "partial":
+            return float(np.mean(costs))
+        fill = _NO_H_PENALTY if self.timeout_policy == "penalty" else max(costs)
+        return float(np.mean(list(costs) + [fill] * missing))
 
-    def _mean_cost_with_early_exit(self, pairs_subset, params):
+    def _mean_cost_with_early_exit(self, pairs_subset, params, phase: str = ""):
         """
         Compute mean cost over a subset of pairs with optional early exit based on:
         - time limit
         - minimum inliers threshold after warmup
         Returns a float cost (lower is better), or +inf on hard failure.
+        Time-limited evaluations are costed with _truncated_cost (timeout_policy).
+        Emits one 'eval' telemetry event (see _emit) tagged with 'phase'.
         """
+        if self._worker is not None:
+            # Arrancar (o rearrancar tras un kill) fuera del plazo de la evaluación
+            self._worker.start()
+            worker = f"{self._worker.pid}:eval-worker"
+        else:
+            worker = f"{os.getpid()}:{threading.current_thread().name}"
         start = time.time()
 
         # Empty subset guard
@@ -608,6 +2643,9 @@ class FeatureMatcherOptimizer:
 
         inliers_hist = []
         costs = []
+        pair_s, failed = [], []
+        pruned = None
+        killed = False
 
         # Clamp warmup to the actual subset size
         eff_warmup = int(min(max(int(self.warmup_pairs), 0), len(pairs_subset)))
@@ -615,16 +2653,32 @@ class FeatureMatcherOptimizer:
         for i, pair in enumerate(pairs_subset, 1):
             # --- time limit early exit ---
             if self.time_limit_s is not None and (time.time() - start) > float(self.time_limit_s):
-                # If we have at least one cost, return its mean; else +inf
-                return float(np.mean(costs)) if costs else float("inf")
+                pruned = "time_limit"
+                break
 
             # Do the actual matching/eval for this pair
+            t_pair = time.time()
             try:
-                # use the existing _eval_pair helper (staticmethod) and pass alpha_rmse
-                cost_i, inliers_i = self._eval_pair(pair, params, self.alpha_rmse)
+                if self._worker is not None:
+                    # Hard deadline: the worker is killed when the remaining budget runs out
+                    remaining = float(self.time_limit_s) - (t_pair - start)
+                    cost_i, inliers_i, prof_i = self._worker.call(pair, self._pair_params(pair, params),
+                                                                  self.alpha_rmse, remaining)
+                else:
+                    # use the existing _eval_pair helper (staticmethod) and pass alpha_rmse
+                    cost_i, inliers_i, prof_i = self._eval_pair(pair, self._pair_params(pair, params),
+                                                                self.alpha_rmse)
+            except TimeoutError:
+                pair_s.append(time.time() - t_pair)
+                pruned, killed = "time_limit", True
+                break
             except Exception:
                 # hard failure for this pair -> treat as worst case
-                cost_i, inliers_i = float("inf"), 0
+                cost_i, inliers_i, prof_i = float("inf"), 0, None
+                failed.append(f"{pair[0]};{pair[1]}")
+            pair_s.append(time.time() - t_pair)
+            if prof_i is not None:
+                self._record_profile(params, prof_i)
 
             costs.append(cost_i)
             inliers_hist.append(inliers_i)
@@ -634,10 +2688,27 @@ class FeatureMatcherOptimizer:
                 # mean inliers over the pairs seen so far
                 mean_inl = float(np.mean(inliers_hist))
                 if mean_inl < float(self.min_inliers_threshold):
-                    return float("inf")
-
-        # Normal completion: return mean cost
-        return float(np.mean(costs)) if costs else float("inf")
+                    pruned = "min_inliers"
+                    break
+
+        if pruned == "min_inliers":
+            mean_cost = float("inf")
+        elif pruned == "time_limit":
+            mean_cost = self._truncated_cost(costs, len(pairs_subset))
+        else:
+            # Normal completion: mean of the costs seen (+inf if none)
+            mean_cost = float(np.mean(costs)) if costs else float("inf")
+
+        self._emit("eval", phase=phase,
+                   candidate=self._candidate_ids.get(self._params_key(params)), params=params,
+                   n_pairs=len(pairs_subset), n_evaluated=len(costs),
+                   cost=mean_cost, pruned=pruned, elapsed_s=time.time() - start,
+                   imputed_pairs=len(pairs_subset) - len(costs) if pruned == "time_limit" else 0,
+                   killed=killed,
+                   worker=worker,
+                   pairs=[f"{a};{b}" for a, b in pairs_subset[:len(pair_s)]],
+                   pair_s=pair_s, failed_pairs=failed)
+        return mean_cost
 
 
     def _successive_halving_search(self, pairs: List[Tuple[str, str]]) -> Dict:
@@ -667,9 +2738,12 @@ class FeatureMatcherOptimizer:
         for r, n_pairs in enumerate(rungs, 1):
             subset = pairs[:n_pairs]
             scored = []
+            # El mejor de cada rung se compara sólo dentro de ese rung (subconjuntos distintos)
+            self._incumbent = None
             for p in candidates:
-                mean_c = self._mean_cost_with_early_exit(subset, p)
+                mean_c = self._mean_cost_with_early_exit(subset, p, phase=f"sh_rung_{r}")
                 scored.append((mean_c, p))
+                self._note_incumbent(mean_c, p, phase=f"sh_rung_{r}")
             scored.sort(key=lambda x: x[0])
             keep = max(1, len(scored) // self.halving_eta) if r < len(rungs) else len(scored)
             candidates = [p for _, p in scored[:keep]]
@@ -677,7 +2751,7 @@ class FeatureMatcherOptimizer:
                                  "keep": keep, "scores": [{"mean_cost": c, "params": par} for c, par in scored]})
 
         best_params = candidates[0]
-        best_cost = self._mean_cost_with_early_exit(pairs, best_params)
+        best_cost = self._mean_cost_with_early_exit(pairs, best_params, phase="sh_final")
         return {"best_params": best_params, "best_cost": best_cost, "rungs": ranking_info}
 
     def fit(self, pairs: Sequence[Tuple[str, str]]) -> Tuple[Dict, Dict]:
@@ -685,7 +2759,30 @@ class FeatureMatcherOptimizer:
         if len(pairs) < 2:
             raise ValueError("Se requieren al menos 2 pares.")
         report = {"grid_size": len(self.param_grid)}
-
+        self._profiles = {}
+        self.telemetry_ = []
+        self._incumbent = None
+        self._t0 = time.time()
+        self._telemetry_file = open(self.telemetry_path, "w", encoding="utf-8") if self.telemetry_path else None
+        if self.hard_time_limit and self.time_limit_s is not None:
+            self._worker = _EvalWorker()
+        try:
+            self._emit("start", grid_size=len(self.param_grid), n_pairs=len(pairs),
+                       cv_mode=self.cv_mode, successive_halving=self.successive_halving)
+            best_params, summary = self._fit(pairs, report)
+            self._emit("end", best_params=best_params)
+            summary.update(self._telemetry_report())
+        finally:
+            if self._telemetry_file is not None:
+                self._telemetry_file.close()
+                self._telemetry_file = None
+            if self._worker is not None:
+                self._worker.close()
+                self._worker = None
+        return best_params, summary
+
+    def _fit(self, pairs: List[Tuple[str, str]], report: Dict) -> Tuple[Dict, Dict]:
+        """Búsqueda según cv_mode (ver fit, que añade la telemetría al informe)."""
         if self.cv_mode == "kfold":
             n_samples = len(pairs)
             if self.cv_mode == "kfold":
@@ -706,17 +2803,21 @@ class FeatureMatcherOptimizer:
                 fold_costs = []
                 for fold_idx, (tr_idx, va_idx) in enumerate(kf.split(pairs), 1):
                     val_pairs = [pairs[i] for i in va_idx]
-                    c = self._mean_cost_with_early_exit(val_pairs, params)
+                    c = self._mean_cost_with_early_exit(val_pairs, params, phase=f"kfold_{fold_idx}")
                     fold_costs.append(c)
 
                     # Paciencia: si ya es mucho peor que el mejor, corto
                     if self.patience_bad_folds is not None and best_score < float("inf"):
                         current_mean = float(np.mean(fold_costs))
                         if current_mean > self.patience_bad_folds * best_score:
+                            self._emit("prune", phase="kfold", pruned="patience_bad_folds",
+                                       candidate=self._candidate_ids.get(self._params_key(params)),
+                                       params=params, folds_done=fold_idx, cost=current_mean)
                             break
 
                 mean_c, std_c = float(np.mean(fold_costs)), float(np.std(fold_costs))
                 all_scores.append({"params": params, "val_mean_cost": mean_c, "val_std_cost": std_c})
+                self._note_incumbent(mean_c, params, phase="kfold")
                 if mean_c < best_score:
                     best_score, best_params = mean_c, dict(params)
 
@@ -727,6 +2828,7 @@ class FeatureMatcherOptimizer:
                 "n_splits": self.n_splits,
                 "best_cv_mean_cost": best_score,
                 "ranking": sorted(all_scores, key=lambda x: x["val_mean_cost"]),
+                **self._profile_report(),
             }
             return best_params, self.summary_
 
@@ -737,7 +2839,7 @@ class FeatureMatcherOptimizer:
         if self.successive_halving:
             sh = self._successive_halving_search(train)
             best_params, best_train_cost = sh["best_params"], sh["best_cost"]
-            test_costs = [self._mean_cost_with_early_exit([t], best_params) for t in test]
+            test_costs = [self._mean_cost_with_early_exit([t], best_params, phase="test") for t in test]
             self.best_params_ = best_params
             self.summary_ = {
                 **report,
@@ -746,18 +2848,20 @@ class FeatureMatcherOptimizer:
                 "best_train_cost": best_train_cost,
                 "test_mean_cost": float(np.mean(test_costs)) if test_costs else None,
                 "rungs": sh["rungs"],
+                **self._profile_report(),
             }
             return best_params, self.summary_
 
         # Holdout plano
         best_cost, best_params, train_costs = float("inf"), None, []
         for params in self.param_grid:
-            mean_c = self._mean_cost_with_early_exit(train, params)
+            mean_c = self._mean_cost_with_early_exit(train, params, phase="train")
             train_costs.append((params, mean_c))
+            self._note_incumbent(mean_c, params, phase="train")
             if mean_c < best_cost:
                 best_cost, best_params = mean_c, dict(params)
 
-        test_costs = [self._mean_cost_with_early_exit([t], best_params) for t in test]
+        test_costs = [self._mean_cost_with_early_exit([t], best_params, phase="test") for t in test]
         self.best_params_ = best_params
         self.summary_ = {
             **report,
@@ -767,6 +2871,7 @@ class FeatureMatcherOptimizer:
             "test_mean_cost": float(np.mean(test_costs)) if test_costs else None,
             "test_std_cost": float(np.std(test_costs)) if test_costs else None,
             "train_costs": [{"params": p, "mean_cost": c} for (p, c) in sorted(train_costs, key=lambda x: x[1])],
+            **self._profile_report(),
         }
         return best_params, self.summary_
 
@@ -793,8 +2898,37 @@ if __name__ == "__main__":
     parser.add_argument("--min-inliers", type=int, default=None, help="Umbral medio de inliers tras warmup.")
     parser.add_argument("--warmup-pairs", type=int, default=2, help="# pares antes de aplicar min-inliers.")
     parser.add_argument("--time-limit-s", type=float, default=None, help="Límite de tiempo por combinación.")
+    parser.add_argument("--hard-time-limit", action="store_true",
+                        help="Hace cumplir --time-limit-s evaluando en un proceso hijo que se mata al vencer.")
+    parser.add_argument("--timeout-policy", type=str, default="penalty",
+                        choices=["penalty", "worst", "inf", "partial"],
+                        help="Coste imputado a los pares no evaluados de una combinación cortada por tiempo.")
     parser.add_argument("--patience-bad-folds", type=float, default=None,
                         help="En k-fold, corta si coste acumulado > factor * mejor_coste.")
+    parser.add_argument("--telemetry", type=str, default=None,
+                        help="Ruta del log JSON-lines de telemetría (un evento por evaluación).")
+
+    # Modelo y presupuesto de la estimación robusta (se aplica a todo el grid salvo que el grid lo defina)
+    parser.add_argument("--max-keypoints", type=int, default=None,
+                        help="Presupuesto de keypoints por imagen (selección uniforme).")
+    parser.add_argument("--transform-model", type=str, default=None,
+                        choices=["homography", "affine", "similarity", "auto"],
+                        help="Modelo de transformación a estimar.")
+    parser.add_argument("--ransac-max-iters", type=int, default=None, help="Tope de iteraciones RANSAC/PROSAC.")
+    parser.add_argument("--ransac-time-limit-s", type=float, default=None,
+                        help="Límite de tiempo por estimación robusta.")
+    parser.add_argument("--descriptor-norm", type=str, nargs="+", default=None, choices=list(DESCRIPTOR_NORMS),
+                        help="Post-proceso de descriptores float a explorar en el grid (p.ej. none rootsift).")
+    parser.add_argument("--descriptor-storage", type=str, default=None, choices=list(DESCRIPTOR_STORAGES),
+                        help="Representación compacta de descriptores float (float16, uint8).")
+    parser.add_argument("--descriptor-pca", type=int, default=None,
+                        help="Dimensiones PCA de los descriptores float (base ajustada sobre img2).")
+    parser.add_argument("--guide-hjson", type=str, default=None,
+                        help="JSON de homografías (OUT_HJSON de una ejecución anterior) para matching guiado.")
+    parser.add_argument("--guide-radius", type=float, default=None,
+                        help="Radio de búsqueda del matching guiado (px de la imagen de trabajo).")
+    parser.add_argument("--profile", action="store_true",
+                        help="Tiempos por etapa, contadores y memoria en el informe y en OUT_HJSON.")
 
     # Salidas
     parser.add_argument("--out-json", type=str, required=True, help="Ruta del informe principal (JSON).")
@@ -824,6 +2958,26 @@ if __name__ == "__main__":
         "orb_nlevels": [8, 12],
     }
 
+    if args.max_keypoints is not None:
+        grid.setdefault("max_keypoints", [args.max_keypoints])
+    if args.transform_model is not None:
+        grid.setdefault("transform_model", [args.transform_model])
+    if args.ransac_max_iters is not None:
+        grid.setdefault("ransac_max_iters", [args.ransac_max_iters])
+    if args.ransac_time_limit_s is not None:
+        grid.setdefault("ransac_time_limit_s", [args.ransac_time_limit_s])
+    if args.descriptor_norm is not None:
+        grid.setdefault("descriptor_norm", args.descriptor_norm)
+    if args.descriptor_storage is not None:
+        grid.setdefault("descriptor_storage", [args.descriptor_storage])
+    if args.descriptor_pca is not None:
+        grid.setdefault("descriptor_pca", [args.descriptor_pca])
+    if args.guide_radius is not None:
+        grid.setdefault("guide_radius", [args.guide_radius])
+    if args.profile:
+        grid.setdefault("profile", [True])
+    guides = load_guide_homographies(args.guide_hjson) if args.guide_hjson else None
+
     # Ejecutar optimización
     opt = FeatureMatcherOptimizer(
         param_grid=grid,
@@ -838,7 +2992,11 @@ if __name__ == "__main__":
         min_inliers_threshold=args.min_inliers,
         warmup_pairs=args.warmup_pairs,
         time_limit_s=args.time_limit_s,
-        patience_bad_folds=args.patience_bad_folds
+        patience_bad_folds=args.patience_bad_folds,
+        hard_time_limit=args.hard_time_limit,
+        timeout_policy=args.timeout_policy,
+        telemetry_path=args.telemetry,
+        guides=guides,
     )
     best, report = opt.fit(pairs)
 
@@ -849,7 +3007,7 @@ if __name__ == "__main__":
     # Guardar homografías por par si se ha pedido
     if args.out_hjson:
         try:
-            save_homographies_json(pairs, {**best}, args.out_hjson, alpha_rmse=args.alpha)
+            save_homographies_json(pairs, {**best}, args.out_hjson, alpha_rmse=args.alpha, guides=guides)
         except Exception as e:
             print(f"[WARN] No se pudo escribir OUT_HJSON: {e}")
 
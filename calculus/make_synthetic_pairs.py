@@ -33,9 +33,16 @@ warped2 = np.clip(warped2.astype(np.int16) + noise, 0, 255).astype(np.uint8)
 cv2.imwrite("data/A2.png", base)
 cv2.imwrite("data/B2.png", warped2)
 
+# Verdad terreno (mismo formato que groundtruth.json de benchmark.py)
+with open("data/groundtruth.json", "w", encoding="utf-8") as f:
+    json.dump({
+        "A1_B1": {"img1": "data/A1.png", "img2": "data/B1.png", "H_true": H_true.tolist()},
+        "A2_B2": {"img1": "data/A2.png", "img2": "data/B2.png", "H_true": H2.tolist()},
+    }, f, indent=2)
+
 # Pairs.txt
 with open("pairs.txt", "w", encoding="utf-8") as f:
     f.write("data/A1.png; data/B1.png\n")
     f.write("data/A2.png; data/B2.png\n")
 
-print("Listo. Archivos escritos en ./data y ./pairs.txt")
+print("Listo. Archivos escritos en ./data (con groundtruth.json) y ./pairs.txt")
@@ -68,10 +68,15 @@ class Ui_MainWindow(object):
 
         self.grid_floating.addWidget(self.btnBrowseFloating, 0, 1, 1, 1)
 
+        self.btnBatch = QPushButton(self.groupFloating)
+        self.btnBatch.setObjectName(u"btnBatch")
+
+        self.grid_floating.addWidget(self.btnBatch, 0, 2, 1, 1)
+
         self.labelFloatingInfo = QLabel(self.groupFloating)
         self.labelFloatingInfo.setObjectName(u"labelFloatingInfo")
 
-        self.grid_floating.addWidget(self.labelFloatingInfo, 1, 0, 1, 2)
+        self.grid_floating.addWidget(self.labelFloatingInfo, 1, 0, 1, 3)
 
 
         self.verticalLayout_sources.addWidget(self.groupFloating)
@@ -468,6 +473,10 @@ class Ui_MainWindow(object):
         self.groupFloating.setTitle(QCoreApplication.translate("MainWindow", u"Imagen a georreferenciar (flotante)", None))
         self.editFloatingPath.setPlaceholderText(QCoreApplication.translate("MainWindow", u"Ruta de la imagen (tif, jpg, png...)", None))
         self.btnBrowseFloating.setText(QCoreApplication.translate("MainWindow", u"Examinar...", None))
+#if QT_CONFIG(tooltip)
+        self.btnBatch.setToolTip(QCoreApplication.translate("MainWindow", u"Procesar varias im\u00e1genes flotantes contra la referencia actual", None))
+#endif // QT_CONFIG(tooltip)
+        self.btnBatch.setText(QCoreApplication.translate("MainWindow", u"Lote...", None))
         self.labelFloatingInfo.setText(QCoreApplication.translate("MainWindow", u"No hay imagen cargada", None))
         self.groupReference.setTitle(QCoreApplication.translate("MainWindow", u"Capa de referencia (georreferenciada)", None))
         self.editReferencePath.setPlaceholderText(QCoreApplication.translate("MainWindow", u"Ruta de la capa (raster/vector)", None))
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Visor ampliable de matches a resolución completa.
+
+La previsualización de la pestaña 'Matches' se dibuja reducida; este visor permite
+acercarse hasta ver los píxeles originales. Sólo se dibuja la zona visible a la escala
+de pantalla (feature_matcher_cv.render_matches con ROI), así que el coste por repintado
+depende del tamaño de la ventana y no del de las imágenes.
+"""
+
+import numpy as np
+
+from qgis.PyQt import QtCore, QtGui, QtWidgets
+
+from .calculus import feature_matcher_cv
+
+# Ampliación máxima (px de pantalla por px original) y espera antes de repintar
+MAX_ZOOM = 8.0
+RENDER_DEBOUNCE_MS = 30
+
+
+class MatchesZoomDialog(QtWidgets.QDialog):
+    """
+    Composición [flotante | referencia] con rueda = zoom (centrado en el cursor),
+    arrastre = desplazamiento y doble clic = volver a encajar.
+    """
+
+    def __init__(self, img1: np.ndarray, img2: np.ndarray,
+                 pts1: np.ndarray, pts2: np.ndarray, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Matches (resolución completa)")
+        self.resize(1200, 700)
+
+        self._img1, self._img2 = img1, img2
+        self._pts1, self._pts2 = pts1, pts2
+        self._full_w, self._full_h = feature_matcher_cv.matches_canvas_size(img1.shape, img2.shape)
+
+        self._label = QtWidgets.QLabel(self)
+        self._label.setAlignment(QtCore.Qt.AlignCenter)
+        self._label.setMinimumSize(1, 1)
+        self._label.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
+        self._label.setStyleSheet("background-color: black;")
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self._label)
+
+        # Vista: centro (coordenadas de la composición original) y zoom; None = encajar
+        self._center = QtCore.QPointF(self._full_w / 2.0, self._full_h / 2.0)
+        self._zoom = None
+        self._drag_pos = None
+        self._vis = None  # array dibujado actual (el QImage lo referencia sin copia)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(RENDER_DEBOUNCE_MS)
+        self._timer.timeout.connect(self._render)
+
+        self._label.installEventFilter(self)
+
+    # --- vista ---
+    def _fit_zoom(self) -> float:
+        size = self._label.size()
+        return min(size.width() / float(self._full_w), size.height() / float(self._full_h))
+
+    def _current_zoom(self) -> float:
+        return self._fit_zoom() if self._zoom is None else self._zoom
+
+    def _clamp_center(self):
+        z = self._current_zoom()
+        half_w = self._label.width() / (2.0 * z)
+        half_h = self._label.height() / (2.0 * z)
+        cx = min(max(self._center.x(), min(half_w, self._full_w / 2.0)),
+                 max(self._full_w - half_w, self._full_w / 2.0))
+        cy = min(max(self._center.y(), min(half_h, self._full_h / 2.0)),
+                 max(self._full_h - half_h, self._full_h / 2.0))
+        self._center = QtCore.QPointF(cx, cy)
+
+    def _to_full(self, pos: QtCore.QPointF) -> QtCore.QPointF:
+        z = self._current_zoom()
+        return QtCore.QPointF(self._center.x() + (pos.x() - self._label.width() / 2.0) / z,
+                              self._center.y() + (pos.y() - self._label.height() / 2.0) / z)
+
+    def _schedule(self):
+        self._timer.start()
+
+    def _render(self):
+        if self._label.width() <= 0 or self._label.height() <= 0:
+            return
+        self._clamp_center()
+        z = self._current_zoom()
+        half_w = self._label.width() / (2.0 * z)
+        half_h = self._label.height() / (2.0 * z)
+        roi = (max(0.0, self._center.x() - half_w), max(0.0, self._center.y() - half_h),
+               min(float(self._full_w), self._center.x() + half_w),
+               min(float(self._full_h), self._center.y() + half_h))
+
+        vis = feature_matcher_cv.render_matches(
+            self._img1, self._img2, self._pts1, self._pts2, scale=z, roi=roi,
+        )
+        self._vis = vis
+        h, w = vis.shape[:2]
+        qimg = QtGui.QImage(vis.data, w, h, vis.strides[0], QtGui.QImage.Format_BGR888)
+        self._label.setPixmap(QtGui.QPixmap.fromImage(qimg))
+
+    # --- eventos ---
+    def eventFilter(self, obj, event):
+        if obj is not self._label:
+            return False
+
+        etype = event.type()
+        if etype == QtCore.QEvent.Resize:
+            self._schedule()
+        elif etype == QtCore.QEvent.Wheel:
+            pos = QtCore.QPointF(event.pos())
+            anchor = self._to_full(pos)
+            factor = 1.25 if event.angleDelta().y() > 0 else 0.8
+            fit = self._fit_zoom()
+            zoom = min(MAX_ZOOM, max(fit, self._current_zoom() * factor))
+            self._zoom = None if zoom <= fit else zoom
+            # Mantener bajo el cursor el mismo punto de la composición
+            z = self._current_zoom()
+            self._center = QtCore.QPointF(anchor.x() - (pos.x() - self._label.width() / 2.0) / z,
+                                          anchor.y() - (pos.y() - self._label.height() / 2.0) / z)
+            self._schedule()
+            return True
+        elif etype == QtCore.QEvent.MouseButtonPress and event.button() == QtCore.Qt.LeftButton:
+            self._drag_pos = QtCore.QPointF(event.pos())
+            return True
+        elif etype == QtCore.QEvent.MouseMove and self._drag_pos is not None:
+            pos = QtCore.QPointF(event.pos())
+            z = self._current_zoom()
+            delta = (pos - self._drag_pos) / z
+            self._center = self._center - delta
+            self._drag_pos = pos
+            self._schedule()
+            return True
+        elif etype == QtCore.QEvent.MouseButtonRelease:
+            self._drag_pos = None
+            return True
+        elif etype == QtCore.QEvent.MouseButtonDblClick:
+            self._zoom = None
+            self._center = QtCore.QPointF(self._full_w / 2.0, self._full_h / 2.0)
+            self._schedule()
+            return True
+        return False
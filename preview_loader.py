@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Carga diferida y reducida de previsualizaciones.
+
+Las imágenes flotantes y de referencia pueden ser GeoTIFF de varios gigapíxeles, así
+que aquí nunca se decodifican a resolución completa: se leen directamente a un tamaño
+acotado (QImageReader.setScaledSize o GDAL usando overviews) dentro de un QgsTask y se
+construye una pirámide pequeña de la que el diálogo toma el nivel adecuado al QLabel.
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from qgis.PyQt import QtCore, QtGui
+from qgis.core import QgsTask
+
+from .calculus import feature_matcher_cv
+
+# Lado máximo del nivel superior de la pirámide y lado mínimo del último nivel
+PREVIEW_MAX_SIDE = 2048
+PYRAMID_MIN_SIDE = 128
+# Formatos que se leen antes con GDAL (overviews; Qt decodificaría la imagen completa)
+_GDAL_FIRST_EXT = {".tif", ".tiff", ".vrt", ".img", ".jp2"}
+# Espera tras el último cambio de tamaño antes del reescalado suave, y tamaños cacheados
+RESIZE_DEBOUNCE_MS = 150
+SCALED_CACHE_PER_LABEL = 4
+
+
+def _array_to_qimage(arr: np.ndarray) -> QtGui.QImage:
+    """Copia un array uint8 (gris o RGB) a un QImage independiente del buffer."""
+    arr = np.ascontiguousarray(arr)
+    h, w = arr.shape[:2]
+    if arr.ndim == 2:
+        qimg = QtGui.QImage(arr.data, w, h, w, QtGui.QImage.Format_Grayscale8)
+    else:
+        qimg = QtGui.QImage(arr.data, w, h, 3 * w, QtGui.QImage.Format_RGB888)
+    return qimg.copy()
+
+
+def _read_with_qt(path: str, max_side: int) -> QtGui.QImage:
+    reader = QtGui.QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and max(size.width(), size.height()) > max_side:
+        s = max_side / float(max(size.width(), size.height()))
+        reader.setScaledSize(QtCore.QSize(max(1, int(round(size.width() * s))),
+                                          max(1, int(round(size.height() * s)))))
+    return reader.read()
+
+
+def _read_with_gdal(path: str, max_side: int, bounds=None) -> QtGui.QImage:
+    arr, _, _ = feature_matcher_cv.read_window(path, bounds, max_side=max_side, gray=False)
+    return _array_to_qimage(arr)
+
+
+def load_preview_image(path: str, max_side: int = PREVIEW_MAX_SIDE, bounds=None) -> QtGui.QImage:
+    """
+    Lee 'path' reducido a lado <= max_side sin decodificar la resolución completa.
+
+    Con 'bounds' (xmin, ymin, xmax, ymax en el CRS del raster) sólo se lee esa ventana,
+    lo que requiere GDAL. Devuelve un QImage nulo si ningún lector puede abrir el fichero.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if bounds is not None:
+        readers = (_read_with_gdal,)
+    elif ext in _GDAL_FIRST_EXT:
+        readers = (_read_with_gdal, _read_with_qt)
+    else:
+        readers = (_read_with_qt, _read_with_gdal)
+
+    for reader in readers:
+        try:
+            if reader is _read_with_gdal:
+                img = reader(path, max_side, bounds)
+            else:
+                img = reader(path, max_side)
+        except (RuntimeError, ValueError, OSError):
+            continue
+        if not img.isNull():
+            return img
+    return QtGui.QImage()
+
+
+class PreviewPyramid:
+    """
+    Niveles de una previsualización, del mayor al menor (cada uno mitad del anterior).
+
+    Los niveles son QImage (se pueden crear en cualquier hilo); los QPixmap se generan
+    bajo demanda en el hilo de la GUI y se guardan por nivel.
+    """
+
+    def __init__(self, image: QtGui.QImage, min_side: int = PYRAMID_MIN_SIDE):
+        self.levels = []
+        self._pixmaps = {}
+        if image is None or image.isNull():
+            return
+        self.levels.append(image)
+        while max(image.width(), image.height()) // 2 >= min_side:
+            image = image.scaled(image.width() // 2, image.height() // 2,
+                                 QtCore.Qt.IgnoreAspectRatio,
+                                 QtCore.Qt.SmoothTransformation)
+            self.levels.append(image)
+
+    def isNull(self) -> bool:
+        return not self.levels
+
+    def size(self) -> QtCore.QSize:
+        return self.levels[0].size() if self.levels else QtCore.QSize()
+
+    def level_index_for(self, size: QtCore.QSize) -> int:
+        """Nivel más pequeño que, ajustado a 'size' con KeepAspectRatio, no se amplía."""
+        for i in range(len(self.levels) - 1, -1, -1):
+            img = self.levels[i]
+            if img.width() >= size.width() or img.height() >= size.height():
+                return i
+        return 0
+
+    def pixmap_for(self, size: QtCore.QSize) -> QtGui.QPixmap:
+        if not self.levels:
+            return QtGui.QPixmap()
+        i = self.level_index_for(size)
+        pix = self._pixmaps.get(i)
+        if pix is None:
+            pix = QtGui.QPixmap.fromImage(self.levels[i])
+            self._pixmaps[i] = pix
+        return pix
+
+
+class PreviewLoadTask(QgsTask):
+    """
+    Carga una previsualización (y su pirámide) en segundo plano.
+
+    on_done(task) se llama en el hilo de la GUI al terminar, con task.pyramid
+    (PreviewPyramid o None) y task.error (mensaje o None).
+    """
+
+    def __init__(self, description: str, path: str, on_done,
+                 max_side: int = PREVIEW_MAX_SIDE, bounds=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.path = path
+        self.max_side = max_side
+        self.bounds = bounds
+        self.pyramid = None
+        self.error = None
+        self._on_done = on_done
+
+    def run(self):
+        try:
+            img = load_preview_image(self.path, self.max_side, self.bounds)
+            if self.isCanceled():
+                return False
+            if img.isNull():
+                self.error = "No se ha podido leer la imagen."
+                return False
+            self.pyramid = PreviewPyramid(img)
+        except Exception as e:
+            self.error = str(e)
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        if self._on_done is not None:
+            self._on_done(self)
+
+
+class PreviewManager(QtCore.QObject):
+    """
+    Muestra previsualizaciones retenidas en QLabels y las reescala al cambiar de tamaño.
+
+    Mientras el QLabel se redimensiona se pinta con FastTransformation desde el nivel
+    de la pirámide más cercano; cuando el tamaño deja de cambiar (antirrebote) se hace
+    una pasada suave que se guarda en caché por tamaño, de modo que volver a un tamaño
+    ya visto (p.ej. maximizar/restaurar o cambiar de pestaña) no vuelve a escalar.
+    """
+
+    def __init__(self, parent=None,
+                 debounce_ms: int = RESIZE_DEBOUNCE_MS,
+                 cache_per_label: int = SCALED_CACHE_PER_LABEL):
+        super().__init__(parent)
+        self.cache_per_label = max(1, int(cache_per_label))
+        self._sources = {}   # QLabel -> PreviewPyramid
+        self._scaled = {}    # QLabel -> OrderedDict[(w, h)] = QPixmap suave
+        self._pending = set()
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(int(debounce_ms))
+        self._timer.timeout.connect(self._smooth_pass)
+
+    def set_source(self, label, source):
+        """Asocia una PreviewPyramid (o QImage) al QLabel y la pinta en suave."""
+        if isinstance(source, QtGui.QImage):
+            source = PreviewPyramid(source)
+        if source is None or source.isNull():
+            self.clear(label)
+            return
+        if label not in self._sources:
+            label.installEventFilter(self)
+        self._sources[label] = source
+        self._scaled[label] = OrderedDict()
+        self._pending.discard(label)
+        self._render(label, smooth=True)
+
+    def source(self, label):
+        return self._sources.get(label)
+
+    def clear(self, label):
+        if self._sources.pop(label, None) is not None:
+            label.removeEventFilter(self)
+        self._scaled.pop(label, None)
+        self._pending.discard(label)
+        label.clear()
+
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Resize and obj in self._sources:
+            # Pasada rápida ahora (si el tamaño no está en caché) y suave al estabilizarse
+            if not self._render(obj, smooth=False):
+                self._pending.add(obj)
+                self._timer.start()
+        return False
+
+    def _smooth_pass(self):
+        pending, self._pending = self._pending, set()
+        for label in pending:
+            if label in self._sources:
+                self._render(label, smooth=True)
+
+    def _render(self, label, smooth: bool) -> bool:
+        """Pinta el QLabel; devuelve True si el resultado es definitivo (suave)."""
+        size = label.size()
+        if size.width() <= 0 or size.height() <= 0:
+            return True
+
+        cache = self._scaled[label]
+        key = (size.width(), size.height())
+        pix = cache.get(key)
+        if pix is not None:
+            cache.move_to_end(key)
+            label.setPixmap(pix)
+            return True
+
+        mode = QtCore.Qt.SmoothTransformation if smooth else QtCore.Qt.FastTransformation
+        pix = self._sources[label].pixmap_for(size).scaled(size, QtCore.Qt.KeepAspectRatio, mode)
+        if smooth:
+            cache[key] = pix
+            while len(cache) > self.cache_per_label:
+                cache.popitem(last=False)
+        label.setPixmap(pix)
+        label.setText("")
+        return smooth
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Vistas de control de calidad de un resultado de matching.
+
+- Residuos: mapa de calor de |residuo| y flechas por GCP sobre la referencia.
+- Cortina (swipe): referencia y flotante remuestreada al marco de la referencia,
+  separadas por una línea vertical que sigue al ratón.
+
+Las imágenes se generan con feature_matcher_cv en un QgsTask y por niveles de
+resolución creciente: el primero (rápido) se muestra enseguida y los siguientes lo
+van sustituyendo.
+"""
+
+import numpy as np
+
+from qgis.PyQt import QtCore, QtGui
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.core import QgsTask
+
+from .calculus import feature_matcher_cv
+
+# (lado máximo de salida, lado de la rejilla del mapa de calor) de cada nivel
+QA_LEVELS = ((512, 16), (1600, 64))
+
+
+def _bgr_to_qimage(arr: np.ndarray) -> QtGui.QImage:
+    arr = np.ascontiguousarray(arr)
+    h, w = arr.shape[:2]
+    return QtGui.QImage(arr.data, w, h, arr.strides[0], QtGui.QImage.Format_BGR888).copy()
+
+
+def _gray_to_qimage(arr: np.ndarray) -> QtGui.QImage:
+    """Gris (HxW) o gris+alfa (HxWx2) a QImage independiente del buffer."""
+    arr = np.ascontiguousarray(arr)
+    h, w = arr.shape[:2]
+    if arr.ndim == 2:
+        return QtGui.QImage(arr.data, w, h, arr.strides[0], QtGui.QImage.Format_Grayscale8).copy()
+    rgba = np.ascontiguousarray(np.dstack([arr[:, :, 0]] * 3 + [arr[:, :, 1]]))
+    return QtGui.QImage(rgba.data, w, h, rgba.strides[0], QtGui.QImage.Format_RGBA8888).copy()
+
+
+class QAViewsTask(QgsTask):
+    """
+    Genera las vistas de residuos y de cortina nivel a nivel (QA_LEVELS).
+
+    levelReady(dict) se emite tras cada nivel con QImages "residuals", "reference" y
+    "warped" (con alfa); la conexión llega a la GUI en cola, así que el diálogo puede
+    mostrarlas directamente.
+    """
+
+    levelReady = pyqtSignal(object)
+
+    def __init__(self, img1: np.ndarray, img2: np.ndarray, H: np.ndarray,
+                 pts_dst: np.ndarray, residuals: np.ndarray, levels=QA_LEVELS):
+        super().__init__("Autogeoreferencer: vistas de residuos", QgsTask.CanCancel)
+        self.img1, self.img2, self.H = img1, img2, np.asarray(H, dtype=np.float64)
+        self.pts_dst = np.asarray(pts_dst, dtype=np.float64).reshape(-1, 2)
+        self.residuals = np.asarray(residuals, dtype=np.float64).reshape(-1, 2)
+        self.levels = levels
+        self.error = None
+
+    def run(self):
+        try:
+            for i, (max_side, grid_side) in enumerate(self.levels):
+                if self.isCanceled():
+                    return False
+                res_vis = feature_matcher_cv.render_residuals(
+                    self.img2, self.pts_dst, self.residuals,
+                    max_side=max_side, grid_side=grid_side,
+                )
+                ref, warped = feature_matcher_cv.render_swipe_layers(
+                    self.img1, self.img2, self.H, max_side=max_side,
+                )
+                self.levelReady.emit({
+                    "level": i,
+                    "residuals": _bgr_to_qimage(res_vis),
+                    "reference": _gray_to_qimage(ref),
+                    "warped": _gray_to_qimage(warped),
+                })
+                self.setProgress(100.0 * (i + 1) / len(self.levels))
+        except Exception as e:
+            self.error = str(e)
+            return False
+        return True
+
+
+class SwipeView(QtCore.QObject):
+    """
+    Cortina sobre un QLabel: a la izquierda de la posición del ratón se ve la flotante
+    remuestreada y a la derecha la referencia. Las capas escaladas al tamaño del
+    QLabel se guardan, así que mover el ratón sólo recompone dos pixmaps.
+    """
+
+    def __init__(self, label, parent=None):
+        super().__init__(parent)
+        self.label = label
+        self._reference = None
+        self._warped = None
+        self._scaled = None   # (tamaño, rect destino, pixmap ref, pixmap flotante)
+        self._split = 0.5     # posición de la cortina (fracción del ancho de la imagen)
+        label.setMouseTracking(True)
+        label.installEventFilter(self)
+
+    def set_layers(self, reference: QtGui.QImage, warped: QtGui.QImage):
+        self._reference, self._warped = reference, warped
+        self._scaled = None
+        self._compose()
+
+    def clear(self):
+        self._reference = self._warped = self._scaled = None
+        self.label.clear()
+
+    def eventFilter(self, obj, event):
+        if obj is self.label and self._reference is not None:
+            etype = event.type()
+            if etype == QtCore.QEvent.Resize:
+                self._scaled = None
+                self._compose()
+            elif etype == QtCore.QEvent.MouseMove:
+                rect = self._target_rect()
+                if rect.width() > 0:
+                    # QLabel centra el pixmap: pasar x del QLabel a x de la imagen
+                    off = (self.label.width() - rect.width()) / 2.0
+                    self._split = min(1.0, max(0.0, (event.pos().x() - off) / rect.width()))
+                    self._compose()
+        return False
+
+    def _target_rect(self) -> QtCore.QRect:
+        size = self._reference.size().scaled(self.label.size(), QtCore.Qt.KeepAspectRatio)
+        return QtCore.QRect(0, 0, size.width(), size.height())
+
+    def _compose(self):
+        if self._reference is None:
+            return
+        size = self.label.size()
+        if size.width() <= 0 or size.height() <= 0:
+            return
+
+        if self._scaled is None or self._scaled[0] != size:
+            rect = self._target_rect()
+            ref = QtGui.QPixmap.fromImage(self._reference.scaled(
+                rect.size(), QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation))
+            warped = QtGui.QPixmap.fromImage(self._warped.scaled(
+                rect.size(), QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation))
+            self._scaled = (size, rect, ref, warped)
+        _, rect, ref, warped = self._scaled
+
+        x = int(round(self._split * rect.width()))
+        out = QtGui.QPixmap(rect.size())
+        out.fill(QtCore.Qt.black)
+        painter = QtGui.QPainter(out)
+        painter.drawPixmap(0, 0, ref)
+        painter.drawPixmap(QtCore.QRect(0, 0, x, rect.height()), warped,
+                           QtCore.QRect(0, 0, x, rect.height()))
+        painter.setPen(QtGui.QPen(QtGui.QColor(255, 200, 0), 2))
+        painter.drawLine(x, 0, x, rect.height())
+        painter.end()
+        self.label.setPixmap(out)
+        self.label.setText("")
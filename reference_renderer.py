@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Renderizado de referencias desde el mapa de QGIS.
+
+Renderiza una extensión (AOI) del canvas a una resolución en terreno dada, por
+teselas en paralelo (QgsMapRendererParallelJob), y vuelca el resultado a un
+GeoTIFF teselado con geotransformación y CRS, en lugar de un PNG de tamaño fijo.
+
+RenderCache guarda en disco los renders por (extensión, CRS, resolución, capas y
+estilos) para no volver a pedir teselas XYZ/WMS al repetir la misma AOI.
+"""
+
+import hashlib
+import json
+import math
+import os
+import time
+
+import numpy as np
+from osgeo import gdal, osr
+
+from qgis.PyQt import QtCore, QtGui
+from qgis.core import QgsMapLayerStyle, QgsMapRendererParallelJob, QgsMapSettings, QgsRectangle
+
+# Lado máximo del raster de salida (px) y tamaño de tesela de render
+MAX_OUTPUT_SIDE = 16384
+RENDER_TILE_SIZE = 2048
+# Nº de trabajos de render simultáneos (cada uno ya usa varios hilos por capa)
+MAX_PARALLEL_JOBS = 4
+# Lado máximo de la previsualización que se compone durante el render
+PREVIEW_MAX_SIDE = 1024
+# Tamaño máximo por defecto de la caché de renders en disco
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def output_size_for_extent(rect: QgsRectangle, target_res: float, max_side: int = MAX_OUTPUT_SIDE):
+    """
+    Tamaño de salida (ancho, alto) y resolución efectiva (unidades de mapa/px) para
+    renderizar 'rect' a 'target_res'. Si excede max_side se engrosa la resolución.
+    """
+    width, height = rect.width(), rect.height()
+    if width <= 0 or height <= 0:
+        raise ValueError("Extensión vacía.")
+    res = float(target_res) if target_res and target_res > 0 else max(width, height) / 512.0
+    res = max(res, max(width, height) / float(max_side))
+    return max(1, int(math.ceil(width / res))), max(1, int(math.ceil(height / res))), res
+
+
+def snap_extent(rect: QgsRectangle, res: float) -> QgsRectangle:
+    """Amplía rect hasta la rejilla de 'res' unidades/px (AOIs casi iguales comparten render)."""
+    return QgsRectangle(math.floor(rect.xMinimum() / res) * res,
+                        math.floor(rect.yMinimum() / res) * res,
+                        math.ceil(rect.xMaximum() / res) * res,
+                        math.ceil(rect.yMaximum() / res) * res)
+
+
+def _qimage_to_rgba(img: QtGui.QImage) -> np.ndarray:
+    """Copia un QImage a un array HxWx4 (RGBA, uint8)."""
+    img = img.convertToFormat(QtGui.QImage.Format_RGBA8888)
+    w, h = img.width(), img.height()
+    ptr = img.constBits()
+    ptr.setsize(img.bytesPerLine() * h)
+    arr = np.frombuffer(ptr, dtype=np.uint8).reshape(h, img.bytesPerLine())
+    return arr[:, :w * 4].reshape(h, w, 4).copy()
+
+
+def _tile_settings(base: QgsMapSettings, extent: QgsRectangle, w: int, h: int) -> QgsMapSettings:
+    ms = QgsMapSettings(base)
+    ms.setExtent(extent)
+    ms.setOutputSize(QtCore.QSize(w, h))
+    ms.setBackgroundColor(QtGui.QColor(0, 0, 0, 0))
+    return ms
+
+
+def render_extent_to_geotiff(map_settings: QgsMapSettings,
+                             rect: QgsRectangle,
+                             out_path: str,
+                             target_res: float,
+                             tile_size: int = RENDER_TILE_SIZE,
+                             max_side: int = MAX_OUTPUT_SIDE,
+                             max_parallel: int = MAX_PARALLEL_JOBS) -> dict:
+    """
+    Renderiza 'rect' con las capas/estilo de map_settings a un GeoTIFF RGBA teselado.
+
+    El raster se alinea a una rejilla exacta de 'res' unidades/px anclada en la
+    esquina superior izquierda de rect; cada tesela se renderiza con su propio
+    QgsMapRendererParallelJob y se escribe en cuanto termina (memoria acotada a
+    max_parallel teselas).
+
+    Devuelve dict con: path, width, height, res, geotransform (GDAL), crs_wkt y
+    preview (QImage reducido, lado <= PREVIEW_MAX_SIDE).
+    """
+    width, height, res = output_size_for_extent(rect, target_res, max_side)
+    x0, y0 = rect.xMinimum(), rect.yMaximum()
+    geotransform = (x0, res, 0.0, y0, 0.0, -res)
+    crs_wkt = map_settings.destinationCrs().toWkt()
+
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(out_path, width, height, 4, gdal.GDT_Byte,
+                       options=["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256",
+                                "COMPRESS=DEFLATE", "PHOTOMETRIC=RGB", "ALPHA=YES",
+                                "BIGTIFF=IF_SAFER"])
+    if ds is None:
+        raise IOError(f"No se pudo crear el GeoTIFF: {out_path}")
+    ds.SetGeoTransform(geotransform)
+    srs = osr.SpatialReference()
+    if crs_wkt and srs.ImportFromWkt(crs_wkt) == 0:
+        ds.SetProjection(srs.ExportToWkt())
+
+    pscale = min(1.0, PREVIEW_MAX_SIDE / float(max(width, height)))
+    preview = QtGui.QImage(max(1, int(width * pscale)), max(1, int(height * pscale)),
+                           QtGui.QImage.Format_ARGB32_Premultiplied)
+    preview.fill(QtCore.Qt.transparent)
+    painter = QtGui.QPainter(preview)
+    painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+
+    tiles = []
+    for row0 in range(0, height, tile_size):
+        for col0 in range(0, width, tile_size):
+            tw, th = min(tile_size, width - col0), min(tile_size, height - row0)
+            ext = QgsRectangle(x0 + col0 * res, y0 - (row0 + th) * res,
+                               x0 + (col0 + tw) * res, y0 - row0 * res)
+            tiles.append((col0, row0, tw, th, ext))
+
+    try:
+        for i in range(0, len(tiles), max(1, max_parallel)):
+            batch = tiles[i:i + max(1, max_parallel)]
+            jobs = []
+            for col0, row0, tw, th, ext in batch:
+                job = QgsMapRendererParallelJob(_tile_settings(map_settings, ext, tw, th))
+                job.start()
+                jobs.append(job)
+            for (col0, row0, tw, th, _), job in zip(batch, jobs):
+                job.waitForFinished()
+                img = job.renderedImage()
+                rgba = _qimage_to_rgba(img)
+                for b in range(4):
+                    ds.GetRasterBand(b + 1).WriteArray(rgba[:, :, b], col0, row0)
+                painter.drawImage(QtCore.QRectF(col0 * pscale, row0 * pscale, tw * pscale, th * pscale), img)
+    finally:
+        painter.end()
+        ds.FlushCache()
+        ds = None
+
+    return {
+        "path": out_path,
+        "width": width,
+        "height": height,
+        "res": res,
+        "geotransform": geotransform,
+        "crs_wkt": crs_wkt,
+        "preview": preview,
+    }
+
+
+class RenderCache:
+    """
+    Caché en disco de referencias renderizadas, con expulsión LRU por tamaño.
+
+    La clave combina extensión, CRS, resolución de salida y, por cada capa visible,
+    id + fuente + hash del estilo, de modo que cambiar la simbología invalida el render.
+    El índice (index.json) persiste entre sesiones de QGIS.
+    """
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, cache_dir: str, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    # --- índice ---
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, self.INDEX_NAME)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Descartar entradas cuyo fichero ya no existe
+        return {k: v for k, v in index.items() if os.path.exists(v.get("path", ""))}
+
+    def _save_index(self):
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self._index_path())
+
+    # --- claves ---
+    @staticmethod
+    def _layer_signature(layer) -> str:
+        style = QgsMapLayerStyle()
+        style.readFromLayer(layer)
+        style_hash = hashlib.sha1(style.xmlData().encode("utf-8")).hexdigest()
+        return f"{layer.id()}|{layer.source()}|{style_hash}"
+
+    @classmethod
+    def make_key(cls, map_settings: QgsMapSettings, rect: QgsRectangle, res: float) -> str:
+        crs = map_settings.destinationCrs()
+        parts = [
+            "{:.9f},{:.9f},{:.9f},{:.9f}".format(
+                rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum()),
+            crs.authid() or crs.toWkt(),
+            "{:.9f}".format(res),
+        ]
+        parts.extend(cls._layer_signature(lyr) for lyr in map_settings.layers())
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.tif")
+
+    # --- acceso ---
+    def get(self, key: str):
+        """Devuelve el dict de render_extent_to_geotiff (con preview) o None."""
+        entry = self._index.get(key)
+        if entry is None or not os.path.exists(entry["path"]):
+            return None
+        entry["last_used"] = time.time()
+        self._save_index()
+        preview = QtGui.QImage(entry.get("preview_path", ""))
+        return {**entry, "geotransform": tuple(entry["geotransform"]), "preview": preview}
+
+    def put(self, key: str, result: dict) -> dict:
+        """Registra un render (ya escrito en path_for(key)) y aplica la expulsión LRU."""
+        preview_path = os.path.join(self.cache_dir, f"{key}.png")
+        result["preview"].save(preview_path, "PNG")
+        size = os.path.getsize(result["path"]) + os.path.getsize(preview_path)
+        self._index[key] = {
+            "path": result["path"],
+            "preview_path": preview_path,
+            "width": result["width"],
+            "height": result["height"],
+            "res": result["res"],
+            "geotransform": list(result["geotransform"]),
+            "crs_wkt": result["crs_wkt"],
+            "size_bytes": size,
+            "last_used": time.time(),
+        }
+        self._evict(keep=key)
+        self._save_index()
+        return result
+
+    def _evict(self, keep: str = None):
+        total = sum(e.get("size_bytes", 0) for e in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda kv: kv[1].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for p in (entry.get("path"), entry.get("preview_path")):
+                try:
+                    if p:
+                        os.remove(p)
+                except OSError:
+                    pass
+            total -= entry.get("size_bytes", 0)
+            del self._index[key]
+
+
+def render_extent_cached(cache: RenderCache,
+                         map_settings: QgsMapSettings,
+                         rect: QgsRectangle,
+                         target_res: float,
+                         max_side: int = MAX_OUTPUT_SIDE) -> dict:
+    """
+    Igual que render_extent_to_geotiff pero consultando/llenando la caché. La extensión
+    se ajusta a la rejilla de la resolución efectiva antes de calcular la clave.
+    Añade 'cached': True/False al resultado.
+    """
+    _, _, res = output_size_for_extent(rect, target_res, max_side)
+    rect = snap_extent(rect, res)
+    key = cache.make_key(map_settings, rect, res)
+    hit = cache.get(key)
+    if hit is not None:
+        return {**hit, "cached": True}
+    result = render_extent_to_geotiff(map_settings, rect, cache.path_for(key), res, max_side=max_side)
+    cache.put(key, result)
+    return {**result, "cached": False}
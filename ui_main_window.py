@@ -39,9 +39,12 @@ class Ui_MainWindow(object):
         self.btnBrowseFloating = QtWidgets.QPushButton(self.groupFloating)
         self.btnBrowseFloating.setObjectName("btnBrowseFloating")
         self.grid_floating.addWidget(self.btnBrowseFloating, 0, 1, 1, 1)
+        self.btnBatch = QtWidgets.QPushButton(self.groupFloating)
+        self.btnBatch.setObjectName("btnBatch")
+        self.grid_floating.addWidget(self.btnBatch, 0, 2, 1, 1)
         self.labelFloatingInfo = QtWidgets.QLabel(self.groupFloating)
         self.labelFloatingInfo.setObjectName("labelFloatingInfo")
-        self.grid_floating.addWidget(self.labelFloatingInfo, 1, 0, 1, 2)
+        self.grid_floating.addWidget(self.labelFloatingInfo, 1, 0, 1, 3)
         self.verticalLayout_sources.addWidget(self.groupFloating)
         self.groupReference = QtWidgets.QGroupBox(self.pageSources)
         self.groupReference.setObjectName("groupReference")
@@ -320,6 +323,8 @@ class Ui_MainWindow(object):
         self.groupFloating.setTitle(_translate("MainWindow", "Imagen a georreferenciar (flotante)"))
         self.editFloatingPath.setPlaceholderText(_translate("MainWindow", "Ruta de la imagen (tif, jpg, png...)"))
         self.btnBrowseFloating.setText(_translate("MainWindow", "Examinar..."))
+        self.btnBatch.setToolTip(_translate("MainWindow", "Procesar varias imágenes flotantes contra la referencia actual"))
+        self.btnBatch.setText(_translate("MainWindow", "Lote..."))
         self.labelFloatingInfo.setText(_translate("MainWindow", "No hay imagen cargada"))
         self.groupReference.setTitle(_translate("MainWindow", "Capa de referencia (georreferenciada)"))
         self.editReferencePath.setPlaceholderText(_translate("MainWindow", "Ruta de la capa (raster/vector)"))